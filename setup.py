@@ -72,7 +72,8 @@ setup(name="rdiff-backup",
                                            library_dirs=libdir_list,
                                            libraries=libname,
                                            extra_link_args=lflags_arg)],
-	  scripts = ['rdiff-backup', 'rdiff-backup-statistics'],
+	  scripts = ['rdiff-backup', 'rdiff-backup-statistics',
+				 'rdiff-backup-journal'],
 	  data_files = [('share/man/man1', ['rdiff-backup.1', 'rdiff-backup-statistics.1']),
 					('share/doc/rdiff-backup-%s' % (version_string,),
 					 ['CHANGELOG', 'COPYING', 'README.md', 'FAQ-body.html'])],
@@ -22,9 +22,47 @@
  * ----------------------------------------------------------------------- */
 
 #include <Python.h>
+#include <pythread.h>
 #include <librsync.h>
+#ifndef _WIN32
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#define USE_MMAP
+#else
+#include <io.h>
+#endif
 #define RS_JOB_BLOCKSIZE 65536
 
+/* The cycle methods below release the GIL while librsync works, so
+   files can be processed in several threads at once.  Each maker
+   object has its own lock, taken while its job runs, so that a maker
+   shared between threads is only used by one of them at a time. */
+static int
+_librsync_alloc_lock(PyThread_type_lock *lock)
+{
+  *lock = PyThread_allocate_lock();
+  if (*lock == NULL) {
+	PyErr_NoMemory();
+	return -1;
+  }
+  return 0;
+}
+
+/* Run one step of job with the GIL released and lock held */
+static rs_result
+_librsync_job_iter(rs_job_t *job, rs_buffers_t *buf, PyThread_type_lock lock)
+{
+  rs_result result;
+
+  Py_BEGIN_ALLOW_THREADS
+  PyThread_acquire_lock(lock, WAIT_LOCK);
+  result = rs_job_iter(job, buf);
+  PyThread_release_lock(lock);
+  Py_END_ALLOW_THREADS
+  return result;
+}
+
 static PyObject *librsyncError;
 
 /* Sets python error string from result */
@@ -44,6 +82,7 @@ typedef struct {
   PyObject_HEAD
   PyObject *x_attr;
   rs_job_t *sig_job;
+  PyThread_type_lock lock;
 } _librsync_SigMakerObject;
 
 static PyObject*
@@ -58,6 +97,10 @@ _librsync_new_sigmaker(PyObject* self, PyObject* args)
   sm = PyObject_New(_librsync_SigMakerObject, &_librsync_SigMakerType);
   if (sm == NULL) return NULL;
   sm->x_attr = NULL;
+  if (_librsync_alloc_lock(&sm->lock) < 0) {
+	PyObject_Del(sm);
+	return NULL;
+  }
 
 #ifdef RS_DEFAULT_STRONG_LEN
   sm->sig_job = rs_sig_begin((size_t)blocklen,
@@ -73,6 +116,7 @@ static void
 _librsync_sigmaker_dealloc(PyObject* self)
 {
   rs_job_free(((_librsync_SigMakerObject *)self)->sig_job);
+  PyThread_free_lock(((_librsync_SigMakerObject *)self)->lock);
   PyObject_Del(self);
 }
 
@@ -98,7 +142,7 @@ _librsync_sigmaker_cycle(_librsync_SigMakerObject *self, PyObject *args)
   buf.avail_out = (size_t)RS_JOB_BLOCKSIZE;
   buf.eof_in = (inbuf_length == 0);
 
-  result = rs_job_iter(self->sig_job, &buf);
+  result = _librsync_job_iter(self->sig_job, &buf, self->lock);
 
   if (result != RS_DONE && result != RS_BLOCKED) {
 	_librsync_seterror(result, "signature cycle");
@@ -193,6 +237,7 @@ typedef struct {
   PyObject *x_attr;
   rs_job_t *delta_job;
   rs_signature_t *sig_ptr;
+  PyThread_type_lock lock;
 } _librsync_DeltaMakerObject;
 
 /* Call with the entire signature loaded into one big string */
@@ -213,6 +258,10 @@ _librsync_new_deltamaker(PyObject* self, PyObject* args)
   dm = PyObject_New(_librsync_DeltaMakerObject, &_librsync_DeltaMakerType);
   if (dm == NULL) return NULL;
   dm->x_attr = NULL;
+  if (_librsync_alloc_lock(&dm->lock) < 0) {
+	PyObject_Del(dm);
+	return NULL;
+  }
 
   /* Put signature at sig_ptr and build hash */
   sig_loader = rs_loadsig_begin(&sig_ptr);
@@ -221,13 +270,18 @@ _librsync_new_deltamaker(PyObject* self, PyObject* args)
   buf.next_out = outbuf;
   buf.avail_out = (size_t)RS_JOB_BLOCKSIZE;
   buf.eof_in = 1;
+  Py_BEGIN_ALLOW_THREADS
   result = rs_job_iter(sig_loader, &buf);
+  Py_END_ALLOW_THREADS
   rs_job_free(sig_loader);
   if (result != RS_DONE) {
 	_librsync_seterror(result, "delta rs_signature_t builder");
 	return NULL;
   }
-  if ((result = rs_build_hash_table(sig_ptr)) != RS_DONE) {
+  Py_BEGIN_ALLOW_THREADS
+  result = rs_build_hash_table(sig_ptr);
+  Py_END_ALLOW_THREADS
+  if (result != RS_DONE) {
 	_librsync_seterror(result, "delta rs_build_hash_table");
 	return NULL;
   }
@@ -245,6 +299,7 @@ _librsync_deltamaker_dealloc(PyObject* self)
 
   rs_free_sumset(sig_ptr);
   rs_job_free(dm->delta_job);
+  PyThread_free_lock(dm->lock);
   PyObject_Del(self);
 }
 
@@ -270,7 +325,7 @@ _librsync_deltamaker_cycle(_librsync_DeltaMakerObject *self, PyObject *args)
   buf.avail_out = (size_t)RS_JOB_BLOCKSIZE;
   buf.eof_in = (inbuf_length == 0);
 
-  result = rs_job_iter(self->delta_job, &buf);
+  result = _librsync_job_iter(self->delta_job, &buf, self->lock);
   if (result != RS_DONE && result != RS_BLOCKED) {
 	_librsync_seterror(result, "delta cycle");
 	return NULL;
@@ -365,33 +420,108 @@ typedef struct {
   PyObject *x_attr;
   rs_job_t *patch_job;
   PyObject *basis_file;
+  PyThread_type_lock lock;
+  FILE *cfile;        /* basis read through stdio, or NULL if mapped */
+  char *read_buffer;  /* stdio buffer of cfile, if we allocated it */
+  char *map;          /* basis file mapped into memory, or NULL */
+  size_t map_len;
 } _librsync_PatchMakerObject;
 
-/* Call with the basis file */
+#ifdef USE_MMAP
+/* Copy callback for a mapped basis file.  Instead of copying, point
+   librsync at the mapped data, which is allowed by rs_copy_cb. */
+static rs_result
+_librsync_map_copy_cb(void *opaque, rs_long_t pos, size_t *len, void **buf)
+{
+  _librsync_PatchMakerObject *pm = (_librsync_PatchMakerObject *)opaque;
+
+  if (pos < 0 || (size_t)pos >= pm->map_len) return RS_INPUT_ENDED;
+  if (*len > pm->map_len - (size_t)pos) *len = pm->map_len - (size_t)pos;
+  *buf = pm->map + pos;
+  return RS_DONE;
+}
+
+/* Map the basis file if it is a non-empty regular file.  Return 0 if
+   it was mapped, and -1 if it should be read through stdio instead. */
+static int
+_librsync_map_basis(_librsync_PatchMakerObject *pm, int fd)
+{
+  struct stat st;
+  void *map;
+
+  if (fstat(fd, &st) < 0 || !S_ISREG(st.st_mode) || st.st_size <= 0 ||
+	  (unsigned long long)st.st_size > (size_t)-1)
+	return -1;
+  map = mmap(NULL, (size_t)st.st_size, PROT_READ, MAP_SHARED, fd, 0);
+  if (map == MAP_FAILED) return -1;
+  /* Copy commands of reverse diffs mostly go forward through the file */
+  madvise(map, (size_t)st.st_size, MADV_SEQUENTIAL);
+  pm->map = (char *)map;
+  pm->map_len = (size_t)st.st_size;
+  return 0;
+}
+#endif
+
+/* Call with the basis file, whether it may be mapped into memory, and
+   the size of the read buffer to use otherwise (0 for the default) */
 static PyObject*
 _librsync_new_patchmaker(PyObject* self, PyObject* args)
 {
   _librsync_PatchMakerObject* pm;
   PyObject *python_file;
-  FILE *cfile;
+  int use_mmap = 0;
+  Py_ssize_t read_ahead = 0;
+  int python_fd, cfd;
 
-  if (!PyArg_ParseTuple(args, "O:new_patchmaker", &python_file))
+  if (!PyArg_ParseTuple(args, "O|pn:new_patchmaker", &python_file,
+						&use_mmap, &read_ahead))
 	return NULL;
-  int python_fd = PyObject_AsFileDescriptor(python_file);
+  python_fd = PyObject_AsFileDescriptor(python_file);
   if (python_fd < 0) {
 	PyErr_SetString(PyExc_TypeError, "Need true file object");
 	return NULL;
   }
-  Py_INCREF(python_file);
 
   pm = PyObject_New(_librsync_PatchMakerObject, &_librsync_PatchMakerType);
   if (pm == NULL) return NULL;
   pm->x_attr = NULL;
-
+  pm->patch_job = NULL;
+  pm->cfile = NULL;
+  pm->read_buffer = NULL;
+  pm->map = NULL;
+  pm->map_len = 0;
+  if (_librsync_alloc_lock(&pm->lock) < 0) {
+	PyObject_Del(pm);
+	return NULL;
+  }
+  Py_INCREF(python_file);
   pm->basis_file = python_file;
-  cfile = fdopen(python_fd, "rb"); /* same mode as in the Python code */
-  if (cfile == NULL) return NULL;
-  pm->patch_job = rs_patch_begin(rs_file_copy_cb, cfile);
+
+#ifdef USE_MMAP
+  if (use_mmap && _librsync_map_basis(pm, python_fd) == 0) {
+	pm->patch_job = rs_patch_begin(_librsync_map_copy_cb, pm);
+	return (PyObject*)pm;
+  }
+#endif
+
+  /* Read through our own descriptor, so the stdio file can be closed
+	 without closing the Python file */
+  cfd = dup(python_fd);
+  if (cfd < 0 || (pm->cfile = fdopen(cfd, "rb")) == NULL) {
+	PyErr_SetFromErrno(PyExc_OSError);
+	if (cfd >= 0) close(cfd);
+	Py_DECREF(pm);
+	return NULL;
+  }
+  if (read_ahead > 0) {
+	pm->read_buffer = PyMem_Malloc((size_t)read_ahead);
+	if (pm->read_buffer == NULL) {
+	  Py_DECREF(pm);
+	  return PyErr_NoMemory();
+	}
+	setvbuf(pm->cfile, pm->read_buffer, _IOFBF, (size_t)read_ahead);
+  }
+  pm->patch_job = rs_patch_begin(rs_file_copy_cb, pm->cfile);
 
   return (PyObject*)pm;
 }
@@ -401,7 +531,13 @@ _librsync_patchmaker_dealloc(PyObject* self)
 {
   _librsync_PatchMakerObject *pm = (_librsync_PatchMakerObject *)self;
   Py_DECREF(pm->basis_file);
-  rs_job_free(pm->patch_job);
+  if (pm->patch_job != NULL) rs_job_free(pm->patch_job);
+#ifdef USE_MMAP
+  if (pm->map != NULL) munmap(pm->map, pm->map_len);
+#endif
+  if (pm->cfile != NULL) fclose(pm->cfile);
+  PyMem_Free(pm->read_buffer);
+  PyThread_free_lock(pm->lock);
   PyObject_Del(self);
 }
 
@@ -427,7 +563,7 @@ _librsync_patchmaker_cycle(_librsync_PatchMakerObject *self, PyObject *args)
   buf.avail_out = (size_t)RS_JOB_BLOCKSIZE;
   buf.eof_in = (inbuf_length == 0);
 
-  result = rs_job_iter(self->patch_job, &buf);
+  result = _librsync_job_iter(self->patch_job, &buf, self->lock);
   if (result != RS_DONE && result != RS_BLOCKED) {
 	_librsync_seterror(result, "patch cycle");
 	return NULL;
@@ -139,6 +139,7 @@ class QuotedRPath(rpath.RPath):
 	the index is quoted, not the base.
 
 	"""
+    __slots__ = ("quoted_index", )
 
     def __init__(self, connection, base, index=(), data=None):
         """Make new QuotedRPath"""
@@ -22,6 +22,10 @@
 # The current version of rdiff-backup
 version = "1.3.4"
 
+# Version of the compact RORPath encoding of the rorpcodec module.  It
+# is only used on a connection if both sides support it.
+rorp_codec_version = 1
+
 # If this is set, use this value in seconds as the current time
 # instead of reading it from the clock.
 current_time = None
@@ -39,6 +43,78 @@ conn_bufsize = 393216
 # stuck in buffers when moving over a remote connection.
 pipeline_max_length = 500
 
+# Number of threads used on the destination side to compute the
+# signatures of upcoming changed files while earlier ones are being
+# sent.  With 1 (the default) signatures are computed one at a time as
+# they are read.
+signature_workers = 1
+
+# Like signature_workers, but for the deltas computed on the source
+# side.  delta_prefetch_bytes bounds the total size of the files whose
+# deltas may be held in memory ahead of time.
+delta_workers = 1
+delta_prefetch_bytes = 64 * 1024 * 1024
+
+# Number of threads reading source directories ahead of Select.  With
+# more than 1, up to readahead_width of the next subdirectories of a
+# directory, and their subdirectories down to readahead_depth levels,
+# are listed and stat'ed before the backup gets to them.
+readahead_threads = 1
+readahead_width = 16
+readahead_depth = 2
+
+# If set, the path of a change journal written by rdiff-backup-journal
+# on the source side.  Only the files listed there are read, the
+# others are taken from the mirror metadata of the previous backup.
+change_journal = None
+
+# How the block size of signatures is chosen, see Rdiff.find_blocksize.
+# "size" goes by the length of the file alone, "history" also by how
+# much the file changed in the previous session, according to its
+# file_statistics.
+blocksize_policy = "size"
+
+# If true, changed files which were wholly rewritten in the previous
+# session, or whose names match no_compression_regexp, are sent whole
+# instead of as a delta against a signature of the mirror file.
+guess_whole_files = None
+
+# When patching, librsync reads the basis file wherever the copy
+# commands of the delta point.  If mmap_basis is true, local regular
+# basis files are mapped into memory instead of being read with a
+# seek and read per command.  Otherwise, or if the file can't be
+# mapped, basis_read_ahead is the size of the buffer reads go through,
+# 0 for the stdio default.  A large buffer only helps if the copies go
+# forward through the basis: each scattered copy would read the whole
+# buffer.  Mapping is off by default, because reading a mapped file
+# which was truncated, or whose file system fails, kills the process
+# with SIGBUS.
+mmap_basis = None
+basis_read_ahead = 0
+
+# If true, a file restored through more than one reverse diff is read
+# out once from the mirror file and the composed diffs (see the
+# deltachain module), instead of being written out after each diff.
+compose_deltas = 1
+
+# If true, keep the signatures of large mirror files in
+# rdiff-backup-data/signature_cache, so they don't have to be computed
+# again in the next session.  Only regular files of at least
+# signature_cache_min_size bytes are cached.
+signature_cache = None
+signature_cache_min_size = 1024 * 1024
+
+# Format of newly written mirror_metadata files.  "text" is the
+# traditional gzipped text format, "binary" the indexed format of
+# metadata.BinaryMetadataFile.  Both can always be read.
+metadata_format = "text"
+
+# Codec used to compress new increments, "gzip" or "zstd" (see the
+# compression module), and the number of threads compressing each
+# file.
+compression_codec = "gzip"
+compression_threads = 1
+
 # True if script is running as a server
 server = None
 
@@ -178,6 +254,11 @@ parsable_output = None
 # hardlink information regardless.
 preserve_hardlinks = 1
 
+# If set, at most this many entries of the hard link table are kept in
+# memory on the mirror side, see Hardlink.InodeIndex.  The others are
+# moved to a database in the temp directory.
+hardlink_memory_entries = None
+
 # If this is false, then rdiff-backup will not compress any
 # increments.  Default is to compress based on regexp below.
 compression = 1
@@ -199,6 +280,14 @@ null_separator = None
 # Determines whether or not ssh will be run with the -C switch
 ssh_compression = 1
 
+# If set to "zlib" or "zstd", the frames sent between rdiff-backup
+# processes are compressed with this codec by the connection itself,
+# see SetConnections.init_wire_compression.  Frames holding data which
+# is compressed already, like the files matched by
+# no_compression_regexp, are sent as they are.
+wire_compression = None
+wire_codecs = ["zlib"]  # Codecs supported here, zstd is added if available
+
 # If true, print statistics after successful backup
 print_statistics = None
 
@@ -29,7 +29,13 @@ source side should only transmit inode information.
 
 """
 
+import os
+import sys
 import errno
+import pickle
+import shutil
+import tempfile
+import collections
 from . import Globals, Time, log, robust
 
 # The keys in this dictionary are (inode, devloc) pairs.  The values
@@ -38,22 +44,156 @@ from . import Globals, Time, log, robust
 # the number of files hard linked to this one we may see, and key is
 # either (dest_inode, dest_devloc) or None, and represents the
 # hardlink info of the existing file on the destination.  Finally
-# sha1sum is the hash of the file if it exists, or None.
+# sha1sum is the hash of the file if it exists, or None.  It is an
+# InodeIndex, which works like a dictionary.
 _inode_index = None
 
 
+class InodeIndex:
+    """Dictionary of hard linked inodes, keeping some entries on disk
+
+	This works like a dictionary, but if max_entries is set, at most
+	that many entries are kept in memory.  The least recently used
+	ones are moved to an sqlite database in a temp directory, and
+	back when they are looked up again.  Entries are removed when
+	del_rorp has seen all the links of their inode, wherever they
+	are.  The largest number of entries and an estimate of the memory
+	they took are kept for the statistics.
+
+	"""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self.memory = collections.OrderedDict()
+        self.memory_size = 0  # estimated bytes used by self.memory
+        self.disk_entries = 0
+        self.peak_entries = self.peak_memory_size = 0
+        self.tempdir = self.db = None
+
+    def __len__(self):
+        return len(self.memory) + self.disk_entries
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None: raise KeyError(key)
+        return value
+
+    def __eq__(self, other):
+        return dict(self.items()) == other
+
+    def keys(self):
+        return [key for key, value in self.items()]
+
+    def items(self):
+        """Return list of all (key, value) pairs, in memory or on disk"""
+        pairs = list(self.memory.items())
+        if self.disk_entries:
+            pairs.extend((pickle.loads(key), pickle.loads(value))
+                         for key, value in self.db.execute(
+                             "SELECT key, value FROM inodes"))
+        return pairs
+
+    def get(self, key, default=None):
+        try:
+            value = self.memory[key]
+        except KeyError:
+            value = self._disk_pop(key)
+            if value is None: return default
+            self._memory_add(key, value)
+        else:
+            self.memory.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        try:
+            self.memory_size -= get_entry_size(key, self.memory.pop(key))
+        except KeyError:
+            self._disk_pop(key)
+        self._memory_add(key, value)
+
+    def __delitem__(self, key):
+        try:
+            self.memory_size -= get_entry_size(key, self.memory.pop(key))
+        except KeyError:
+            if self._disk_pop(key) is None: raise
+
+    def _memory_add(self, key, value):
+        """Add entry to memory, moving old entries to disk if too many"""
+        self.memory[key] = value
+        self.memory_size += get_entry_size(key, value)
+        if self.max_entries is not None:
+            while len(self.memory) > self.max_entries:
+                old_key, old_value = self.memory.popitem(last=False)
+                self.memory_size -= get_entry_size(old_key, old_value)
+                self._disk_put(old_key, old_value)
+        self.peak_entries = max(self.peak_entries, len(self))
+        self.peak_memory_size = max(self.peak_memory_size, self.memory_size)
+
+    def _disk_put(self, key, value):
+        """Write entry to the database, creating it if necessary"""
+        if self.db is None:
+            import sqlite3
+            self.tempdir = tempfile.mkdtemp(prefix="rdiff-backup-hardlinks-")
+            self.db = sqlite3.connect(os.path.join(self.tempdir, "inodes"))
+            # The database is thrown away afterwards, so it needn't be safe
+            self.db.execute("PRAGMA journal_mode = OFF")
+            self.db.execute("PRAGMA synchronous = OFF")
+            self.db.execute(
+                "CREATE TABLE inodes (key BLOB PRIMARY KEY, value BLOB)")
+        self.db.execute("INSERT INTO inodes VALUES (?, ?)",
+                        (pickle.dumps(key, 4), pickle.dumps(value, 4)))
+        self.disk_entries += 1
+
+    def _disk_pop(self, key):
+        """Remove entry from the database and return its value, or None"""
+        if not self.disk_entries: return None
+        pickled_key = pickle.dumps(key, 4)
+        row = self.db.execute("SELECT value FROM inodes WHERE key = ?",
+                              (pickled_key, )).fetchone()
+        if row is None: return None
+        self.db.execute("DELETE FROM inodes WHERE key = ?", (pickled_key, ))
+        self.disk_entries -= 1
+        return pickle.loads(row[0])
+
+    def close(self):
+        """Delete the database, if one was made"""
+        if self.db is None: return
+        self.db.close()
+        shutil.rmtree(self.tempdir)
+        self.db = self.tempdir = None
+
+
+def get_entry_size(key, value):
+    """Return rough number of bytes used by an _inode_index entry"""
+    index = value[0]
+    return (sys.getsizeof(key) + sum(map(sys.getsizeof, key)) +
+            sys.getsizeof(value) + sys.getsizeof(index) +
+            sum(map(sys.getsizeof, index)) + 100)  # 100 for the dict slot
+
+
 def initialize_dictionaries():
     """Set all the hard link dictionaries to empty"""
     global _inode_index
-    _inode_index = {}
+    if _inode_index is not None: _inode_index.close()
+    _inode_index = InodeIndex(Globals.hardlink_memory_entries)
 
 
 def clear_dictionaries():
     """Delete all dictionaries"""
     global _inode_index
+    if _inode_index is not None: _inode_index.close()
     _inode_index = None
 
 
+def get_table_stats():
+    """Return pair (most entries, most bytes in memory) of the table"""
+    if _inode_index is None: return (0, 0)
+    return (_inode_index.peak_entries, _inode_index.peak_memory_size)
+
+
 def get_inode_key(rorp):
 
 
@@ -18,11 +18,21 @@
 # USA
 """Start (and end) here - read arguments, set global settings, etc."""
 
+import time
 
 from .log import Log, LoggerError, ErrorLog
-from . import Globals, Time, SetConnections, selection, robust, rpath, \
-    manage, backup, connection, restore, FilenameMapping, \
-    Security, Hardlink, regress, C, fs_abilities, statistics, compare
+from . import Globals, Time, SetConnections, robust, rpath, connection, \
+    FilenameMapping, Security, C, statistics, lazyimport
+
+# Most of these are only needed by some of the actions
+selection = lazyimport.lazy_import("selection")
+manage = lazyimport.lazy_import("manage")
+backup = lazyimport.lazy_import("backup")
+restore = lazyimport.lazy_import("restore")
+Hardlink = lazyimport.lazy_import("Hardlink")
+regress = lazyimport.lazy_import("regress")
+fs_abilities = lazyimport.lazy_import("fs_abilities")
+compare = lazyimport.lazy_import("compare")
 
 action = None
 create_full_path = None
@@ -126,6 +136,28 @@ def Main(arglist):
 
 
 def Backup(rpin, rpout):
+    """Backup, possibly incrementally, src_path to dest_path."""
+    global incdir
+    SetConnections.BackupInitConnections(rpin.conn, rpout.conn)
+    backup_check_dirs(rpin, rpout)
+    backup_set_rbdir(rpin, rpout)
+    rpout.conn.fs_abilities.backup_set_globals(rpin, force)
+    if Globals.chars_to_quote:
+        rpout = backup_quoted_rpaths(rpout)
+    init_user_group_mapping(rpout.conn)
+    backup_final_init(rpout)
+    backup_set_select(rpin)
+    backup_warn_if_infinite_regress(rpin, rpout)
+    if prevtime:
+        Time.setprevtime(prevtime)
+        backup_set_change_hints(rpin, rpout)
+        rpout.conn.Main.backup_touch_curmirror_local(rpin, rpout)
+        backup.Mirror_and_increment(rpin, rpout, incdir)
+        rpout.conn.Main.backup_remove_curmirror_local()
+    else:
+        backup.Mirror(rpin, rpout)
+        rpout.conn.Main.backup_touch_curmirror_local(rpin, rpout)
+    rpout.conn.Main.backup_close_statistics(time.time())
 
 
 def backup_quoted_rpaths(rpout):
@@ -146,6 +178,19 @@ def backup_set_select(rpin):
                                                     *select_files)
 
 
+def backup_set_change_hints(rpin, rpout):
+    """Only read source files in the change journal, if one is given
+
+	Must be called after backup_set_select and once Time.prevtime is
+	set, as it gets the metadata of the previous backup.
+
+	"""
+    if not Globals.change_journal: return
+    mirror_rorps = rpout.conn.backup.DestinationStruct.get_previous_rorps()
+    rpin.conn.backup.SourceStruct.set_change_hints(Globals.change_journal,
+                                                   mirror_rorps)
+
+
 def backup_check_dirs(rpin, rpout):
 
 
@@ -306,7 +351,9 @@ def backup_close_statistics(end_time):
 	system). Use at end of session.
 
 	"""
-
+    if Globals.print_statistics: statistics.print_active_stats(end_time)
+    if Globals.file_statistics: statistics.FileStats.close()
+    statistics.write_active_statfileobj(end_time)
 
 
 def Restore(src_rp, dest_rp, restore_as_of=None):
@@ -19,22 +19,131 @@
 """Invoke rdiff utility to make signatures, deltas, or patch"""
 
 import os
-from . import Globals, log, TempFile, rpath, hash, librsync
+import re
+from . import Globals, log, TempFile, rpath, hash, librsync, metadata
 
+# How each file changed in the previous session, by index, if
+# Globals.blocksize_policy is "history".  See load_change_history.
+_change_history = None
+SMALL_CHANGE, REWRITTEN, WHOLLY_REWRITTEN = 1, 2, 3
+# A file changed a little if its increment was at most small_change_ratio
+# of its size, was rewritten if the increment was at least rewrite_ratio
+# of its size, and wholly rewritten if at least whole_file_ratio.
+small_change_ratio = 0.01
+rewrite_ratio = 0.5
+whole_file_ratio = 0.9
+# Rewritten files get blocks big enough for about this many blocks,
+# but no bigger than max_blocksize.
+rewritten_blocks = 64
+max_blocksize = 1024 * 1024
 
 
+def get_signature(rp, blocksize=None):
+    """Take signature of rpin file and return in file object"""
+    if not blocksize: blocksize = find_blocksize(rp.getsize(), rp.index)
+    log.Log(
+        "Getting signature of %s with blocksize %s" % (rp.get_safepath(),
+                                                        blocksize), 7)
+    return librsync.SigFile(rp.open("rb"), blocksize)
+
 
-def find_blocksize(file_len):
+def find_blocksize(file_len, index=None):
     """Return a reasonable block size to use on files of length file_len
 
 	If the block size is too big, deltas will be bigger than is
 	necessary.  If the block size is too small, making deltas and
 	patching can take a really long time.
 
+	The square root of the length works well when nothing is known
+	about the file.  With a change history, files which changed a
+	little get smaller blocks, for smaller deltas, and files which
+	were rewritten get large blocks, as their signature is of no use
+	anyway.
+
 	"""
     if file_len < 4096: return 64  # set minimum of 64 bytes
-    else:  # Use square root, rounding to nearest 16
-        return int(pow(file_len, 0.5) / 16) * 16
+    # Use square root, rounding to nearest 16
+    blocksize = int(pow(file_len, 0.5) / 16) * 16
+    if _change_history and index is not None:
+        change = _change_history.get(index)
+        if change == SMALL_CHANGE:
+            blocksize = max(blocksize // 64 * 16, 64)
+        elif change == REWRITTEN or change == WHOLLY_REWRITTEN:
+            blocksize = max(blocksize, file_len // rewritten_blocks // 16 * 16)
+            blocksize = min(blocksize, max_blocksize)
+    return blocksize
+
+
+def load_change_history(session_time):
+    """Read how each file changed in the session at session_time
+
+	The sizes of the files and of their increments come from the
+	file_statistics file of that session in Globals.rbdir.  Only the
+	files which changed a little or were rewritten are kept.  Without
+	the file, find_blocksize goes by file length alone.
+
+	"""
+    global _change_history
+    _change_history = {}
+    for filename in Globals.rbdir.listdir():
+        rp = Globals.rbdir.append(filename)
+        if (rp.isincfile() and rp.getincbase_bname() == b"file_statistics"
+                and rp.getinctime() == session_time):
+            break
+    else:
+        log.Log(
+            "No file statistics for %s, choosing block sizes by file "
+            "length" % (session_time, ), 4)
+        return
+
+    line_re = re.compile(b"^(.*) 1 ([0-9]+) (?:[0-9]+|NA) ([0-9]+)$", re.S)
+    separator = Globals.null_separator and b"\0" or b"\n"
+    fp = rp.open("rb", rp.isinccompressed())
+    rest = b""
+    while 1:
+        buf = fp.read(Globals.blocksize)
+        lines = (rest + buf).split(separator)
+        rest = buf and lines.pop() or b""
+        for line in lines:
+            match = line_re.match(line)
+            if not match: continue
+            source_size, inc_size = int(match.group(2)), int(match.group(3))
+            if not source_size: continue
+            if inc_size <= small_change_ratio * source_size:
+                change = SMALL_CHANGE
+            elif inc_size >= whole_file_ratio * source_size:
+                change = WHOLLY_REWRITTEN
+            elif inc_size >= rewrite_ratio * source_size:
+                change = REWRITTEN
+            else:
+                continue
+            filename = match.group(1)
+            if not Globals.null_separator:
+                index = metadata.quoted_filename_to_index(filename)
+            elif filename == b".": index = ()
+            else: index = tuple(filename.split(b"/"))
+            _change_history[index] = change
+        if not buf: break
+    assert not fp.close()
+    log.Log(
+        "Read change history of %d files from %s" %
+        (len(_change_history), rp.get_safepath()), 5)
+
+
+def skip_signature(mirror_rp):
+    """True if the changed file mirror_rp is better sent whole
+
+	That is if the file was wholly rewritten in the previous session,
+	or if its name matches no_compression_regexp, like compressed
+	archives, which rarely have blocks in common with the old version.
+	Computing, sending and using a signature is then mostly wasted.
+
+	"""
+    if (_change_history and
+            _change_history.get(mirror_rp.index) == WHOLLY_REWRITTEN):
+        return True
+    return bool(Globals.no_compression_regexp
+                and Globals.no_compression_regexp.match(mirror_rp.path))
 
 
 def get_delta_sigfileobj(sig_fileobj, rp_new):
@@ -70,9 +179,15 @@ def write_delta(basis, new, delta, compress=None):
     delta.write_from_fileobj(deltafile, compress)
 
 
+def get_patched_fp(basis_fp, delta_fp):
+    """Return file object of basis_fp patched with delta_fp"""
+    return librsync.PatchedFile(basis_fp, delta_fp, Globals.mmap_basis,
+                                Globals.basis_read_ahead)
+
+
 def write_patched_fp(basis_fp, delta_fp, out_fp):
     """Write patched file to out_fp given input fps.  Closes input files"""
-    rpath.copyfileobj(librsync.PatchedFile(basis_fp, delta_fp), out_fp)
+    rpath.copyfileobj(get_patched_fp(basis_fp, delta_fp), out_fp)
     assert not basis_fp.close() and not delta_fp.close()
 
 
@@ -84,15 +199,71 @@ def write_via_tempfile(fp, rp):
     return retval
 
 
-def patch_local(rp_basis, rp_delta, outrp=None, delta_compressed=None):
+def patch_local(rp_basis,
+                rp_delta,
+                outrp=None,
+                delta_compressed=None,
+                sig_gen=None):
     """Patch routine that must be run locally, writes to outrp
 
 	This should be run local to rp_basis because it needs to be a real
 	file (librsync may need to seek around in it).  If outrp is None,
-	patch rp_basis instead.
+	patch rp_basis instead.  If sig_gen, a librsync.SigGenerator, is
+	given, the patched data is passed to it too, see SigWrapper.
 
 	The return value is the close value of the delta, so it can be
 	used to produce hashes.
 
 	"""
+    assert rp_delta.conn is Globals.local_connection
+    deltafile = rp_delta.open("rb", delta_compressed)
+    patchfile = get_patched_fp(rp_basis.open("rb"), deltafile)
+    if sig_gen: patchfile = SigWrapper(patchfile, sig_gen)
+    if outrp:
+        return outrp.write_from_fileobj(patchfile)
+    else:
+        return write_via_tempfile(patchfile, rp_basis)
+
+
+def get_sig_generator(size, index=None):
+    """Return SigGenerator making the signature get_signature would make
+
+	size and index are those of the file whose data will be passed
+	to it, they determine the block size.
+
+	"""
+    return librsync.SigGenerator(find_blocksize(size, index))
+
+
+class SigWrapper:
+    """Wrapper around a file object, passing what is read to sig_gen
+
+	This way the signature of a file can be made while it is written,
+	instead of reading it again afterwards.  Like hash.FileWrapper,
+	only use this with files that will be read through in a single
+	pass and then closed.
+
+	"""
+
+    def __init__(self, fileobj, sig_gen):
+        self.fileobj = fileobj
+        self.sig_gen = sig_gen
+
+    def read(self, length=-1):
+        buf = self.fileobj.read(length)
+        self.sig_gen.update(buf)
+        return buf
+
+    def readinto(self, buf):
+        """Read into writable buffer buf, return number of bytes read"""
+        if hasattr(self.fileobj, "readinto"):
+            length = self.fileobj.readinto(buf)
+        else:
+            data = self.fileobj.read(len(buf))
+            length = len(data)
+            buf[:length] = data
+        self.sig_gen.update(bytes(memoryview(buf)[:length]))
+        return length
 
+    def close(self):
+        return self.fileobj.close()
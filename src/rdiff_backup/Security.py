@@ -119,6 +119,7 @@ def set_allowed_requests(sec_level):
             "restore.MirrorStruct.get_diffs", "restore.ListChangedSince",
             "restore.ListAtTime", "backup.SourceStruct.get_source_select",
             "backup.SourceStruct.set_source_select",
+            "backup.SourceStruct.set_change_hints",
             "backup.SourceStruct.get_diffs",
             "compare.RepoSide.init_and_get_iter",
             "compare.RepoSide.close_rf_cache", "compare.RepoSide.attach_files",
@@ -132,6 +133,8 @@ def set_allowed_requests(sec_level):
             "log.ErrorLog.open", "log.ErrorLog.isopen", "log.ErrorLog.close",
             "backup.DestinationStruct.set_rorp_cache",
             "backup.DestinationStruct.get_sigs",
+            "backup.DestinationStruct.get_previous_rorps",
+            "Rdiff.load_change_history",
             "backup.DestinationStruct.patch_and_increment",
             "Main.backup_touch_curmirror_local",
             "Main.backup_remove_curmirror_local",
@@ -153,7 +156,10 @@ def set_allowed_requests(sec_level):
         ])
     if Globals.server:
         l.extend([
-            "SetConnections.init_connection_remote", "log.Log.setverbosity",
+            "SetConnections.init_connection_remote",
+            "SetConnections.init_rorp_codec_remote",
+            "SetConnections.init_wire_compression_remote",
+            "log.Log.setverbosity",
             "log.Log.setterm_verbosity", "Time.setprevtime_local",
             "Globals.postset_regexp_local",
             "backup.SourceStruct.set_session_info",
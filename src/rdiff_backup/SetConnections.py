@@ -28,7 +28,7 @@ import os
 import sys
 import subprocess
 from .log import Log
-from . import Globals, connection, rpath
+from . import Globals, connection, rpath, compression
 
 # This is the schema that determines how rdiff-backup will open a
 # pipe to the remote system.  If the file is given as A::B, %s will
@@ -167,6 +167,59 @@ def init_connection_settings(conn):
     conn.log.Log.setterm_verbosity(Log.term_verbosity)
     for setting_name in Globals.changed_settings:
         conn.Globals.set(setting_name, Globals.get(setting_name))
+    init_rorp_codec(conn)
+    init_wire_compression(conn)
+
+
+def init_rorp_codec(conn):
+    """Send RORPaths over conn in the compact encoding if it's supported
+
+	Older versions of rdiff-backup don't have the encoding, and don't
+	know Globals.rorp_codec_version either.  Both sides use the lower
+	of the two versions.
+
+	"""
+    try:
+        remote_version = conn.Globals.get('rorp_codec_version')
+    except KeyError:
+        Log("Remote side doesn't support compact RORPath encoding", 5)
+        return
+    codec_version = min(remote_version, Globals.rorp_codec_version)
+    conn.SetConnections.init_rorp_codec_remote(codec_version)
+    conn.rorp_codec_version = codec_version
+
+
+def init_rorp_codec_remote(codec_version):
+    """Run on server side to use the compact encoding back to the client"""
+    Globals.connections[1].rorp_codec_version = codec_version
+
+
+def init_wire_compression(conn):
+    """Compress the frames sent over conn if wire compression is on
+
+	Both sides compress what they send, so the remote side has to know
+	the codec.  Older versions know no codec at all, and the
+	connection is then left uncompressed.
+
+	"""
+    codec = Globals.wire_compression
+    if not codec: return
+    compression.check_wire_codec(codec)
+    try:
+        remote_codecs = conn.Globals.get('wire_codecs')
+    except KeyError:
+        remote_codecs = []
+    if codec not in remote_codecs:
+        Log("Remote side can't decompress %s, connection not compressed" %
+            (codec, ), 2)
+        return
+    conn.SetConnections.init_wire_compression_remote(codec)
+    conn.wire_compression = codec
+
+
+def init_wire_compression_remote(codec):
+    """Run on server side to compress frames back to the client"""
+    Globals.connections[1].wire_compression = codec
 
 
 def init_connection_remote(conn_number):
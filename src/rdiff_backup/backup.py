@@ -30,8 +30,11 @@ def Mirror(src_rpath, dest_rpath):
     DestS = dest_rpath.conn.backup.DestinationStruct
 
     source_rpiter = SourceS.get_source_select()
-    DestS.set_rorp_cache(dest_rpath, source_rpiter, 0)
+    cache_set = dest_rpath.conn.reval_async(
+        "backup.DestinationStruct.set_rorp_cache", dest_rpath, source_rpiter,
+        0)
     dest_sigiter = DestS.get_sigs(dest_rpath)
+    cache_set.result()
     source_diffiter = SourceS.get_diffs(dest_sigiter)
     DestS.patch(dest_rpath, source_diffiter)
 
@@ -44,10 +47,15 @@ def Mirror_and_increment(src_rpath, dest_rpath, inc_rpath):
         4)
     SourceS = src_rpath.conn.backup.SourceStruct
     DestS = dest_rpath.conn.backup.DestinationStruct
+    if Globals.blocksize_policy == "history" or Globals.guess_whole_files:
+        dest_rpath.conn.Rdiff.load_change_history(Time.prevtime)
 
     source_rpiter = SourceS.get_source_select()
-    DestS.set_rorp_cache(dest_rpath, source_rpiter, 1)
+    cache_set = dest_rpath.conn.reval_async(
+        "backup.DestinationStruct.set_rorp_cache", dest_rpath, source_rpiter,
+        1)
     dest_sigiter = DestS.get_sigs(dest_rpath)
+    cache_set.result()
     source_diffiter = SourceS.get_diffs(dest_sigiter)
     DestS.patch_and_increment(dest_rpath, source_diffiter, inc_rpath)
 
@@ -70,6 +78,92 @@ class SourceStruct:
 
 		"""
 
+    @classmethod
+    def set_change_hints(cls, journal, mirror_rorps):
+        """Only read the source files listed in change journal
+
+		Unchanged files are made from mirror_rorps, the metadata of
+		the previous backup, see changejournal.HintedIter.  Must be
+		called after set_source_select and before iterating.
+
+		"""
+        if mirror_rorps is None:
+            log.Log("No mirror metadata found, reading all source files", 2)
+            return
+        select = cls._source_select.iter
+        hints = changejournal.get_hints(journal, select.rpath)
+        if hints is None: return
+        cls._source_select = rorpiter.CacheIndexable(
+            changejournal.HintedIter(select, hints, mirror_rorps),
+            Globals.pipeline_max_length * 3)
+
+    @classmethod
+    def get_diffs(cls, dest_sigiter):
+        """Return diffs of any files with signature in dest_sigiter
+
+		If Globals.delta_workers is more than 1, the deltas of the
+		next few files are computed concurrently, but still yielded
+		in index order.  Globals.delta_prefetch_bytes bounds the
+		amount of data held in memory for this.
+
+		"""
+        diff_iter = cls.generate_diffs(dest_sigiter)
+        if Globals.delta_workers > 1:
+            diff_iter = rorpiter.PrefetchFiles(diff_iter,
+                                               Globals.delta_workers,
+                                               Globals.delta_prefetch_bytes)
+        return diff_iter
+
+    @classmethod
+    def generate_diffs(cls, dest_sigiter):
+        """Generate diffs and flush markers for get_diffs above"""
+        source_rps = cls._source_select
+        error_handler = robust.get_error_handler("ListError")
+
+        def attach_snapshot(diff_rorp, src_rp):
+            """Attach file of snapshot to diff_rorp, w/ error checking"""
+            fileobj = robust.check_common_error(
+                error_handler, rpath.RPath.open, (src_rp, "rb"))
+            if fileobj: diff_rorp.setfile(hash.FileWrapper(fileobj))
+            else: diff_rorp.zero()
+            diff_rorp.set_attached_filetype('snapshot')
+
+        def attach_diff(diff_rorp, src_rp, dest_sig):
+            """Attach file of diff to diff_rorp, w/ error checking"""
+            fileobj = robust.check_common_error(
+                error_handler, Rdiff.get_delta_sigrp_hash, (dest_sig, src_rp))
+            if fileobj:
+                diff_rorp.setfile(fileobj)
+                diff_rorp.set_attached_filetype('diff')
+            else:
+                diff_rorp.zero()
+                diff_rorp.set_attached_filetype('snapshot')
+
+        for dest_sig in dest_sigiter:
+            if dest_sig is iterfile.MiscIterFlushRepeat:
+                yield iterfile.MiscIterFlush  # Flush buffer when get_sigs does
+                continue
+            src_rp = (source_rps.get(dest_sig.index)
+                      or rpath.RORPath(dest_sig.index))
+            diff_rorp = src_rp.getRORPath()
+            if dest_sig.isflaglinked():
+                diff_rorp.flaglinked(dest_sig.get_link_flag())
+            elif src_rp.isreg():
+                reset_perms = False
+                if (Globals.process_uid != 0 and not src_rp.readable()
+                        and src_rp.isowner()):
+                    reset_perms = True
+                    src_rp.chmod(0o400 | src_rp.getperms())
+
+                if dest_sig.isreg(): attach_diff(diff_rorp, src_rp, dest_sig)
+                else: attach_snapshot(diff_rorp, src_rp)
+
+                if reset_perms: src_rp.chmod(src_rp.getperms() & ~0o400)
+            else:
+                dest_sig.close_if_necessary()
+                diff_rorp.set_attached_filetype('snapshot')
+            yield diff_rorp
+
 
 
 class DestinationStruct:
@@ -98,7 +192,100 @@ class DestinationStruct:
 		If we are backing up across a pipe, we must flush the pipeline
 		every so often so it doesn't get congested on destination end.
 
+		If Globals.signature_workers is more than 1, the signatures of
+		the next few changed files are computed concurrently, but
+		still yielded in index order.
+
+		"""
+        sig_iter = cls.generate_sigs(dest_base_rpath)
+        if Globals.signature_workers > 1:
+            sig_iter = rorpiter.PrefetchFiles(sig_iter,
+                                              Globals.signature_workers)
+        return sig_iter
+
+    @classmethod
+    def generate_sigs(cls, dest_base_rpath):
+        """Generate signatures and flush markers for get_sigs above"""
+        flush_threshold = Globals.pipeline_max_length - 2
+        num_rorps_seen = 0
+        for src_rorp, dest_rorp in cls.CCPP:
+            if (Globals.backup_reader is not Globals.backup_writer):
+                num_rorps_seen += 1
+                if (num_rorps_seen > flush_threshold):
+                    num_rorps_seen = 0
+                    yield iterfile.MiscIterFlushRepeat
+            if not (src_rorp and dest_rorp and src_rorp == dest_rorp and
+                    (not Globals.preserve_hardlinks
+                     or Hardlink.rorp_eq(src_rorp, dest_rorp))):
+
+                index = src_rorp and src_rorp.index or dest_rorp.index
+                if (Globals.signature_cache and dest_rorp
+                        and dest_rorp.isreg()
+                        and not (src_rorp and src_rorp.isreg())):
+                    sigcache.remove(index)  # mirror file is going away
+                sig = cls.get_one_sig(dest_base_rpath, index, src_rorp,
+                                      dest_rorp)
+                if sig:
+                    cls.CCPP.flag_changed(index)
+                    yield sig
+
+    @classmethod
+    def get_one_sig(cls, dest_base_rpath, index, src_rorp, dest_rorp):
+        """Return a signature given source and destination rorps
+
+		With Globals.guess_whole_files, regular files which
+		Rdiff.skip_signature expects to be rewritten get a signature
+		rorp without data, so the source sends them whole.
+
 		"""
+        if (Globals.preserve_hardlinks and src_rorp
+                and Hardlink.islinked(src_rorp)):
+            dest_sig = rpath.RORPath(index)
+            dest_sig.flaglinked(Hardlink.get_link_index(src_rorp))
+        elif dest_rorp:
+            dest_sig = dest_rorp.getRORPath()
+            if dest_rorp.isreg():
+                dest_rp = longname.get_mirror_rp(dest_base_rpath, dest_rorp)
+                if (Globals.guess_whole_files and src_rorp
+                        and src_rorp.isreg() and Rdiff.skip_signature(dest_rp)):
+                    cls.CCPP.statfileobj.add_skipped_signature()
+                    return rpath.RORPath(index)
+                sig_fp = cls.get_one_sig_fp(dest_rp)
+                if sig_fp is None: return None
+                dest_sig.setfile(sig_fp)
+        else:
+            dest_sig = rpath.RORPath(index)
+        return dest_sig
+
+    @classmethod
+    def get_one_sig_fp(cls, dest_rp):
+        """Return a signature fp of given index, corresponding to reg file
+
+		If the signature cache is on and holds an up to date signature
+		of dest_rp, it is used instead of reading dest_rp.
+
+		"""
+        if not dest_rp.isreg():
+            log.ErrorLog.write_if_open(
+                "UpdateError", dest_rp,
+                "File changed from regular file before signature")
+            return None
+        if Globals.signature_cache:
+            sig_fp = sigcache.get_signature_fp(dest_rp)
+            if sig_fp: return sig_fp
+        if (Globals.process_uid != 0 and not dest_rp.readable()
+                and dest_rp.isowner()):
+            # This branch can happen with root source and non-root
+            # destination.  Permissions are changed permanently, which
+            # should propogate to the diffs
+            dest_rp.chmod(0o400 | dest_rp.getperms())
+        return Rdiff.get_signature(dest_rp)
+
+    @classmethod
+    def get_previous_rorps(cls):
+        """Return iterator of the mirror metadata at Time.prevtime"""
+        return (metadata.ManagerObj
+                or metadata.SetManager()).GetAtTime(Time.prevtime)
 
 
 
@@ -235,12 +422,56 @@ class PatchITRB(rorpiter.ITRBranch):
 
 	"""
 
+    def patch_to_temp(self, basis_rp, diff_rorp, new):
+        """Patch basis_rp, writing output in new, which doesn't exist yet
 
 		Returns true if able to write new as desired, false if
 		UpdateError or similar gets in the way.
 
 		"""
+        sig_gen = (Globals.signature_cache
+                   and sigcache.get_sig_generator(diff_rorp))
+        if diff_rorp.isflaglinked():
+            self.patch_hardlink_to_temp(diff_rorp, new)
+        elif diff_rorp.get_attached_filetype() == 'snapshot':
+            result = self.patch_snapshot_to_temp(diff_rorp, new, sig_gen)
+            if not result: return 0
+            elif result == 2: return 1  # SpecialFile
+        elif not self.patch_diff_to_temp(basis_rp, diff_rorp, new, sig_gen):
+            return 0
+        if new.lstat():
+            if diff_rorp.isflaglinked():
+                if Globals.eas_write:
+                    # Attributes of a hard linked inode were copied with
+                    # the first of its files, but the EAs must be set
+                    # here so matches_cached_rorp below succeeds
+                    new.data['ea'] = diff_rorp.get_ea()
+            else:
+                rpath.copy_attribs(diff_rorp, new)
+        if not self.matches_cached_rorp(diff_rorp, new): return 0
+        if Globals.signature_cache and new.isreg():
+            self.update_signature_cache(basis_rp, new, sig_gen)
+        return 1
+
+    def update_signature_cache(self, basis_rp, new, sig_gen):
+        """Cache signature of new, which is about to replace basis_rp
+
+		sig_gen is the SigGenerator the data of new was passed to
+		while it was written, or None if it isn't to be cached.
+
+		"""
+
+        def error_handler(exc, *args):
+            log.Log(
+                "Unable to cache signature of %s: %s" %
+                (basis_rp.get_safepath(), exc), 2)
+            return None
 
+        robust.check_common_error(error_handler, sigcache.update,
+                                  (basis_rp.index, new, sig_gen))
+
+    def patch_snapshot_to_temp(self, diff_rorp, new, sig_gen=None):
+        """Write diff_rorp to new, return true if successful
 
 		Returns 1 if normal success, 2 if special file is written,
 		whether or not it is successful.  This is because special
@@ -253,6 +484,11 @@ class PatchITRB(rorpiter.ITRBranch):
             rpath.copy_attribs(diff_rorp, new)
             return 2
 
+        if sig_gen:
+            wrapped_rorp = diff_rorp.getRORPath()
+            wrapped_rorp.setfile(Rdiff.SigWrapper(diff_rorp.open("rb"),
+                                                  sig_gen))
+            diff_rorp = wrapped_rorp
         report = robust.check_common_error(self.error_handler, rpath.copy,
                                            (diff_rorp, new))
         if isinstance(report, hash.Report):
@@ -260,11 +496,16 @@ class PatchITRB(rorpiter.ITRBranch):
             return 1
         return report != 0  # if == 0, error_handler caught something
 
-    def patch_diff_to_temp(self, basis_rp, diff_rorp, new):
-        """Apply diff_rorp to basis_rp, write output in new"""
+    def patch_diff_to_temp(self, basis_rp, diff_rorp, new, sig_gen=None):
+        """Apply diff_rorp to basis_rp, write output in new
+
+		If sig_gen is given, the patched data is passed to it too.
+
+		"""
         assert diff_rorp.get_attached_filetype() == 'diff'
         report = robust.check_common_error(
-            self.error_handler, Rdiff.patch_local, (basis_rp, diff_rorp, new))
+            self.error_handler, Rdiff.patch_local,
+            (basis_rp, diff_rorp, new, None, sig_gen))
         if isinstance(report, hash.Report):
             self.CCPP.update_hash(diff_rorp.index, report.sha1_digest)
             return 1
@@ -296,3 +537,6 @@ class IncrementITRB(PatchITRB):
 	"""
 
 
+from . import Globals, metadata, rorpiter, TempFile, Hardlink, robust, \
+    increment, rpath, log, selection, Time, Rdiff, statistics, iterfile, \
+    hash, longname, sigcache, changejournal
@@ -0,0 +1,494 @@
+# Copyright 2019 The rdiff-backup project
+#
+# This file is part of rdiff-backup.
+#
+# rdiff-backup is free software; you can redistribute it and/or modify
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# rdiff-backup is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rdiff-backup; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+"""Only read the parts of the source directory which changed
+
+Without help, the source side has to list every directory and stat
+every file, just so the destination can find that most of them didn't
+change.  rdiff-backup-journal (see record_main below) watches the
+source directory with inotify and appends the paths which change to a
+journal file.  With --change-journal, the source side takes the
+journal at the start of a session, only walks the changed paths and
+their parent directories, and takes everything else from the metadata
+of the previous backup.
+
+Each record in the journal is a type byte, an absolute path, and a
+null byte.  Type "E" means only the entry itself changed, type "T"
+means the whole tree below it may have changed, which is what a
+created, deleted or moved directory gets.  The recorder writes a "T"
+record for its root when it starts, so changes made while it wasn't
+running are never missed.
+
+The journal is renamed to journal.<session time> when it is taken.
+These files are kept until a later session finds that the session
+which took them completed, so the changes of a failed session are
+walked again by the next one.
+
+"""
+
+import os
+import sys
+import errno
+import fcntl
+import struct
+import ctypes
+import ctypes.util
+from . import Globals, Time, log, rorpiter, selection
+
+# Status of an index in ChangeHints
+REUSE, DESCEND, WALK = 0, 1, 2
+
+
+class ChangeHints:
+    """Tree of the changed paths below a source directory
+
+	Changed entries are the nodes of the tree, and a tree which
+	changed as a whole is replaced by True.  get_status tells whether
+	an index is in a changed tree (WALK), is a changed entry or the
+	parent directory of one (DESCEND), or didn't change (REUSE).
+
+	"""
+
+    def __init__(self):
+        self.tree = {}
+        self.changed_count = 0
+
+    def add(self, index, whole_tree):
+        """Mark index as changed, with everything below it if whole_tree"""
+        self.changed_count += 1
+        if not index:
+            if whole_tree: self.tree = True
+            return
+        node = self.tree
+        for comp in index[:-1]:
+            if node is True: return
+            node = node.setdefault(comp, {})
+        if node is True: return
+        if whole_tree: node[index[-1]] = True
+        else: node.setdefault(index[-1], {})
+
+    def get_status(self, index):
+        """Return REUSE, DESCEND, or WALK for index"""
+        node = self.tree
+        for comp in index:
+            if node is True: return WALK
+            node = node.get(comp)
+            if node is None: return REUSE
+        if node is True: return WALK
+        return DESCEND
+
+    def everything_changed(self):
+        """True if the whole source directory has to be walked"""
+        return self.tree is True
+
+    def get_sf(self):
+        """Return selection function excluding the unchanged files
+
+		The root directory itself is never excluded.  Put first, it
+		keeps the unchanged files from being stat'ed at all.
+
+		"""
+
+        def sel_func(rp):
+            if rp.index and self.get_status(rp.index) == REUSE: return 0
+            return None
+
+        sel_func.exclude = 1
+        sel_func.name = "Change journal"
+        return sel_func
+
+
+def get_lock_path(journal):
+    """Return path of the lock file held by the recorder of journal"""
+    return journal + b".lock"
+
+
+def recorder_running(journal):
+    """True if an rdiff-backup-journal process is writing journal"""
+    try:
+        fd = os.open(get_lock_path(journal), os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def get_taken_journals(journal):
+    """Return list of (session time, path) of the journals taken before"""
+    dirname, basename = os.path.split(journal)
+    prefix = basename + b"."
+    result = []
+    for filename in os.listdir(dirname or b"."):
+        if filename.startswith(prefix) and filename[len(prefix):].isdigit():
+            result.append((int(filename[len(prefix):]),
+                           os.path.join(dirname, filename)))
+    result.sort()
+    return result
+
+
+def take_journal(journal):
+    """Return list of (path, whole_tree) changed since the last backup
+
+	Journals taken by sessions up to Time.prevtime are removed, as
+	those sessions completed, and the changes in the others are
+	returned with the changes in journal, which is taken for this
+	session.  journal is locked while it is renamed, so a record
+	written at the same time ends up in one of the files.  Return
+	None if the journal can't be trusted.
+
+	"""
+    if not recorder_running(journal):
+        log.Log("Warning: rdiff-backup-journal isn't running for change "
+                "journal %s, reading all source files" %
+                (os.fsdecode(journal), ), 2)
+        return None
+
+    data = []
+    for session_time, path in get_taken_journals(journal):
+        if session_time <= Time.prevtime: os.unlink(path)
+        elif session_time != Time.curtime:
+            with open(path, "rb") as fp:
+                data.append(fp.read())
+
+    try:
+        fd = os.open(journal, os.O_RDONLY)
+    except FileNotFoundError:
+        pass
+    else:
+        with os.fdopen(fd, "rb") as fp:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.rename(journal, b"%s.%d" % (journal, Time.curtime))
+            data.append(fp.read())
+
+    changes = []
+    for record in b"".join(data).split(b"\0"):
+        if record: changes.append((record[1:], record[:1] != b"E"))
+    return changes
+
+
+def path_to_index(root, path):
+    """Return index of path in directory root, or None if outside it"""
+    if path == root: return ()
+    prefix = root.rstrip(b"/") + b"/"
+    if not path.startswith(prefix): return None
+    return tuple(path[len(prefix):].split(b"/"))
+
+
+def get_hints(journal, root_rp):
+    """Return ChangeHints for the source root_rp, or None to walk it all"""
+    active = [
+        name for name in ("eas_active", "acls_active", "win_acls_active",
+                          "resource_forks_active", "carbonfile_active")
+        if Globals.get(name)
+    ]
+    if active:
+        log.Log("Warning: the change journal can't be used with %s, as "
+                "the mirror metadata doesn't have them, reading all "
+                "source files" % ", ".join(active), 2)
+        return None
+    changes = take_journal(journal)
+    if changes is None: return None
+
+    root = os.path.realpath(root_rp.path)
+    hints = ChangeHints()
+    for path, whole_tree in changes:
+        index = path_to_index(root, path)
+        if index is not None: hints.add(index, whole_tree)
+    log.Log("Change journal lists %d changed paths" %
+            (hints.changed_count, ), 4)
+    if hints.everything_changed(): return None
+    return hints
+
+
+def HintedIter(select, hints, mirror_rorps):
+    """Yield the rpaths of select, taking unchanged ones from mirror_rorps
+
+	select is a Select object ready to iterate, and mirror_rorps the
+	metadata of the previous backup.  The changed parts of the source
+	directory are walked as usual, while the unchanged files are
+	excluded up front and made from their mirror metadata instead,
+	filtered by the other selection functions.  Their parent
+	directories are walked anyway, as the parents of changed entries,
+	unless the selection functions only scan them; these are stat'ed
+	when one of their unchanged files is included.
+
+	Regular files with several hard links are stat'ed again, as they
+	may change through a link the recorder didn't see.  So are files
+	whose selection needs data the metadata doesn't keep.
+
+	"""
+    sel_funcs = select.selection_functions[:]
+    select.add_selection_func(hints.get_sf(), 1)
+    root_rp = select.rpath
+
+    def select_unhinted(rp):
+        """Like select.Select, but without the change hints"""
+        return selection.Select.run_selection_functions(sel_funcs, rp)
+
+    def get_reused_rp(mirror_rorp):
+        """Return the source rpath for unchanged mirror_rorp, or None"""
+        if mirror_rorp.isreg() and mirror_rorp.getnumlinks() > 1:
+            rp = root_rp.new_index(mirror_rorp.index)
+            if not rp.lstat(): return None
+        else:
+            data = mirror_rorp.data
+            data.pop('mirrorname', None)
+            data.pop('incname', None)
+            rp = root_rp.__class__(root_rp.conn, root_rp.base,
+                                   mirror_rorp.index, data)
+        try:
+            result = select_unhinted(rp)
+        except KeyError:
+            # A selection function, like the one of
+            # --exclude-other-filesystems, wants data the metadata
+            # doesn't have (devloc is only kept for hard links)
+            rp = root_rp.new_index(mirror_rorp.index)
+            if not rp.lstat(): return None
+            result = select_unhinted(rp)
+        if result != 1: return None
+        return rp
+
+    reused = (rorp for rorp in mirror_rorps
+              if rorp.index and hints.get_status(rorp.index) == REUSE)
+    dirs = [()]  # indicies of the directories yielded, root to the last
+    excluded = None  # index of the last directory found to be excluded
+    reused_count = 0
+    for src_rp, mirror_rorp in rorpiter.Collate2Iters(select, reused):
+        if src_rp: rp = src_rp
+        else:
+            index = mirror_rorp.index
+            if excluded and index[:len(excluded)] == excluded: continue
+            rp = get_reused_rp(mirror_rorp)
+            if not rp: continue
+            reused_count += 1
+
+        index = rp.index
+        while index[:len(dirs[-1])] != dirs[-1]:
+            del dirs[-1]
+        parent_rps = []
+        for i in range(len(dirs[-1]) + 1, len(index)):
+            parent_rp = root_rp.new_index(index[:i])
+            if not parent_rp.isdir() or select_unhinted(parent_rp) == 0:
+                excluded = parent_rp.index
+                break
+            parent_rps.append(parent_rp)
+        else:
+            for parent_rp in parent_rps:
+                dirs.append(parent_rp.index)
+                yield parent_rp
+            if index and rp.isdir(): dirs.append(index)
+            yield rp
+    log.Log("Took %d unchanged files from the mirror metadata" %
+            (reused_count, ), 5)
+
+
+# Flags of inotify(7)
+IN_MODIFY, IN_ATTRIB, IN_MOVED_FROM, IN_MOVED_TO = 0x2, 0x4, 0x40, 0x80
+IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_MOVE_SELF = 0x100, 0x200, 0x400, 0x800
+IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR = 0x4000, 0x8000, 0x40000000
+IN_ONLYDIR, IN_DONT_FOLLOW, IN_CLOEXEC = 0x1000000, 0x2000000, 0o2000000
+watch_mask = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+              | IN_DONT_FOLLOW)
+event_header = struct.Struct("iIII")
+
+
+class Recorder:
+    """Append the paths changed below a directory to a change journal
+
+	Each directory below root gets an inotify watch, and every event
+	with a file name becomes a journal record for that file, or for
+	the tree below it if it is a directory which appeared or went
+	away.  The records read at once are appended together, leaving
+	out the ones already in the current journal.
+
+	"""
+    # Forget the records written before when there are more than this
+    max_written = 1000000
+
+    def __init__(self, root, journal):
+        self.root = os.path.realpath(root)
+        self.journal = os.path.abspath(journal)
+        self.libc = ctypes.CDLL(
+            ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, "inotify_init1: " + os.strerror(err))
+        self.wd_paths, self.path_wds = {}, {}
+        self.journal_id, self.written = None, set()
+        self.error = None  # set if some directory can't be watched
+
+    def add_watches(self, dirpath):
+        """Watch dirpath and every directory below it
+
+		Return an error message if some directory couldn't be watched,
+		as its changes would go unrecorded, and None otherwise.
+		Directories which went away in the meantime don't count.
+
+		"""
+        errors = []
+
+        def walk_error(exc):
+            if exc.errno not in (errno.ENOENT, errno.ENOTDIR):
+                errors.append(exc)
+
+        for path, dirnames, filenames in os.walk(dirpath, onerror=walk_error):
+            wd = self.libc.inotify_add_watch(self.fd, path, watch_mask)
+            if wd >= 0:
+                self.wd_paths[wd], self.path_wds[path] = path, wd
+                continue
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                return ("Out of inotify watches, raise "
+                        "fs.inotify.max_user_watches")
+            elif err not in (errno.ENOENT, errno.ENOTDIR):
+                errors.append(OSError(err, os.strerror(err), path))
+        if errors: return "Can't watch %s" % (errors[0], )
+        return None
+
+    def remove_watches(self, dirpath):
+        """Stop watching dirpath and the directories below it"""
+        prefix = dirpath + b"/"
+        for path in list(self.path_wds.keys()):
+            if path == dirpath or path.startswith(prefix):
+                wd = self.path_wds.pop(path)
+                del self.wd_paths[wd]
+                self.libc.inotify_rm_watch(self.fd, wd)
+
+    def get_records(self, buf):
+        """Return list of the journal records for the events in buf"""
+        records, offset = [], 0
+        while offset < len(buf):
+            wd, mask, cookie, length = event_header.unpack_from(buf, offset)
+            name = buf[offset + event_header.size:offset +
+                       event_header.size + length].rstrip(b"\0")
+            offset += event_header.size + length
+            if mask & IN_Q_OVERFLOW:
+                records.append(b"T" + self.root)
+                continue
+            dirpath = self.wd_paths.get(wd)
+            if dirpath is None: continue
+            if mask & IN_IGNORED:
+                del self.wd_paths[wd]
+                if self.path_wds.get(dirpath) == wd:
+                    del self.path_wds[dirpath]
+            if not name:  # the parent directory gets the same event
+                if dirpath == self.root and mask & (
+                        IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    # run stops after writing this record
+                    records.append(b"T" + self.root)
+                    self.error = ("%s was moved, deleted or unmounted" %
+                                  (os.fsdecode(self.root), ))
+                continue
+
+            path = os.path.join(dirpath, name)
+            if mask & IN_ISDIR and mask & (IN_MOVED_FROM | IN_DELETE):
+                self.remove_watches(path)
+            if mask & IN_ISDIR and mask & (IN_MOVED_TO | IN_CREATE):
+                error = self.add_watches(path)
+                if error:  # run stops after writing these records
+                    records.append(b"T" + self.root)
+                    self.error = error
+            if mask & IN_ISDIR and mask & (IN_MOVED_FROM | IN_MOVED_TO
+                                           | IN_CREATE | IN_DELETE):
+                records.append(b"T" + path)
+            else:
+                records.append(b"E" + path)
+        return records
+
+    def open_journal(self):
+        """Return fd of the current journal, locked for writing"""
+        while 1:
+            fd = os.open(self.journal, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            fd_stat = os.fstat(fd)
+            try:
+                path_stat = os.stat(self.journal)
+            except FileNotFoundError:
+                path_stat = None
+            if (path_stat and (path_stat.st_dev, path_stat.st_ino) ==
+                (fd_stat.st_dev, fd_stat.st_ino)):
+                break
+            os.close(fd)  # renamed by rdiff-backup since opening it
+
+        journal_id = (fd_stat.st_dev, fd_stat.st_ino)
+        if (journal_id != self.journal_id
+                or len(self.written) > self.max_written):
+            self.journal_id, self.written = journal_id, set()
+        return fd
+
+    def write_records(self, records):
+        """Append the records not yet in the current journal"""
+        fd = self.open_journal()
+        try:
+            new_records = []
+            for record in records:
+                if record not in self.written:
+                    self.written.add(record)
+                    new_records.append(record + b"\0")
+            if new_records: os.write(fd, b"".join(new_records))
+        finally:
+            os.close(fd)
+
+    def run(self):
+        """Record the changes until killed
+
+		If a directory can't be watched, or the root directory goes
+		away, the journal can't be trusted any more, so this exits.
+		rdiff-backup then finds the recorder isn't running and reads
+		all source files.
+
+		"""
+        lock_fd = os.open(get_lock_path(self.journal), os.O_RDONLY
+                          | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            sys.exit("Another rdiff-backup-journal is writing %s" %
+                     (os.fsdecode(self.journal), ))
+        self.error = self.add_watches(self.root)
+        if self.error: sys.exit(self.error)
+        # Changes made while no recorder was running are unknown
+        self.write_records([b"T" + self.root])
+        while 1:
+            buf = os.read(self.fd, 65536)
+            records = self.get_records(buf)
+            if records: self.write_records(records)
+            if self.error: sys.exit(self.error)
+
+
+def record_main(arglist):
+    """Start of rdiff-backup-journal, arglist is the command line"""
+    if len(arglist) != 2 or arglist[0].startswith("-"):
+        sys.exit("Usage: rdiff-backup-journal <source-dir> <journal-file>\n\n"
+                 "See the --change-journal option in the rdiff-backup man "
+                 "page for more information.")
+    root, journal = map(os.fsencode, arglist)
+    if not os.path.isdir(root):
+        sys.exit("Directory %s not found" % (arglist[0], ))
+    try:
+        Recorder(root, journal).run()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,252 @@
+# Copyright 2019 The rdiff-backup project
+#
+# This file is part of rdiff-backup.
+#
+# rdiff-backup is free software; you can redistribute it and/or modify
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# rdiff-backup is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rdiff-backup; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+"""Compression codecs for increments and metadata files
+
+Which codec a compressed file was written with is given by its
+suffix, ".gz" for gzip or ".zst" for zstd, so files written with
+different codecs can be read back in the same session.  New increments
+use the codec set by Globals.compression_codec.
+
+With Globals.compression_threads above 1, gzip files are written like
+pigz does: the data is cut into blocks which are compressed as
+separate gzip members in a thread pool shared by all files.  The members are concatenated
+in order, which is still an ordinary gzip file.  zstd compresses with
+that many threads itself.  zstd needs the zstandard module, which is
+optional.
+
+The frames sent over a connection can be compressed too, see
+compress_frame.  These use zlib or zstd at a fast level, without a
+file format around the data.
+
+"""
+
+import os
+import gzip
+import atexit
+import zlib
+import functools
+import collections
+import concurrent.futures
+from . import Globals, log
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Map file suffixes to codec names
+suffixes = {b"gz": "gzip", b"zst": "zstd"}
+codec_suffixes = dict((name, suffix) for suffix, name in suffixes.items())
+
+# Codecs for compressing connection frames.  The list is kept in
+# Globals, where the other side of a connection can look it up.
+wire_codecs = Globals.wire_codecs
+if zstandard and "zstd" not in wire_codecs: wire_codecs.append("zstd")
+zstd_magic = b"\x28\xb5\x2f\xfd"
+
+# Data starting with one of these is most likely compressed already.
+# They are the formats of no_compression_regexp in Globals.
+compressed_magics = (
+    b"\x1f\x8b",  # gzip, tgz
+    b"BZh",  # bzip2
+    b"PK\x03\x04",  # zip
+    b"\xfd7zXZ\x00",  # xz
+    zstd_magic,
+    b"\xed\xab\xee\xdb",  # rpm
+    b"!<arch>\n",  # deb
+    b"\xff\xd8\xff",  # jpeg
+    b"\x89PNG",
+    b"GIF8",
+    b"\x00\x00\x00\x0cjP  ",  # jpeg 2000
+    b"ID3",  # mp3
+    b"OggS",
+    b"fLaC",
+    b"RIFF",  # avi
+    b"\x00\x00\x01\xba",  # mpeg
+    b"Rar!",
+    b"\x60\xea",  # arj
+    b"-----BEGIN PGP")
+# Frames shorter than this aren't worth compressing
+wire_min_size = 512
+# Size of the part of a frame compressed to check whether it shrinks
+wire_sample_size = 4096
+
+
+def get_codec(filename):
+    """Return name of codec used by the compressed file filename
+
+	Compressed files without a known suffix, like temp files, are gzip
+	files.
+
+	"""
+    suffix = os.fsencode(filename).split(b".")[-1]
+    return suffixes.get(suffix, "gzip")
+
+
+def get_suffix():
+    """Return suffix, without the dot, for newly compressed files"""
+    return codec_suffixes[Globals.compression_codec]
+
+
+def check_codec(codec):
+    """Raise a fatal error if codec can't be used here"""
+    if codec not in codec_suffixes:
+        log.Log.FatalError("Unknown compression codec '%s'" % (codec, ))
+    if codec == "zstd" and zstandard is None:
+        log.Log.FatalError("zstd compression needs the Python zstandard "
+                           "module, which could not be imported")
+
+
+def check_wire_codec(codec):
+    """Raise a fatal error if frames can't be compressed with codec"""
+    if codec not in ("zlib", "zstd"):
+        log.Log.FatalError("Unknown wire compression codec '%s'" % (codec, ))
+    if codec not in wire_codecs:
+        log.Log.FatalError("zstd wire compression needs the Python "
+                           "zstandard module, which could not be imported")
+
+
+def compress_frame(codec, data):
+    """Return data compressed with codec, or None if not worth it
+
+	Data which is short, starts like a compressed file, or whose
+	first wire_sample_size bytes don't shrink by a tenth, is left
+	alone.
+
+	"""
+    if (len(data) < wire_min_size or bytes(data[:16]).startswith(
+            compressed_magics)):
+        return None
+    if codec == "zstd": compress = zstandard.ZstdCompressor(level=1).compress
+    else: compress = functools.partial(zlib.compress, level=1)
+    if len(data) > 2 * wire_sample_size:
+        sample = data[:wire_sample_size]
+        if len(compress(sample)) > 0.9 * len(sample): return None
+    compressed = compress(data)
+    if len(compressed) >= len(data): return None
+    return compressed
+
+
+def decompress_frame(data):
+    """Return decompressed data of a frame compressed by compress_frame"""
+    if bytes(data[:4]) == zstd_magic:
+        if zstandard is None:
+            raise IOError("Received zstd compressed data, but the Python "
+                          "zstandard module could not be imported")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def open_zstd(filename, mode):
+    """Return file object reading or writing zstd file filename"""
+    check_codec("zstd")
+    if 'r' in mode:
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(filename, "rb"))
+    threads = Globals.compression_threads
+    if threads == 1: threads = 0  # Don't start any extra threads
+    compressor = zstandard.ZstdCompressor(threads=threads)
+    return compressor.stream_writer(open(filename, "wb"))
+
+
+# The thread pool compressing gzip members, see get_executor
+_executor, _executor_threads = None, 0
+
+
+def get_executor(threads):
+    """Return the thread pool compressing gzip members
+
+	All ParallelGzipFiles share one pool, started the first time it
+	is needed, with the largest number of threads asked for so far.
+	It is shut down when the process exits.
+
+	"""
+    global _executor, _executor_threads
+    if threads > _executor_threads:
+        # Work already submitted to the old pool still gets done
+        if _executor is not None: _executor.shutdown(wait=False)
+        _executor = concurrent.futures.ThreadPoolExecutor(threads)
+        _executor_threads = threads
+    return _executor
+
+
+def shutdown_executor():
+    """Wait for the compressing threads to finish and stop them"""
+    global _executor, _executor_threads
+    if _executor is not None:
+        _executor.shutdown()
+        _executor, _executor_threads = None, 0
+
+
+atexit.register(shutdown_executor)
+
+
+class ParallelGzipFile:
+    """Write-only gzip file, compressing blocks in a thread pool
+
+	Each block of at most block_size bytes becomes its own gzip member.
+	Callers may also end a member early with end_member, which returns
+	the number of the next member; its offset in the file can be
+	looked up in member_offsets after closing.
+
+	"""
+    block_size = 1024 * 1024
+
+    def __init__(self, fileobj, threads=1, compresslevel=9):
+        self.fileobj, self.threads = fileobj, threads
+        self.compresslevel = compresslevel
+        self._pending = collections.deque()
+        self._buffer, self.member_size = [], 0
+        self._member_count = 0
+        self.offset = 0  # Number of compressed bytes written so far
+        self.member_offsets = []
+
+    def write(self, buf):
+        self._buffer.append(buf)
+        self.member_size += len(buf)
+        if self.member_size >= self.block_size: self.end_member()
+        return len(buf)
+
+    def end_member(self):
+        """Compress buffered data as one member, return next member number"""
+        if not self._buffer: return self._member_count
+        data = b"".join(self._buffer)
+        self._buffer, self.member_size = [], 0
+        self._member_count += 1
+        if self.threads <= 1:
+            self._write_member(gzip.compress(data, self.compresslevel))
+            return self._member_count
+
+        self._pending.append(
+            get_executor(self.threads).submit(gzip.compress, data,
+                                              self.compresslevel))
+        while len(self._pending) > 2 * self.threads:
+            self._write_member(self._pending.popleft().result())
+        return self._member_count
+
+    def _write_member(self, member):
+        self.member_offsets.append(self.offset)
+        self.fileobj.write(member)
+        self.offset += len(member)
+
+    def close(self):
+        self.end_member()
+        while self._pending:
+            self._write_member(self._pending.popleft().result())
+        return self.fileobj.close()
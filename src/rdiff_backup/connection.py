@@ -54,6 +54,21 @@ class Connection:
     def __bool__(self):
         return True
 
+    def reval_async(self, function_string, *args):
+        """Execute command on the connection, return a ConnectionFuture
+
+		Connections which can't have several requests in flight, like
+		the local connection, run the command right away and return a
+		future which is already done.
+
+		"""
+        future = ConnectionFuture()
+        try:
+            future.set_result(self.reval(function_string, *args))
+        except Exception as exc:
+            future.set_result(exc)
+        return future
+
 
 class LocalConnection(Connection):
     """Local connection
@@ -100,14 +115,27 @@ class LowLevelPipeConnection(Connection):
 	R - RPath
 	Q - QuotedRPath
 	r - RORPath only
+	n - RORPath only, in the compact encoding of rorpcodec
 	c - PipeConnection object
+	Z - compressed frame, its data is the type of the original frame
+	    followed by the data compressed with compression.compress_frame
 
 	"""
+    # Version of the rorpcodec encoding the other side understands, set by
+    # SetConnections.init_rorp_codec.  If None, RORPaths are pickled.
+    rorp_codec_version = None
+    # Codec compressing the frames we send, set by
+    # SetConnections.init_wire_compression.  Compressed frames are
+    # understood when received even if this is None.
+    wire_compression = None
 
     def __init__(self, inpipe, outpipe):
         """inpipe is a file-type open for reading, outpipe for writing"""
         self.inpipe = inpipe
         self.outpipe = outpipe
+        # Bytes of frame data sent and received, before and after
+        # wire compression; see statistics.StatsObj.set_wire_stats
+        self.wire_raw_bytes = self.wire_bytes = 0
 
     def __str__(self):
         """Return string version
@@ -140,8 +168,47 @@ class LowLevelPipeConnection(Connection):
 		it must be excluded from the pickling
 
 		"""
-        rorpath_repr = (rorpath.index, rorpath.data)
-        self._write("r", pickle.dumps(rorpath_repr, 1), req_num)
+        if self.rorp_codec_version:
+            self._write("n", rorpcodec.encode(rorpath.index, rorpath.data),
+                        req_num)
+        else:
+            rorpath_repr = (rorpath.index, rorpath.data)
+            self._write("r", pickle.dumps(rorpath_repr, 1), req_num)
+
+    def _compress_frame(self, headerchar, data):
+        """Return pair (headerchar, data) of a frame as it is sent
+
+		_write calls this before writing the header.  Unless
+		compress_frame finds it isn't worth it, the data is compressed
+		and sent as type "Z" frame.
+
+		"""
+        self.wire_raw_bytes += len(data)
+        if self.wire_compression:
+            compressed = compression.compress_frame(self.wire_compression,
+                                                    data)
+            if compressed is not None:
+                headerchar, data = "Z", headerchar.encode() + compressed
+        self.wire_bytes += len(data)
+        return headerchar, data
+
+    def _decompress_frame(self, format_string, data):
+        """Return pair (format_string, data) of a received frame
+
+		_get calls this after reading the data, before looking at
+		format_string, so a type "Z" frame is read like the original.
+
+		"""
+        self.wire_bytes += len(data)
+        if format_string == b"Z":
+            format_string = data[0:1]
+            data = compression.decompress_frame(data[1:])
+        self.wire_raw_bytes += len(data)
+        return format_string, data
+
+    def _getcompactrorpath(self, raw_rorpath_buf):
+        """Reconstruct RORPath object sent with type "n" """
+        return rpath.RORPath(*rorpcodec.decode(raw_rorpath_buf))
 
     def _putconn(self, pipeconn, req_num):
         """Put a connection into the pipe
@@ -150,6 +217,67 @@ class LowLevelPipeConnection(Connection):
 		string form) of its connection number it is *connected to*.
 
 		"""
+        self._write("c", str(pipeconn.conn_number).encode(), req_num)
+
+    def _putiter(self, iterator, req_num):
+        """Put an iterator through the pipe
+
+		Its RORPaths are sent in the compact encoding if the other side
+		understands it.
+
+		"""
+        iter_file = iterfile.MiscIterToFile(iterator)
+        iter_file.rorp_codec = self.rorp_codec_version
+        self._write("i", str(VirtualFile.new(iter_file)).encode(), req_num)
+
+    def _write(self, headerchar, data, req_num):
+        """Write header and then data to the pipe
+
+		The header is the type character, the request number, and the
+		length of the data in 7 bytes.  The frame may be compressed
+		first, see _compress_frame.
+
+		"""
+        headerchar, data = self._compress_frame(headerchar, data)
+        try:
+            self.outpipe.write(headerchar.encode() + bytes([req_num]) +
+                               len(data).to_bytes(7, 'big'))
+            self.outpipe.write(data)
+            self.outpipe.flush()
+        except (IOError, AttributeError):
+            raise ConnectionWriteError()
+
+    def _get(self):
+        """Read an object from the pipe and return (req_num, value)"""
+        header_string = self.inpipe.read(9)
+        if not len(header_string) == 9:
+            raise ConnectionReadError("Truncated header string (problem "
+                                      "probably originated remotely)")
+        format_string, req_num, length = (header_string[0:1],
+                                          header_string[1],
+                                          int.from_bytes(header_string[2:],
+                                                         'big'))
+        if format_string == b"q": raise ConnectionQuit("Received quit signal")
+        try:
+            data = self.inpipe.read(length)
+        except IOError:
+            raise ConnectionReadError()
+        format_string, data = self._decompress_frame(format_string, data)
+
+        if format_string == b"o": result = pickle.loads(data)
+        elif format_string == b"b": result = data
+        elif format_string == b"f": result = VirtualFile(self, int(data))
+        elif format_string == b"i":
+            result = iterfile.FileToMiscIter(VirtualFile(self, int(data)))
+        elif format_string == b"r": result = self._getrorpath(data)
+        elif format_string == b"n": result = self._getcompactrorpath(data)
+        elif format_string == b"R": result = self._getrpath(data)
+        elif format_string == b"Q": result = self._getqrpath(data)
+        else:
+            assert format_string == b"c", header_string
+            result = Globals.connection_dict[int(data)]
+        log.Log.conn("received", result, req_num)
+        return (req_num, result)
 
 
 
@@ -163,7 +291,16 @@ class PipeConnection(LowLevelPipeConnection):
 	The only difference between the client and server is that the
 	client makes the first request, and the server listens first.
 
+	Requests sent with reval_async don't wait for their response.
+	The other side answers requests in order, and each response is
+	kept in its ConnectionFuture when it arrives, so up to
+	max_async_requests of them can be in flight at once.
+
 	"""
+    max_async_requests = 128
+    # Number of requests this process is answering, on any connection.
+    # Requests made while it isn't 0 are part of their call chain.
+    answering = 0
 
     def __init__(self, inpipe, outpipe, conn_number=0):
         """Init PipeConnection
@@ -179,6 +316,9 @@ class PipeConnection(LowLevelPipeConnection):
         self.unused_request_numbers = {}
         for i in range(256):
             self.unused_request_numbers[i] = None
+        self.async_requests = {}  # req_num -> ConnectionFuture
+        self.early_responses = {}  # req_num -> response read too soon
+        self.request_queue = []  # requests waiting for the current one
 
     def __str__(self):
         return "PipeConnection %d" % self.conn_number
@@ -189,36 +329,72 @@ class PipeConnection(LowLevelPipeConnection):
 		Sometimes after a request is sent, the other side will make
 		another request before responding to the original one.  In
 		that case, respond to the request.  But return once the right
-		response is given.
+		response is given.  Requests queued by get_request are
+		answered once no other request is being answered.
 
 		"""
         while 1:
+            if desired_req_num in self.early_responses:
+                return self.early_responses.pop(desired_req_num)
+            if self.request_queue and not PipeConnection.answering:
+                self.answer_request(*self.request_queue.pop(0))
+                continue
             try:
                 req_num, object = self._get()
             except ConnectionQuit:
                 self._put("quitting", self.get_new_req_num())
                 self._close()
                 return
-            if req_num == desired_req_num: return object
-            else:
-                assert isinstance(object, ConnectionRequest)
-                self.answer_request(object, req_num)
+            # While requests of ours are in flight, the other side
+            # may make a request with the same number, so requests
+            # have to be told apart from responses by their type.
+            if isinstance(object, ConnectionRequest):
+                self.get_request(object, req_num)
+            elif req_num == desired_req_num: return object
+            elif req_num in self.async_requests:
+                self.set_async_result(req_num, object)
+            else:  # for a request waiting further up the stack
+                self.early_responses[req_num] = object
+
+    def get_request(self, request, req_num):
+        """Read the arguments of request, then answer or queue it
+
+		While a request is answered, the other side may send requests
+		which are not part of its call chain, like the next ones sent
+		with reval_async.  If they were answered right away, they
+		would run in the middle of the current request while it waits
+		for a callback, so they are queued until it is done.
 
-    def answer_request(self, request, req_num):
-        """Put the object requested by request down the pipe"""
-        del self.unused_request_numbers[req_num]
+		"""
+        unused = req_num in self.unused_request_numbers
+        if unused: del self.unused_request_numbers[req_num]
         argument_list = []
         for i in range(request.num_args):
             arg_req_num, arg = self._get()
             assert arg_req_num == req_num
             argument_list.append(arg)
+        if request.nested or not PipeConnection.answering:
+            self.answer_request(request, req_num, argument_list, unused)
+        else:
+            self.request_queue.append(
+                (request, req_num, argument_list, unused))
+
+    def answer_request(self, request, req_num, argument_list, unused):
+        """Put the object requested by request down the pipe
+
+		unused is true if req_num has to be freed afterwards.
+
+		"""
+        PipeConnection.answering += 1
         try:
             Security.vet_request(request, argument_list)
             result = eval(request.function_string)(*argument_list)
         except:
             result = self.extract_exception()
+        finally:
+            PipeConnection.answering -= 1
         self._put(result, req_num)
-        self.unused_request_numbers[req_num] = None
+        if unused: self.unused_request_numbers[req_num] = None
 
     def extract_exception(self):
         """Return active exception"""
@@ -246,10 +422,11 @@ class PipeConnection(LowLevelPipeConnection):
 		function.
 
 		"""
-        req_num = self.get_new_req_num()
-        self._put(ConnectionRequest(function_string, len(args)), req_num)
-        for arg in args:
-            self._put(arg, req_num)
+        request = ConnectionRequest(function_string, len(args))
+        return self.get_result(self.send_request(request, args))
+
+    def get_result(self, req_num):
+        """Wait for response to request req_num, raise it if exception"""
         result = self.get_response(req_num)
         self.unused_request_numbers[req_num] = None
         if isinstance(result, Exception): raise result
@@ -257,6 +434,44 @@ class PipeConnection(LowLevelPipeConnection):
         elif isinstance(result, KeyboardInterrupt): raise result
         else: return result
 
+    def reval_async(self, function_string, *args):
+        """Send command to remote side without waiting for the result
+
+		Returns a ConnectionFuture.  The response is read when the
+		future's result() is called, or earlier while waiting for the
+		response to some other request.  Requests are executed in the
+		order sent, one after the other, even if they call back into
+		this side, see get_request.
+
+		"""
+        while len(self.async_requests) >= self.max_async_requests:
+            self.wait_async(next(iter(self.async_requests.values())))
+        req_num = self.send_request(
+            ConnectionRequest(function_string, len(args)), args)
+        future = ConnectionFuture(self, req_num)
+        self.async_requests[req_num] = future
+        return future
+
+    def send_request(self, request, args):
+        """Put request and its arguments down the pipe, return req_num"""
+        request.nested = PipeConnection.answering > 0
+        req_num = self.get_new_req_num()
+        self._put(request, req_num)
+        for arg in args:
+            self._put(arg, req_num)
+        return req_num
+
+    def wait_async(self, future):
+        """Read from pipe until the response for future has arrived"""
+        if future.done(): return
+        self.set_async_result(future.req_num,
+                              self.get_response(future.req_num))
+
+    def set_async_result(self, req_num, result):
+        """Give result to the future waiting for it, free req_num"""
+        self.async_requests.pop(req_num).set_result(result)
+        self.unused_request_numbers[req_num] = None
+
     def get_new_req_num(self):
         """Allot a new request number and return it"""
         if not self.unused_request_numbers:
@@ -277,6 +492,37 @@ class PipeConnection(LowLevelPipeConnection):
         return EmulateCallable(self, name)
 
 
+class ConnectionFuture:
+    """The result of a request made with reval_async
+
+	result() returns the value the function returned, or raises the
+	exception it raised, after waiting for the response if necessary.
+
+	"""
+
+    def __init__(self, conn=None, req_num=None):
+        """conn and req_num are only given while waiting for a response"""
+        self.conn, self.req_num = conn, req_num
+        self._done = conn is None
+        self._result = None
+
+    def done(self):
+        """Return true if the response has arrived"""
+        return self._done
+
+    def set_result(self, result):
+        self._result = result
+        self._done = True
+
+    def result(self):
+        """Return the result, raising it if it is an exception"""
+        if not self._done: self.conn.wait_async(self)
+        if isinstance(self._result,
+                      (Exception, SystemExit, KeyboardInterrupt)):
+            raise self._result
+        return self._result
+
+
 class RedirectedConnection(Connection):
     """Represent a connection more than one move away
 
@@ -386,12 +632,26 @@ class VirtualFile:
 
 
 # everything has to be available here for remote connection's use, but
-# put at bottom to reduce circularities.
-from . import Globals, Time, Rdiff, Hardlink, FilenameMapping, Security, \
-    Main, rorpiter, selection, increment, statistics, manage, \
-    iterfile, rpath, robust, restore, manage, backup, connection, \
-    TempFile, SetConnections, librsync, log, regress, fs_abilities, \
-    eas_acls, user_group, compare
+# put at bottom to reduce circularities.  The modules needed to run the
+# connection itself are imported right away, the others the first time
+# they are used.
+from . import Globals, Time, FilenameMapping, Security, rorpiter, \
+    iterfile, rpath, robust, connection, SetConnections, log, rorpcodec, \
+    compression, librsync, statistics, lazyimport
+Main = lazyimport.lazy_import("Main")
+Rdiff = lazyimport.lazy_import("Rdiff")
+Hardlink = lazyimport.lazy_import("Hardlink")
+selection = lazyimport.lazy_import("selection")
+increment = lazyimport.lazy_import("increment")
+manage = lazyimport.lazy_import("manage")
+restore = lazyimport.lazy_import("restore")
+backup = lazyimport.lazy_import("backup")
+TempFile = lazyimport.lazy_import("TempFile")
+regress = lazyimport.lazy_import("regress")
+fs_abilities = lazyimport.lazy_import("fs_abilities")
+eas_acls = lazyimport.lazy_import("eas_acls")
+user_group = lazyimport.lazy_import("user_group")
+compare = lazyimport.lazy_import("compare")
 
 try:
     from . import win_acls
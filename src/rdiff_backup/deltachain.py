@@ -0,0 +1,206 @@
+# Copyright 2019 The rdiff-backup project
+#
+# This file is part of rdiff-backup.
+#
+# rdiff-backup is free software; you can redistribute it and/or modify
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# rdiff-backup is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rdiff-backup; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+"""Compose chains of librsync deltas
+
+To restore a file from several reverse diffs, each diff used to be
+applied to the output of the one before, so the whole file was
+written out once per diff.  Instead, the copy and literal commands of
+the diffs can be composed into one ExtentMap, which says for each part
+of the restored file where it comes from: the basis file (the mirror
+file or the first increment), or the literal data of some diff.  The
+restored file is then read out once.
+
+Only the literal data of the diffs is kept, in a temporary file.  The
+commands are read according to the librsync delta format: a magic
+number, then commands made of one byte and up to two big-endian
+integer parameters.
+
+"""
+
+import bisect
+import tempfile
+from . import Globals, librsync
+
+DELTA_MAGIC = b"rs\x026"
+OP_END = 0x00
+OP_LITERAL_64 = 0x40  # 0x01 to 0x40 are literals of that length
+OP_LITERAL_N1 = 0x41  # literal length in the next 1, 2, 4 or 8 bytes
+OP_LITERAL_N8 = 0x44
+OP_COPY_N1_N1 = 0x45  # copy offset and length in 1, 2, 4 or 8 bytes each
+OP_COPY_N8_N8 = 0x54
+
+# Where the data of an extent comes from
+BASIS, LITERAL = 0, 1
+
+# Literal data of the diffs is kept in memory up to this size, and in a
+# temporary file above it.
+literal_memory = 1024 * 1024
+
+
+class ExtentMap:
+    """Describe a file as a list of extents of other data
+
+	Each extent is a triple (length, source, offset) meaning length
+	bytes starting at offset of source, which is BASIS or LITERAL.
+	self.starts holds the position in the file where each extent
+	begins.
+
+	"""
+
+    def __init__(self):
+        self.starts, self.extents, self.size = [], [], 0
+
+    def add(self, length, source, offset):
+        """Append extent to the end of the file"""
+        if not length: return
+        if self.extents:
+            last_length, last_source, last_offset = self.extents[-1]
+            if last_source == source and last_offset + last_length == offset:
+                self.extents[-1] = (last_length + length, source, last_offset)
+                self.size += length
+                return
+        self.starts.append(self.size)
+        self.extents.append((length, source, offset))
+        self.size += length
+
+    def get_extents(self, pos, length):
+        """Yield the extents making up length bytes starting at pos"""
+        if pos < 0 or pos + length > self.size:
+            raise librsync.librsyncError(
+                "Delta copies %d bytes at %d from basis of %d bytes" %
+                (length, pos, self.size))
+        i = bisect.bisect_right(self.starts, pos) - 1
+        while length > 0:
+            extent_length, source, offset = self.extents[i]
+            skip = pos - self.starts[i]
+            piece = min(extent_length - skip, length)
+            yield (piece, source, offset + skip)
+            pos += piece
+            length -= piece
+            i += 1
+
+
+class DeltaReader:
+    """Read the parts of a delta from a file object"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.buf, self.pos = b"", 0
+
+    def read(self, length):
+        """Return the next length bytes of the delta"""
+        while len(self.buf) - self.pos < length:
+            data = self.fp.read(max(length, Globals.blocksize))
+            if not data: raise librsync.librsyncError("Delta ended early")
+            self.buf = self.buf[self.pos:] + data
+            self.pos = 0
+        self.pos += length
+        return self.buf[self.pos - length:self.pos]
+
+    def read_int(self, size):
+        """Return big-endian integer of size bytes"""
+        return int.from_bytes(self.read(size), "big")
+
+    def copy_to(self, outfp, length):
+        """Write the next length bytes to outfp"""
+        while length > 0:
+            data = self.read(min(length, Globals.blocksize))
+            outfp.write(data)
+            length -= len(data)
+
+
+def compose_delta(basis_map, delta_fp, literal_fp):
+    """Return ExtentMap of the file basis_map patched with delta_fp
+
+	The literal data of the delta is appended to literal_fp.
+
+	"""
+    reader = DeltaReader(delta_fp)
+    if reader.read(4) != DELTA_MAGIC:
+        raise librsync.librsyncError("Bad delta magic number")
+    new_map = ExtentMap()
+    while 1:
+        op = reader.read(1)[0]
+        if op == OP_END: return new_map
+        elif op <= OP_LITERAL_64: length = op
+        elif op <= OP_LITERAL_N8:
+            length = reader.read_int(1 << (op - OP_LITERAL_N1))
+        elif op <= OP_COPY_N8_N8:
+            op -= OP_COPY_N1_N1
+            pos = reader.read_int(1 << (op // 4))
+            length = reader.read_int(1 << (op % 4))
+            for extent in basis_map.get_extents(pos, length):
+                new_map.add(*extent)
+            continue
+        else: raise librsync.librsyncError("Unknown delta command %d" % op)
+        new_map.add(length, LITERAL, literal_fp.tell())
+        reader.copy_to(literal_fp, length)
+
+
+class ComposedFile:
+    """File-like object reading the file described by an ExtentMap"""
+
+    def __init__(self, extent_map, basis_fp, literal_fp):
+        self.extents = iter(extent_map.extents)
+        self.fps = (basis_fp, literal_fp)
+        self.fp, self.remaining = None, 0
+
+    def read(self, length=-1):
+        """Read length bytes, or until the end if length is negative"""
+        bufs = []
+        while length:
+            if not self.remaining:
+                try:
+                    extent_length, source, offset = next(self.extents)
+                except StopIteration:
+                    break
+                self.fp = self.fps[source]
+                self.fp.seek(offset)
+                self.remaining = extent_length
+            if length < 0: size = min(self.remaining, Globals.blocksize)
+            else: size = min(self.remaining, length)
+            data = self.fp.read(size)
+            if not data: raise librsync.librsyncError("Basis file ended early")
+            bufs.append(data)
+            self.remaining -= len(data)
+            if length > 0: length -= len(data)
+        return b"".join(bufs)
+
+    def close(self):
+        """Close the basis file and the literal data"""
+        for fp in self.fps:
+            fp.close()
+
+
+def compose(basis_fp, delta_fps):
+    """Return file object of basis_fp patched with each of delta_fps
+
+	basis_fp must be seekable.  The delta files are read, and closed,
+	in order before this returns, while the basis file is only read
+	when the result is.
+
+	"""
+    basis_fp.seek(0, 2)
+    extent_map = ExtentMap()
+    extent_map.add(basis_fp.tell(), BASIS, 0)
+    literal_fp = tempfile.SpooledTemporaryFile(literal_memory)
+    for delta_fp in delta_fps:
+        extent_map = compose_delta(extent_map, delta_fp, literal_fp)
+        assert not delta_fp.close()
+    return ComposedFile(extent_map, basis_fp, literal_fp)
@@ -44,6 +44,18 @@ class FileWrapper:
         self.sha1.update(buf)
         return buf
 
+    def readinto(self, buf):
+        """Read into writable buffer buf, return number of bytes read"""
+        assert not self.closed
+        if hasattr(self.fileobj, "readinto"):
+            length = self.fileobj.readinto(buf)
+        else:
+            data = self.fileobj.read(len(buf))
+            length = len(data)
+            buf[:length] = data
+        self.sha1.update(memoryview(buf)[:length])
+        return length
+
     def close(self):
         return Report(self.fileobj.close(), self.sha1.hexdigest())
 
@@ -19,7 +19,8 @@
 """Provides functions and *ITR classes, for writing increment files"""
 
 import os
-from . import Globals, Time, rpath, Rdiff, log, statistics, robust
+from . import Globals, Time, rpath, Rdiff, log, statistics, robust, \
+    compression
 
 
 def Increment(new, mirror, incpref):
@@ -49,9 +50,49 @@ def iscompressed(mirror):
 
 
 def makesnapshot(mirror, incpref):
+    """Copy mirror to incfile, since new is quite different"""
+    compress = iscompressed(mirror)
+    if compress and mirror.isreg():
+        snapshotrp = get_inc(incpref,
+                             b"snapshot." + compression.get_suffix())
+    else:
+        snapshotrp = get_inc(incpref, b"snapshot")
+
+    if mirror.isspecial():  # check for errors when creating special increments
+        eh = robust.get_error_handler("SpecialFileError")
+        if robust.check_common_error(eh, rpath.copy_with_attribs,
+                                     (mirror, snapshotrp, compress)) == 0:
+            snapshotrp.setdata()
+            if snapshotrp.lstat(): snapshotrp.delete()
+            snapshotrp.touch()
+    else:
+        rpath.copy_with_attribs(mirror, snapshotrp, compress)
+    return snapshotrp
 
 
 def makediff(new, mirror, incpref):
+    """Make incfile which is a diff new -> mirror"""
+    compress = iscompressed(mirror)
+    if compress: diff = get_inc(incpref, b"diff." + compression.get_suffix())
+    else: diff = get_inc(incpref, b"diff")
+
+    old_new_perms, old_mirror_perms = (None, None)
+    if Globals.process_uid != 0:
+        # Check for unreadable files
+        if not new.readable():
+            old_new_perms = new.getperms()
+            new.chmod(0o400 | old_new_perms)
+        if not mirror.readable():
+            old_mirror_perms = mirror.getperms()
+            mirror.chmod(0o400 | old_mirror_perms)
+
+    Rdiff.write_delta(new, mirror, diff, compress)
+
+    if old_new_perms: new.chmod(old_new_perms)
+    if old_mirror_perms: mirror.chmod(old_mirror_perms)
+
+    rpath.copy_attribs_inc(mirror, diff)
+    return diff
 
 
 def makedir(mirrordir, incpref):
@@ -19,9 +19,9 @@
 """Convert an iterator to a file object and vice-versa"""
 
 import pickle
-import array
 import types
-from . import Globals, C, robust, log, rpath
+import collections
+from . import Globals, C, robust, log, rpath, rorpcodec
 
 
 class IterFileException(Exception):
@@ -33,12 +33,27 @@ class UnwrapFile:
 
     def __init__(self, file):
         self.file = file
+        self.index_interner = rpath.IndexInterner()
+
+    def _decode(self, type, data):
+        """Return the object encoded in data
+
+		types "n" and "N" are RORPaths in the encoding of rorpcodec,
+		everything else that isn't file data is pickled.
+
+		"""
+        if type == b"n" or type == b"N":
+            index, data = rorpcodec.decode(data)
+            return rpath.RORPath(self.index_interner.intern(index), data)
+        return pickle.loads(data)
 
     def _get(self):
         """Return pair (type, data) next in line on the file
 
 		type is a single character which is either
 		"o" for an object,
+		"n" for a RORPath in the compact encoding of rorpcodec,
+		"N" for such a RORPath whose file is the next record,
 		"f" for file,
 		"c" for a continution of a file,
 		"h" for the close value of a file
@@ -46,9 +61,18 @@ class UnwrapFile:
 		None if no more data can be read.
 
 		Data is either the file's data, if type is "c" or "f", or the
-		actual object if the type is "o", "e", or "r"
+		actual object if the type is "o", "n", "e", or "r"
 
 		"""
+        header = self.file.read(8)
+        if not header: return None, None
+        assert len(header) == 8, "Header %s is only %d bytes" % (header,
+                                                                 len(header))
+        type = header[0:1]
+        length = int.from_bytes(header[1:], byteorder='big')
+        buf = self.file.read(length)
+        if type in b"oehn": return type, self._decode(type, buf)
+        return type, buf
 
 
 
@@ -67,7 +91,14 @@ class IterWrappingFile(UnwrapFile):
     def __iter__(self):
         return self
 
-
+    def __next__(self):
+        if self.currently_in_file:
+            self.currently_in_file.close()  # no error checking by this point
+        type, data = self._get()
+        if not type: raise StopIteration
+        if type == b"o" or type == b"e" or type == b"n": return data
+        elif type == b"f": return IterVirtualFile(self, data)
+        else: raise IterFileException("Bad file type %s" % (type, ))
 
 
 class IterVirtualFile(UnwrapFile):
@@ -86,7 +117,58 @@ class IterVirtualFile(UnwrapFile):
 		IterVirtualFile.
 
 		"""
+        UnwrapFile.__init__(self, iwf.file)
+        self.iwf = iwf
+        self.buffer = bytearray(initial_data)
+        self.closed = None
+        self.close_value = None
+        if initial_data: iwf.currently_in_file = self
+        else: self.set_close_val()
+
+    def read(self, length=-1):
+        """Read length bytes from the file, updating buffers as necessary"""
+        assert not self.closed
+        while ((length < 0 or len(self.buffer) < length)
+               and self.iwf.currently_in_file is self):
+            self.addtobuffer()
+        if length < 0: length = len(self.buffer)
+        return_val = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        return return_val
+
+    def addtobuffer(self):
+        """Read the next block of the file into the buffer
+
+		An empty block marks the end of the file, and is followed by
+		the close value.
 
+		"""
+        type, data = self.iwf._get()
+        if type == b"c":
+            if data: self.buffer += data
+            else:
+                self.iwf.currently_in_file = None
+                self.set_close_val()
+        elif type == b"e":
+            self.iwf.currently_in_file = None
+            raise data
+        else: raise IterFileException("Bad file type %s in file" % (type, ))
+
+    def set_close_val(self):
+        """Read the close value of the file, which follows its data"""
+        type, data = self.iwf._get()
+        if type != b"h":
+            raise IterFileException("Expected close value, got type %s" %
+                                    (type, ))
+        self.close_value = data
+
+    def close(self):
+        """Read and discard the rest of the file, return close value"""
+        while self.iwf.currently_in_file is self:
+            self.addtobuffer()
+            del self.buffer[:]
+        self.closed = 1
+        return self.close_value
 
 
 class FileWrappingIter:
@@ -103,7 +185,57 @@ class FileWrappingIter:
 	blocks can identify themselves as continuations.
 
 	"""
+    # If set, RORPaths without files are sent in the compact encoding
+    # of rorpcodec, which the reading side must support.
+    rorp_codec = None
+
+    def __init__(self, iter):
+        """Initialize with iter"""
+        self.iter = iter
+        # The buffer is a queue of memoryviews, so nothing is copied
+        # until read() joins the ones it returns.
+        self.buf, self.buf_size = collections.deque(), 0
+        self.currently_in_file = None
+        self.closed = None
+
+    def read(self, length):
+        """Return next length bytes in file"""
+        assert not self.closed
+        while self.buf_size < length:
+            if not self.addtobuffer(): break
+        return self.get_from_buffer(length)
+
+    def add_to_buffer(self, *pieces):
+        """Append bytes-like pieces to the buffer without copying them"""
+        for piece in pieces:
+            self.buf.append(memoryview(piece))
+            self.buf_size += len(piece)
 
+    def get_from_buffer(self, length=None):
+        """Remove up to length bytes, or all, from buffer and return them
+
+		This is the only place the buffered data is copied.  A view
+		which is only partly returned is split, not copied.
+
+		"""
+        if length is None or length >= self.buf_size:
+            pieces, self.buf = self.buf, collections.deque()
+            self.buf_size = 0
+            return b"".join(pieces)
+
+        pieces, size = [], 0
+        while size < length:
+            piece = self.buf.popleft()
+            if size + len(piece) > length:
+                self.buf.appendleft(piece[length - size:])
+                piece = piece[:length - size]
+            pieces.append(piece)
+            size += len(piece)
+        self.buf_size -= size
+        return b"".join(pieces)
+
+    def addtobuffer(self):
+        """Updates self.buf, adds a chunk from the iter.
 
 		Returns None if we have reached the end of the iterator,
 		otherwise return true.
@@ -118,35 +250,54 @@ class FileWrappingIter:
             if hasattr(currentobj, "read") and hasattr(currentobj, "close"):
                 self.currently_in_file = currentobj
                 self.addfromfile(b"f")
+            elif (self.rorp_codec and type(currentobj) is rpath.RORPath
+                  and not currentobj.file):
+                encoded = rorpcodec.encode(currentobj.index, currentobj.data)
+                self.add_to_buffer(b"n", self._i2b(len(encoded), 7),
+                                   encoded)
             else:
                 pickled_data = pickle.dumps(currentobj, 1)
-                self.array_buf.frombytes(b"o")
-                self.array_buf.frombytes(self._i2b(len(pickled_data), 7))
-                self.array_buf.frombytes(pickled_data)
+                self.add_to_buffer(b"o", self._i2b(len(pickled_data), 7),
+                                   pickled_data)
         return 1
 
     def addfromfile(self, prefix_letter):
-        """Read a chunk from the current file and add to array_buf
+        """Read a chunk from the current file and add to the buffer
 
 		prefix_letter and the length will be prepended to the file
 		data.  If there is an exception while reading the file, the
-		exception will be added to array_buf instead.
+		exception will be added to the buffer instead.
 
 		"""
         buf = robust.check_common_error(self.read_error_handler,
-                                        self.currently_in_file.read,
-                                        [Globals.blocksize])
+                                        self.read_chunk, [Globals.blocksize])
         if buf is None:  # error occurred above, encode exception
             self.currently_in_file = None
             excstr = pickle.dumps(self.last_exception, 1)
-            total = b"".join((b'e', self._i2b(len(excstr), 7), excstr))
+            self.add_to_buffer(b'e', self._i2b(len(excstr), 7), excstr)
         else:
-            total = b"".join((prefix_letter, self._i2b(len(buf), 7), buf))
-            if buf == b"":  # end of file
+            self.add_to_buffer(prefix_letter, self._i2b(len(buf), 7), buf)
+            if not buf:  # end of file
                 cstr = pickle.dumps(self.currently_in_file.close(), 1)
                 self.currently_in_file = None
-                total += b"".join((b'h', self._i2b(len(cstr), 7), cstr))
-        self.array_buf.frombytes(total)
+                self.add_to_buffer(b'h', self._i2b(len(cstr), 7), cstr)
+
+    def read_chunk(self, blocksize):
+        """Return up to blocksize bytes of the current file
+
+		Files with readinto() read straight into a new bytearray, so
+		the data isn't copied again until it leaves the buffer.  After
+		a short read, as at the end of the file, the bytearray is cut
+		to the data, which gives back the memory of a mostly unused
+		buffer.
+
+		"""
+        fp = self.currently_in_file
+        if not hasattr(fp, "readinto"): return fp.read(blocksize)
+        buf = bytearray(blocksize)
+        length = fp.readinto(buf)
+        if length < blocksize: del buf[length:]
+        return buf
 
     def read_error_handler(self, exc, blocksize):
         """Log error when reading from file"""
@@ -183,7 +334,8 @@ class MiscIterToFile(FileWrappingIter):
 
 	This expands on the FileWrappingIter by understanding how to
 	process RORPaths with file objects attached.  It adds a new
-	character "r" to mark these.
+	character "r" to mark these, or "n" and "N" for RORPaths in the
+	compact encoding, see addrorp.
 
 	This is how we send signatures and diffs across the line.  As
 	sending each one separately via a read() call would result in a
@@ -202,18 +354,163 @@ class MiscIterToFile(FileWrappingIter):
 		max_buffer_rps is the maximum size of the buffer in rorps.
 
 		"""
+        self.max_buffer_bytes = (max_buffer_bytes
+                                 or Globals.pipeline_max_length * 8)
+        self.max_buffer_rps = max_buffer_rps or Globals.pipeline_max_length
+        self.rorps_in_buffer = 0
+        self.next_in_line = None
+        FileWrappingIter.__init__(self, rpiter)
+
+    def read(self, length=None):
+        """Return some number of bytes, including 0
+
+		Without length, the buffer is filled until it holds
+		max_buffer_bytes or max_buffer_rps, or the iterator is flushed
+		or ends.
+
+		"""
+        assert not self.closed
+        if length is None:
+            while (self.buf_size < self.max_buffer_bytes
+                   and self.rorps_in_buffer < self.max_buffer_rps):
+                if not self.addtobuffer(): break
+        else:
+            while self.buf_size < length:
+                if not self.addtobuffer(): break
+        self.rorps_in_buffer = 0
+        return self.get_from_buffer(length)
+
+    def addtobuffer(self):
+        """Add some number of bytes to the buffer.  Return false if done"""
+        if self.currently_in_file:
+            self.addfromfile(b"c")
+            if not self.currently_in_file: self.rorps_in_buffer += 1
+        else:
+            if self.next_in_line:
+                currentobj, self.next_in_line = self.next_in_line, None
+            else:
+                try:
+                    currentobj = next(self.iter)
+                except StopIteration:
+                    self.addfinal()
+                    return None
+
+            if hasattr(currentobj, "read") and hasattr(currentobj, "close"):
+                self.currently_in_file = currentobj
+                self.addfromfile(b"f")
+            elif currentobj is iterfile.MiscIterFlush:
+                return None
+            elif currentobj is iterfile.MiscIterFlushRepeat:
+                self.add_misc(currentobj)
+                return None
+            elif isinstance(currentobj, rpath.RORPath):
+                self.addrorp(currentobj)
+            else:
+                self.add_misc(currentobj)
+        return 1
+
+    def add_misc(self, obj):
+        """Add an arbitrary pickleable object to the buffer"""
+        pickled_data = pickle.dumps(obj, 1)
+        self.add_to_buffer(b"o", self._i2b(len(pickled_data), 7),
+                           pickled_data)
+        self.rorps_in_buffer += 1
+
+    def addrorp(self, rorp):
+        """Add a rorp to the buffer
+
+		Its file, if any, is sent as the next record, see
+		FileToMiscIter.get_rorp.  With self.rorp_codec the rorp is sent
+		in the compact encoding, as type "N" if a file follows and "n"
+		otherwise.
+
+		"""
+        if rorp.file: self.next_in_line = rorp.file
+        else: self.rorps_in_buffer += 1
+        if self.rorp_codec:
+            encoded = rorpcodec.encode(rorp.index, rorp.data)
+            type = b"N" if rorp.file else b"n"
+            self.add_to_buffer(type, self._i2b(len(encoded), 7), encoded)
+        else:
+            pickled_data = pickle.dumps(
+                (rorp.index, rorp.data, 1 if rorp.file else 0), 1)
+            self.add_to_buffer(b"r", self._i2b(len(pickled_data), 7),
+                               pickled_data)
 
+    def addfinal(self):
+        """Signal the end of the iterator to the other end"""
+        self.add_to_buffer(b"z", self._i2b(0, 7))
+
+    def close(self):
+        self.closed = 1
 
 
 class FileToMiscIter(IterWrappingFile):
+    """Take a MiscIterToFile and turn it back into a iterator"""
 
+    def __init__(self, file):
+        IterWrappingFile.__init__(self, file)
+        self.buf, self.buf_pos = b"", 0
+
+    def _get(self):
+        """Return (type, data or object) pair
 
 		This is like UnwrapFile._get() but reads in variable length
 		blocks.  Also type "z" is allowed, which means end of
 		iterator.  An empty read() is not considered to mark the end
 		of remote iter.
 
+		Records are cut out of the block with a memoryview and
+		self.buf_pos moved past them, so the rest of the block is not
+		copied for each record.
+
+		"""
+        if self.buf_pos >= len(self.buf):
+            self.buf, self.buf_pos = self.file.read(), 0
+            if not self.buf: return None, None
+        pos = self.buf_pos
+        assert len(self.buf) - pos >= 8, "Unexpected end of MiscIter file"
+        type = self.buf[pos:pos + 1]
+        length = int.from_bytes(self.buf[pos + 1:pos + 8], byteorder='big')
+        data = memoryview(self.buf)[pos + 8:pos + 8 + length]
+        self.buf_pos = pos + 8 + length
+        if type in b"fcz": return type, bytes(data)
+        return type, self._decode(type, data)
+
+    def __next__(self):
+        """Return next object in iter, or raise StopIteration"""
+        if self.currently_in_file: self.currently_in_file.close()
+        type = None
+        while not type:
+            type, data = self._get()
+        if type == b"z": raise StopIteration
+        elif type == b"r": return self.get_rorp(data)
+        elif type == b"N":
+            data.setfile(self.get_file(*self._get()))
+            return data
+        elif type == b"f" or type == b"e": return self.get_file(type, data)
+        elif type == b"o" or type == b"n": return data
+        else: raise IterFileException("Bad file type %s" % (type, ))
+
+    def get_rorp(self, pickled_tuple):
+        """Return rorp that data represents"""
+        index, data_dict, num_files = pickled_tuple
+        rorp = rpath.RORPath(index, data_dict)
+        if num_files:
+            assert num_files == 1, "Only one file accepted right now"
+            rorp.setfile(self.get_file(*self._get()))
+        return rorp
+
+    def get_file(self, type, data):
+        """Return file object of the file record (type, data)
+
+		A file which couldn't be read on the other side is sent as its
+		exception, which is raised when the returned file is read.
+
 		"""
+        if type == b"f": return IterVirtualFile(self, data)
+        if type == b"e": return ErrorFile(data)
+        raise IterFileException("Expected file, got type %s" % (type, ))
 
 
 
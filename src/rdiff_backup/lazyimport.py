@@ -0,0 +1,70 @@
+# Copyright 2019 The rdiff-backup project
+#
+# This file is part of rdiff-backup.
+#
+# rdiff-backup is free software; you can redistribute it and/or modify
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# rdiff-backup is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rdiff-backup; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+"""Import rdiff-backup modules when they are first used
+
+The connection module must have every module a remote side may call
+in its namespace, and Main needs all the modules for the different
+actions.  Importing all of them costs more than many short sessions,
+like a server answering --list-increments, take otherwise.  A module
+returned by lazy_import is only executed the first time one of its
+attributes is looked up.  The modules are the usual ones, so this
+doesn't change what Security lets the remote side call.
+
+Before Python 3.12, two threads using a lazy module at the same time
+can both execute it.  So modules which worker threads use, like
+librsync and statistics, have to be imported the usual way.
+
+"""
+
+import sys
+import types
+import importlib.util
+
+
+def lazy_import(name):
+    """Return module rdiff_backup.name, executing it on first use
+
+	The module is put in sys.modules and in the package right away,
+	so later imports of it get the same module object.  It must be a
+	Python module, not an extension module like C.
+
+	"""
+    fullname = "%s.%s" % (__package__, name)
+    try:
+        return sys.modules[fullname]
+    except KeyError:
+        pass
+    spec = importlib.util.find_spec(fullname)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[fullname] = module
+    spec.loader.exec_module(module)
+    setattr(sys.modules[__package__], name, module)
+    return module
+
+
+def is_loaded(module):
+    """Return true if module has already been executed
+
+	Until it is executed, a lazy module is of a subclass of
+	ModuleType.  Looking at any of its attributes, even __spec__,
+	would execute it.
+
+	"""
+    return type(module) is types.ModuleType
@@ -44,6 +44,20 @@ class librsyncError(Exception):
 
 class LikeFile:
 
+    def readinto(self, buf):
+        """Read into writable buffer buf, return number of bytes read
+
+		Like read, but the output is copied once, into buf, instead of
+		into a slice of self.outbuf and then into a new bytes object.
+
+		"""
+        length = len(buf)
+        while not self.eof and len(self.outbuf) < length:
+            self._add_to_outbuf_once()
+        real_len = min(length, len(self.outbuf))
+        memoryview(buf)[:real_len] = memoryview(self.outbuf).cast("B")[:real_len]
+        del self.outbuf[:real_len]
+        return real_len
 
 
 class SigFile(LikeFile):
@@ -80,13 +94,18 @@ class DeltaFile(LikeFile):
 class PatchedFile(LikeFile):
     """File-like object which applies a librsync delta incrementally"""
 
-    def __init__(self, basis_file, delta_file):
+    def __init__(self, basis_file, delta_file, use_mmap=0, read_ahead=0):
         """PatchedFile initializer - call with basis delta
 
 		Here basis_file must be a true Python file, because we may
 		need to seek() around in it a lot, and this is done in C.
 		delta_file only needs read() and close() methods.
 
+		If use_mmap is true and basis_file is a regular file, it is
+		mapped into memory and read from there.  Otherwise it is read
+		through a buffer of read_ahead bytes, or of the C library's
+		default size if read_ahead is 0.
+
 		"""
         LikeFile.__init__(self, delta_file)
         if hasattr(basis_file, 'file'):
@@ -96,7 +115,8 @@ class PatchedFile(LikeFile):
         if not (self.basis_file.fileno() and self.basis_file.seekable()):
             raise TypeError("basis_file must be a (true) file")
         try:
-            self.maker = _librsync.new_patchmaker(self.basis_file)
+            self.maker = _librsync.new_patchmaker(self.basis_file, use_mmap,
+                                                  read_ahead)
         except _librsync.librsyncError as e:
             raise librsyncError(str(e))
 
@@ -121,6 +141,7 @@ class SigGenerator:
             self.sig_maker = _librsync.new_sigmaker(blocksize)
         except _librsync.librsyncError as e:
             raise librsyncError(str(e))
+        self.blocksize = blocksize
         self.gotsig = None
         self.buffer = b""
         self.sig_string = b""
@@ -130,7 +151,7 @@ class SigGenerator:
         if self.gotsig:
             raise librsyncError("SigGenerator already provided signature")
         self.buffer += buf
-        while len(self.buffer) >= blocksize:
+        while len(self.buffer) >= self.blocksize:
             if self.process_buffer():
                 raise librsyncError("Premature EOF received from sig_maker")
 
@@ -148,4 +169,5 @@ class SigGenerator:
         """Return signature over given data"""
         while not self.process_buffer():
             pass  # keep running until eof
+        self.gotsig = 1
         return self.sig_string
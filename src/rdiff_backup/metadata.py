@@ -54,7 +54,12 @@ field names and values.
 """
 
 
-from . import log, Globals, rpath, Time, robust, increment, rorpiter
+import bisect
+import gzip
+import struct
+import zlib
+from . import log, Globals, rpath, Time, robust, increment, rorpiter, \
+    compression
 
 
 class ParsingError(Exception):
@@ -117,7 +122,15 @@ def quote_path(path_string):
 def unquote_path(quoted_string):
 
 
+# Indicies read from metadata files share their leading components
+_index_interner = rpath.IndexInterner()
+
+
 def quoted_filename_to_index(quoted_filename):
+    """Return tuple index given quoted filename"""
+    if quoted_filename == b'.': return ()
+    return _index_interner.intern(
+        tuple(unquote_path(quoted_filename).split(b'/')))
 
 
 class FlatExtractor:
@@ -176,6 +189,472 @@ class MetadataFile(FlatFile):
     _prefix = b"mirror_metadata"
     _extractor = RorpExtractor
     _object_to_record = staticmethod(RORP2Record)
+    _index_block_size = 256 * 1024  # Uncompressed bytes per index entry
+
+    def __new__(cls, rp_base, mode, *args, **kwargs):
+        """Return a BinaryMetadataFile instead if the format calls for it
+
+		New files are written in the format set by
+		Globals.metadata_format, existing files are read in the format
+		they were written in.
+
+		"""
+        if cls is MetadataFile:
+            if mode[0] == 'w': use_binary = Globals.metadata_format == "binary"
+            else: use_binary = is_binary_metadata(rp_base)
+            if use_binary: cls = BinaryMetadataFile
+        return object.__new__(cls)
+
+    def __init__(self, rp_base, mode, check_path=1, compress=1, callback=None):
+        """Like FlatFile.__init__, but also write a sidecar index
+
+		When writing a regular mirror_metadata file, the records are
+		compressed as a series of gzip members, and a new member is
+		started every _index_block_size bytes of records, so it can be
+		listed in the sidecar index written on closing.
+
+		"""
+        self._index_entries = None
+        if mode[0] != 'w' or not check_path or not compress:
+            return FlatFile.__init__(self, rp_base, mode, check_path,
+                                     compress, callback)
+
+        assert (rp_base.isincfile()
+                and rp_base.getincbase_bname() == self._prefix), rp_base
+        if not rp_base.isinccompressed():
+            rp_base = rp_base.get_parent_rp().append(rp_base.dirsplit()[1] +
+                                                     b".gz")
+        assert not rp_base.lstat(), rp_base
+        self.rp, self.mode, self.callback = rp_base, 'w', callback
+        self.fileobj = compression.ParallelGzipFile(
+            rp_base.open("wb"), Globals.compression_threads)
+        self._index_entries = []
+
+    def write_object(self, object):
+        """Write record of object, starting a new block if necessary"""
+        if self._index_entries is None:
+            return FlatFile.write_object(self, object)
+        if self.fileobj.member_size >= self._index_block_size:
+            self._index_entries.append((self.fileobj.end_member(),
+                                        object.index))
+        self.fileobj.write(self._object_to_record(object))
+
+    def get_objects(self, restrict_index=None):
+        """Return iterator of rorps, seeking to restrict_index if possible"""
+        if restrict_index and self.mode[0] == 'r':
+            offset = find_index_offset(self.rp, restrict_index)
+            if offset:
+                self.fileobj.close()
+                self.fileobj = MemberGzipFile(self.rp.open("rb"), offset)
+        return FlatFile.get_objects(self, restrict_index)
+
+    def close(self):
+        """Close file, and write the sidecar index if there is one"""
+        if self._index_entries is None: return FlatFile.close(self)
+        result = self.fileobj.close()
+        member_offsets = self.fileobj.member_offsets
+        self.fileobj = None
+        self.rp.fsync_with_dir()
+        self.rp.setdata()
+        write_index(self.rp, [(member_offsets[member], index)
+                              for member, index in self._index_entries])
+        if self.callback: self.callback(self.rp)
+        return result
+
+
+class MemberGzipFile(gzip.GzipFile):
+    """Read-only GzipFile of an open file, starting at a gzip member
+
+	The file is skipped to offset first, which must be where a member
+	starts.  Files of remote rpaths can't seek, so with those the
+	bytes before offset are read and dropped instead.  Closing the
+	GzipFile also closes the file.
+
+	"""
+
+    def __init__(self, fileobj, offset=0):
+        if hasattr(fileobj, "seek"): fileobj.seek(offset)
+        else:
+            while offset > 0:
+                buf = fileobj.read(min(offset, Globals.blocksize))
+                if not buf: break
+                offset -= len(buf)
+        gzip.GzipFile.__init__(self, mode="rb", fileobj=fileobj)
+        self.rawfile = fileobj
+
+    def close(self):
+        try:
+            gzip.GzipFile.close(self)
+        finally:
+            self.rawfile.close()
+
+
+# The sidecar index of a compressed mirror_metadata file is kept in the
+# metadata_index directory next to it, under the same name.  Its first
+# line is the size and mtime of the mirror_metadata file, so an index
+# which doesn't belong to the file anymore is ignored.  Every other line has
+# the offset of a gzip member and the quoted path of the first record
+# in it.  The first member, at offset 0, isn't listed.
+index_dir_name = b"metadata_index"
+
+
+def get_index_rp(rp):
+    """Return the RPath of the sidecar index of mirror_metadata file rp"""
+    return rp.get_parent_rp().append_path(index_dir_name).append(
+        rp.dirsplit()[1])
+
+
+def write_index(rp, entries):
+    """Write sidecar index of rp, given list of (offset, index) pairs
+
+	Indexes of mirror_metadata files which don't exist anymore are
+	removed at the same time.
+
+	"""
+    index_rp = get_index_rp(rp)
+    index_dir = index_rp.get_parent_rp()
+    if not index_dir.lstat(): index_dir.mkdir()
+    for filename in index_dir.listdir():
+        if not rp.get_parent_rp().append(filename).lstat():
+            index_dir.append(filename).delete()
+
+    str_list = [b"%d %d\n" % (rp.getsize(), rp.getmtime())]
+    for offset, index in entries:
+        str_list.append(b"%d %b\n" % (offset, quote_path(b"/".join(index))))
+    index_rp.write_bytes(b"".join(str_list))
+
+
+def find_index_offset(rp, index):
+    """Return offset to start reading rp at to find index, or 0"""
+    index_rp = get_index_rp(rp)
+    if not index_rp.lstat(): return 0
+    fp = index_rp.open("rb")
+    lines = fp.read().split(b"\n")
+    fp.close()
+    try:
+        if (list(map(int, lines[0].split()))
+                != [rp.getsize(), rp.getmtime()]):
+            return 0
+        offsets, first_indexes = [], []
+        for line in lines[1:-1]:
+            offset, path = line.split(b" ", 1)
+            offsets.append(int(offset))
+            first_indexes.append(path_to_index(unquote_path(path)))
+    except ValueError:
+        log.Log("Ignoring bad metadata index %s" % index_rp.get_safepath(), 2)
+        return 0
+    i = bisect.bisect_right(first_indexes, index)
+    if i == 0: return 0
+    return offsets[i - 1]
+
+
+# The binary mirror_metadata format starts with binary_magic and a
+# version byte.  Then come blocks of records, each a 4 byte length
+# followed by that many bytes of zlib compressed records.  After the
+# blocks comes the block index, which holds the file offset and first
+# path of every block, and then the trailer, which says where the block
+# index starts.  A record is its length, the file's path, the fixed
+# size integer fields, and then the length and value of each of the
+# variable size fields present.
+binary_magic = b"RDBM"
+binary_version = 1
+_binary_header = struct.Struct("<4sB")
+_binary_trailer = struct.Struct("<QI4s")  # index offset, index length, magic
+_binary_index_entry = struct.Struct("<QI")  # block offset, path length
+_binary_length = struct.Struct("<I")
+_binary_fixed = struct.Struct("<BI8q")  # type, field mask, int fields
+
+_binary_types = (None, "reg", "dir", "sym", "dev", "fifo", "sock")
+_binary_type_codes = dict((t, i) for i, t in enumerate(_binary_types))
+_binary_int_fields = ("size", "mtime", "uid", "gid", "perms", "nlink",
+                      "inode", "devloc")
+_binary_var_fields = ("uname", "gname", "sha1", "linkname", "mirrorname",
+                      "incname", "devnums", "resourcefork", "carbonfile")
+
+
+def path_to_index(path):
+    """Return index from the path stored in a binary record"""
+    if not path: return ()
+    return tuple(path.split(b"/"))
+
+
+def RORP2BinaryRecord(rorpath):
+    """From RORPath, return binary record of file's metadata
+
+	The same fields as in RORP2Record are stored, so both formats
+	give back the same RORPath.
+
+	"""
+    type = rorpath.gettype()
+    ints, vars = {}, {}
+    if type == "reg":
+        ints['size'] = rorpath.getsize()
+        if rorpath.has_resource_fork():
+            vars['resourcefork'] = rorpath.get_resource_fork() or b""
+        if rorpath.has_carbonfile():
+            vars['carbonfile'] = carbonfile2string(
+                rorpath.get_carbonfile()).encode()
+        if Globals.preserve_hardlinks != 0:
+            numlinks = rorpath.getnumlinks()
+            if numlinks > 1:
+                ints['nlink'] = numlinks
+                ints['inode'] = rorpath.getinode()
+                ints['devloc'] = rorpath.getdevloc()
+        if rorpath.has_sha1():
+            vars['sha1'] = rorpath.get_sha1().encode('ascii')
+    elif type == "sym":
+        vars['linkname'] = rorpath.readlink()
+    elif type == "dev":
+        major, minor = rorpath.getdevnums()
+        if rorpath.isblkdev(): devchar = b"b"
+        else:
+            assert rorpath.ischardev()
+            devchar = b"c"
+        vars['devnums'] = b"%b %i %i" % (devchar, major, minor)
+
+    if type is not None:
+        if type != 'sym' and type != 'dev':
+            ints['mtime'] = rorpath.getmtime()
+        ints['uid'], ints['gid'] = rorpath.getuidgid()
+        ints['perms'] = rorpath.getperms()
+        if rorpath.getuname(): vars['uname'] = rorpath.getuname().encode()
+        if rorpath.getgname(): vars['gname'] = rorpath.getgname().encode()
+        if rorpath.has_alt_mirror_name():
+            vars['mirrorname'] = rorpath.get_alt_mirror_name()
+        elif rorpath.has_alt_inc_name():
+            vars['incname'] = rorpath.get_alt_inc_name()
+
+    mask, int_values = 0, []
+    for i, field in enumerate(_binary_int_fields):
+        if field in ints:
+            mask |= 1 << i
+            int_values.append(ints[field])
+        else: int_values.append(0)
+    str_list = []
+    for i, field in enumerate(_binary_var_fields):
+        if field in vars:
+            mask |= 1 << (i + len(_binary_int_fields))
+            str_list.append(_binary_length.pack(len(vars[field])))
+            str_list.append(vars[field])
+
+    path = b"/".join(rorpath.index)
+    record = b"".join([
+        _binary_length.pack(len(path)), path,
+        _binary_fixed.pack(_binary_type_codes[type], mask, *int_values)
+    ] + str_list)
+    return _binary_length.pack(len(record)) + record
+
+
+def BinaryRecord2RORP(record, offset=0):
+    """Return RORPath from binary record starting at offset
+
+	Like Record2RORP, this writes the data dictionary directly.  The
+	record's length prefix is expected to be skipped already.
+
+	"""
+    path_length, = _binary_length.unpack_from(record, offset)
+    offset += 4
+    index = path_to_index(record[offset:offset + path_length])
+    offset += path_length
+    fixed = _binary_fixed.unpack_from(record, offset)
+    offset += _binary_fixed.size
+    type, mask = _binary_types[fixed[0]], fixed[1]
+
+    data_dict = {'type': type}
+    for i, field in enumerate(_binary_int_fields):
+        if mask & (1 << i): data_dict[field] = fixed[i + 2]
+    if type is not None: data_dict['uname'] = data_dict['gname'] = None
+    for i, field in enumerate(_binary_var_fields):
+        if not mask & (1 << (i + len(_binary_int_fields))): continue
+        length, = _binary_length.unpack_from(record, offset)
+        offset += 4
+        data_dict[field] = record[offset:offset + length]
+        offset += length
+
+    for field in ('uname', 'gname', 'sha1'):
+        if data_dict.get(field) is not None:
+            data_dict[field] = data_dict[field].decode()
+    if 'devnums' in data_dict:
+        devchar, major_str, minor_str = data_dict['devnums'].split(b" ")
+        data_dict['devnums'] = (devchar.decode('ascii'), int(major_str),
+                                int(minor_str))
+    if 'carbonfile' in data_dict:
+        data_dict['carbonfile'] = string2carbonfile(
+            data_dict['carbonfile'].decode())
+    return rpath.RORPath(index, data_dict)
+
+
+def is_binary_metadata(rp):
+    """True if rp is a mirror_metadata file in the binary format
+
+	The format is recognized by the magic at the start of the file, so
+	this works whatever rp is named.
+
+	"""
+    if not rp.lstat(): return None
+    fp = rp.open("rb")
+    magic = fp.read(len(binary_magic))
+    fp.close()
+    return magic == binary_magic
+
+
+class BinaryMetadataFile(MetadataFile):
+    """Store/retrieve mirror_metadata in the binary, indexed format
+
+	Compared to the text format, records are quicker to encode and
+	parse, and the block index allows get_objects to start reading
+	right at the block containing the requested index instead of at
+	the beginning of the file.  The blocks are compressed with zlib,
+	so the file itself is never gzipped and has no .gz suffix.
+
+	"""
+    _block_size = 64 * 1024  # Uncompressed size of a block of records
+
+    def __init__(self, rp_base, mode, check_path=1, compress=1, callback=None):
+        """Open rp_base for reading ('r') or writing ('w')
+
+		compress is accepted for compatibility with FlatFile, blocks are
+		always compressed.
+
+		"""
+        assert mode[0] in "rw", mode
+        self.rp, self.mode, self.callback = rp_base, mode[0], callback
+        if check_path:
+            assert (rp_base.isincfile()
+                    and rp_base.getincbase_bname() == self._prefix), rp_base
+        if self.mode == 'w':
+            assert not rp_base.lstat(), rp_base
+            self.fileobj = rp_base.open("wb")
+            self.fileobj.write(_binary_header.pack(binary_magic,
+                                                   binary_version))
+            self._offset = _binary_header.size
+            self._record_buffer, self._buffer_size = [], 0
+            self._block_index, self._block_first_path = [], None
+        else:
+            self.fileobj = rp_base.open("rb")
+            magic, version = _binary_header.unpack(
+                self.fileobj.read(_binary_header.size))
+            if magic != binary_magic:
+                raise ParsingError("%s is not a binary metadata file" %
+                                   (rp_base.get_safepath(), ))
+            if version > binary_version:
+                raise ParsingError(
+                    "Binary metadata file %s has unknown version %d" %
+                    (rp_base.get_safepath(), version))
+
+    def write_object(self, object):
+        """Convert one object to a record and write to file"""
+        if self._block_first_path is None:
+            self._block_first_path = b"/".join(object.index)
+        record = RORP2BinaryRecord(object)
+        self._record_buffer.append(record)
+        self._buffer_size += len(record)
+        if self._buffer_size >= self._block_size: self._write_block()
+
+    def _write_block(self):
+        """Compress and write the buffered records as one block"""
+        block = zlib.compress(b"".join(self._record_buffer))
+        self._block_index.append((self._offset, self._block_first_path))
+        self.fileobj.write(_binary_length.pack(len(block)))
+        self.fileobj.write(block)
+        self._offset += _binary_length.size + len(block)
+        self._record_buffer, self._buffer_size = [], 0
+        self._block_first_path = None
+
+    def _write_index(self):
+        """Write the block index and the trailer"""
+        str_list = []
+        for offset, path in self._block_index:
+            str_list.append(_binary_index_entry.pack(offset, len(path)))
+            str_list.append(path)
+        index = zlib.compress(b"".join(str_list))
+        self.fileobj.write(index)
+        self.fileobj.write(
+            _binary_trailer.pack(self._offset, len(index), binary_magic))
+
+    def _read_index(self):
+        """Return (index offset, list of (first index, offset) of blocks)"""
+        self.fileobj.seek(-_binary_trailer.size, 2)
+        index_offset, index_length, magic = _binary_trailer.unpack(
+            self.fileobj.read(_binary_trailer.size))
+        if magic != binary_magic:
+            raise ParsingError("Binary metadata file %s is truncated" %
+                               (self.rp.get_safepath(), ))
+        self.fileobj.seek(index_offset)
+        index = zlib.decompress(self.fileobj.read(index_length))
+        blocks, pos = [], 0
+        while pos < len(index):
+            offset, path_length = _binary_index_entry.unpack_from(index, pos)
+            pos += _binary_index_entry.size
+            blocks.append((path_to_index(index[pos:pos + path_length]),
+                           offset))
+            pos += path_length
+        return index_offset, blocks
+
+    def _iterate_blocks(self, offset, end_offset):
+        """Yield the uncompressed blocks from offset up to end_offset"""
+        self.fileobj.seek(offset)
+        while offset < end_offset:
+            length, = _binary_length.unpack(
+                self.fileobj.read(_binary_length.size))
+            yield zlib.decompress(self.fileobj.read(length))
+            offset += _binary_length.size + length
+
+    def get_objects(self, restrict_index=None):
+        """Return iterator of objects records from file rp
+
+		If restrict_index is given, only the objects at or below it are
+		returned, starting with the block which may contain it.
+
+		"""
+        assert self.mode == 'r', self.mode
+        index_offset, blocks = self._read_index()
+        if not blocks:
+            self.close()
+            return iter([])
+        if not restrict_index:
+            return self._iterate_objects(blocks[0][1], index_offset)
+        first_indexes = [first_index for first_index, offset in blocks]
+        i = max(bisect.bisect_right(first_indexes, restrict_index) - 1, 0)
+        return self._iterate_starting_with(
+            self._iterate_objects(blocks[i][1], index_offset), restrict_index)
+
+    def _iterate_objects(self, offset, end_offset):
+        """Yield all RORPaths in the blocks from offset to end_offset"""
+        for block in self._iterate_blocks(offset, end_offset):
+            pos = 0
+            while pos < len(block):
+                length, = _binary_length.unpack_from(block, pos)
+                yield BinaryRecord2RORP(block, pos + _binary_length.size)
+                pos += _binary_length.size + length
+        self.close()
+
+    def _iterate_starting_with(self, rorp_iter, index):
+        """Yield only the RORPaths at or below index"""
+        length = len(index)
+        for rorp in rorp_iter:
+            if rorp.index[:length] == index: yield rorp
+            elif rorp.index > index: break
+        if self.fileobj: self.close()
+
+    def get_records(self):
+        """Yield the metadata of the file as text records"""
+        for rorp in self.get_objects():
+            yield RORP2Record(rorp)
+
+    def close(self):
+        """Close file, for when any writing is done"""
+        assert self.fileobj, "File already closed"
+        if self.mode == 'w':
+            if self._record_buffer: self._write_block()
+            self._write_index()
+        result = self.fileobj.close()
+        self.fileobj = None
+        if self.mode == 'w':
+            self.rp.fsync_with_dir()
+            self.rp.setdata()
+            if self.callback: self.callback(self.rp)
+        return result
 
 
 class CombinedWriter:
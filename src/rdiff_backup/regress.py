@@ -137,8 +137,10 @@ def recreate_meta(meta_manager):
         writer.write_object(rorp)
     writer.close()
 
-    finalrp = Globals.rbdir.append(
-        b"mirror_metadata.%b.snapshot.gz" % Time.timetobytes(regress_time))
+    if isinstance(writer, metadata.BinaryMetadataFile): suffix = b""
+    else: suffix = b".gz"
+    finalrp = Globals.rbdir.append(b"mirror_metadata.%b.snapshot%b" %
+                                   (Time.timetobytes(regress_time), suffix))
     assert not finalrp.lstat(), finalrp
     rpath.rename(temprp[0], finalrp)
     if Globals.fsync_directories: Globals.rbdir.fsync()
@@ -19,7 +19,7 @@
 """Read increment files and restore to original"""
 
 
-from . import rorpiter, FilenameMapping
+from . import rorpiter, FilenameMapping, deltachain
 
 
 class RestoreError(Exception):
@@ -31,9 +31,15 @@ def Restore(mirror_rp, inc_rpath, target, restore_to_time):
     MirrorS = mirror_rp.conn.restore.MirrorStruct
     TargetS = target.conn.restore.TargetStruct
 
-    MirrorS.set_mirror_and_rest_times(restore_to_time)
-    MirrorS.initialize_rf_cache(mirror_rp, inc_rpath)
+    # These don't return anything, so they are sent without waiting,
+    # and the target iter is started while the mirror side is busy.
+    times_set = mirror_rp.conn.reval_async(
+        "restore.MirrorStruct.set_mirror_and_rest_times", restore_to_time)
+    cache_set = mirror_rp.conn.reval_async(
+        "restore.MirrorStruct.initialize_rf_cache", mirror_rp, inc_rpath)
     target_iter = TargetS.get_initial_iter(target)
+    times_set.result()
+    cache_set.result()
     diff_iter = MirrorS.get_diffs(target_iter)
     TargetS.patch(target, diff_iter)
     MirrorS.close_rf_cache()
@@ -277,16 +283,22 @@ class RestoreFile:
         if last_inc.getinctype() == b'dir': rorp.data['type'] = 'dir'
         return rorp
 
+    def get_delta_fps(self):
+        """Yield file objects of the diffs following the first increment"""
+        for inc_diff in self.relevant_incs[1:]:
+            log.Log("Applying patch %s" % (inc_diff.get_safeindexpath(), ), 7)
+            assert inc_diff.getinctype() == b'diff'
+            yield inc_diff.open("rb", inc_diff.isinccompressed())
+
     def get_restore_fp(self):
         """Return file object of restored data"""
 
         def get_fp():
             current_fp = self.get_first_fp()
-            for inc_diff in self.relevant_incs[1:]:
-                log.Log("Applying patch %s" % (inc_diff.get_safeindexpath(), ),
-                        7)
-                assert inc_diff.getinctype() == b'diff'
-                delta_fp = inc_diff.open("rb", inc_diff.isinccompressed())
+            delta_fps = self.get_delta_fps()
+            if Globals.compose_deltas and len(self.relevant_incs) > 2:
+                return deltachain.compose(current_fp, delta_fps)
+            for delta_fp in delta_fps:
                 new_fp = tempfile.TemporaryFile()
                 Rdiff.write_patched_fp(current_fp, delta_fp, new_fp)
                 new_fp.seek(0)
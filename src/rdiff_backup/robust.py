@@ -18,6 +18,7 @@
 # USA
 """Catch various exceptions given system call"""
 
+import os
 import errno
 import signal
 import zlib
@@ -99,6 +100,27 @@ def listrp(rp):
     return dir_listing
 
 
+def scandirrp(rp):
+    """Like listrp, but return the os.DirEntry objects of local rp
+
+	Besides the name, a DirEntry knows the file type on most file
+	systems, and caches the result of stat().
+
+	"""
+
+    def error_handler(exc):
+        log.Log("Error listing directory %s" % rp.get_safepath(), 2)
+        return []
+
+    def scandir(path):
+        with os.scandir(path) as entries:
+            return list(entries)
+
+    dir_entries = check_common_error(error_handler, scandir, [rp.path])
+    dir_entries.sort(key=lambda entry: entry.name)
+    return dir_entries
+
+
 def signal_handler(signum, frame):
     """This is called when signal signum is caught"""
     raise SignalException(signum)
@@ -0,0 +1,162 @@
+# Copyright 2019 The rdiff-backup project
+#
+# This file is part of rdiff-backup.
+#
+# rdiff-backup is free software; you can redistribute it and/or modify
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# rdiff-backup is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rdiff-backup; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+"""Compact binary encoding of RORPaths for sending over a connection
+
+Pickling the (index, data) pair of every RORPath is a large part of
+the cost of sending many small files.  This module encodes the index
+and the common fields of the data dictionary with struct instead.  A
+field with a value of an unexpected type, like the ea and acl
+objects, is pickled together with the other such fields.
+
+An encoded RORPath is laid out as follows: a header with the length
+of the path, the type code, and a mask saying which fields are
+present; the path (the index joined by "/"); the integer fields; the
+string fields, each preceded by its length; and finally the pickle of
+any remaining fields.
+
+The encoding is only used when both sides of a connection know it, see
+SetConnections.init_rorp_codec.  Globals.rorp_codec_version is the
+version implemented here.
+
+"""
+
+import pickle
+import struct
+
+_header = struct.Struct("<IBI")  # path length, type code, field mask
+_length = struct.Struct("<I")
+_none_length = 0xffffffff  # length of a string field whose value is None
+
+_types = (None, "reg", "dir", "sym", "dev", "fifo", "sock")
+_type_codes = dict((t, i) for i, t in enumerate(_types))
+_int_fields = ("size", "perms", "uid", "gid", "mtime", "atime", "ctime",
+               "inode", "devloc", "nlink")
+_str_fields = ("uname", "gname", "sha1")
+_bytes_fields = ("linkname", "mirrorname", "incname")
+_var_fields = _str_fields + _bytes_fields
+_bits = dict((field, 1 << i)
+             for i, field in enumerate(_int_fields + _var_fields))
+_extras_bit = 1 << len(_bits)
+
+# Most RORPaths have the same few sets of fields, so the work of
+# sorting the fields of each set into the parts above is only done
+# once, and remembered in these two dictionaries.
+_encoders = {}  # tuple of data keys -> _Layout
+_decoders = {}  # field mask -> _Layout
+
+
+class _Layout:
+    """Which fields go in which part of an encoded RORPath"""
+
+    def __init__(self, fields):
+        self.mask = 0
+        for field in fields:
+            self.mask |= _bits.get(field, 0)
+        self.int_fields = [f for f in _int_fields if f in fields]
+        self.str_fields = [f for f in _str_fields if f in fields]
+        self.bytes_fields = [f for f in _bytes_fields if f in fields]
+        self.ints = struct.Struct("<%dq" % len(self.int_fields))
+        self.extra_fields = [
+            f for f in fields if f not in _bits and f != 'type'
+        ]
+        if self.extra_fields: self.mask |= _extras_bit
+
+
+def _get_encoder(keys):
+    """Return the _Layout for a data dictionary with the given keys"""
+    try:
+        return _encoders[keys]
+    except KeyError:
+        layout = _encoders[keys] = _Layout(keys)
+        return layout
+
+
+def _get_decoder(mask):
+    """Return the _Layout for a RORPath encoded with the given mask"""
+    try:
+        return _decoders[mask]
+    except KeyError:
+        fields = [field for field, bit in _bits.items() if mask & bit]
+        if mask & _extras_bit: fields.append(None)  # any extra field
+        layout = _decoders[mask] = _Layout(fields)
+        return layout
+
+
+def encode(index, data):
+    """Return bytes encoding the index and data dictionary of a RORPath"""
+    layout = _get_encoder(tuple(data))
+    try:
+        ints = layout.ints.pack(*[data[f] for f in layout.int_fields])
+        str_list = []
+        for field in layout.str_fields:
+            value = data[field]
+            if value is None: str_list.append(_length.pack(_none_length))
+            else:
+                value = value.encode()
+                str_list += [_length.pack(len(value)), value]
+        for field in layout.bytes_fields:
+            value = data[field]
+            if not isinstance(value, bytes):
+                raise TypeError("%s is not bytes" % (field, ))
+            str_list += [_length.pack(len(value)), value]
+    except (struct.error, AttributeError, TypeError):
+        # Some value isn't of the usual type, so pickle everything
+        layout, ints, str_list = _get_decoder(_extras_bit), b"", []
+        extras = data.copy()
+    else:
+        if layout.extra_fields:
+            extras = dict((f, data[f]) for f in layout.extra_fields)
+        else: extras = None
+
+    type_code = _type_codes.get(data.get('type', 255), 255)
+    if type_code == 255 and 'type' in data:
+        if extras is None: extras = {}
+        extras['type'] = data['type']
+        layout = _get_decoder(layout.mask | _extras_bit)
+    if extras is not None: str_list.append(pickle.dumps(extras, 4))
+
+    path = b"/".join(index)
+    return b"".join([_header.pack(len(path), type_code, layout.mask), path,
+                     ints] + str_list)
+
+
+def decode(buf):
+    """Return the pair (index, data) encoded in buf by encode()"""
+    path_length, type_code, mask = _header.unpack_from(buf, 0)
+    offset = _header.size
+    path = bytes(buf[offset:offset + path_length])
+    index = tuple(path.split(b"/")) if path else ()
+    offset += path_length
+
+    layout = _get_decoder(mask)
+    data = dict(zip(layout.int_fields, layout.ints.unpack_from(buf, offset)))
+    offset += layout.ints.size
+    if type_code != 255: data['type'] = _types[type_code]
+    for field in layout.str_fields + layout.bytes_fields:
+        length, = _length.unpack_from(buf, offset)
+        offset += _length.size
+        if length == _none_length: data[field] = None
+        else:
+            data[field] = bytes(buf[offset:offset + length])
+            offset += length
+    for field in layout.str_fields:
+        if data[field] is not None: data[field] = data[field].decode()
+
+    if mask & _extras_bit: data.update(pickle.loads(buf[offset:]))
+    return index, data
@@ -27,7 +27,10 @@ files), where files is the number of files attached (usually 1 or
 
 """
 
-
+import io
+import heapq
+import collections
+import concurrent.futures
 from . import Globals, rpath, iterfile, log
 
 
@@ -38,7 +41,45 @@ def CollateIterators(*rorp_iters):
 	iterator yielding tuples like (rorp1, rorp2) with the same
 	index.  If one or the other lacks that index, it will be None
 
+	The heads of the iterators are kept in a heap, so with many
+	iterators, like the increments of a long history, each step only
+	costs a few comparisons per iterator with the smallest index.
+
 	"""
+    iter_num = len(rorp_iters)
+    if iter_num == 2:
+        return Collate2Iters(rorp_iters[0], rorp_iters[1])
+
+    def yield_tuples():
+        # The heap holds (index, iterator number, rorp).  The iterator
+        # numbers are unique, so the rorps themselves are never compared.
+        iters = list(map(iter, rorp_iters))
+        heap = []
+        for i in range(iter_num):
+            for rorp in iters[i]:
+                heap.append((rorp.index, i, rorp))
+                break
+        heapq.heapify(heap)
+
+        while heap:
+            index = heap[0][0]
+            yieldval = [None] * iter_num
+            popped = []
+            while heap and heap[0][0] == index:
+                i = heap[0][1]
+                yieldval[i] = heapq.heappop(heap)[2]
+                popped.append(i)
+            yield IndexedTuple(index, yieldval)
+
+            # Only advance afterwards, like the iterators were read
+            # one tuple at a time.  Each iterator has at most one rorp
+            # in the heap, so one giving an index twice gets two tuples.
+            for i in popped:
+                for rorp in iters[i]:
+                    heapq.heappush(heap, (rorp.index, i, rorp))
+                    break
+
+    return yield_tuples()
 
 
 def Collate2Iters(riter1, riter2):
@@ -102,6 +143,101 @@ def FillInIter(rpiter, rootrp):
         old_index = cur_index
 
 
+class PrefetchedFile:
+    """File-like object holding file data which was read ahead of time
+
+	The data and the close value of the original file are kept, so
+	that, to the reader, this is indistinguishable from the original.
+
+	"""
+
+    def __init__(self, buf, close_val):
+        self.fileobj = io.BytesIO(buf)
+        self.close_val = close_val
+
+    def read(self, length=-1):
+        return self.fileobj.read(length)
+
+    def readinto(self, buf):
+        return self.fileobj.readinto(buf)
+
+    def close(self):
+        """Return close value of the original file"""
+        self.fileobj.close()
+        return self.close_val
+
+
+def _read_attached_file(fp):
+    """Read and close fp, return PrefetchedFile (run in worker thread)
+
+	If reading fails, return an ErrorFile instead, so the exception is
+	raised when the file is read in the main thread, just as it would
+	have been without prefetching.
+
+	"""
+    try:
+        buf = fp.read()
+        return PrefetchedFile(buf, fp.close())
+    except Exception as exc:
+        return iterfile.ErrorFile(exc)
+
+
+def PrefetchFiles(rorp_iter, num_workers, max_bytes=None):
+    """Read the files attached to the rorps of rorp_iter in a thread pool
+
+	Up to 2*num_workers elements are taken from rorp_iter ahead of
+	the consumer, and their attached files (signatures or diffs,
+	usually) are computed and read into memory by num_workers threads.
+	Elements are yielded in the same order they came in, so index order
+	is preserved.
+
+	If max_bytes is set, the total size of the rorps being read ahead
+	is kept below it, so memory use stays bounded.  Regular files
+	larger than max_bytes are not read ahead at all, but are left to
+	be streamed by the consumer as usual.
+
+	When a MiscIterFlush or MiscIterFlushRepeat is received, all
+	pending elements are yielded before it, so flushing the pipeline
+	works like it does without prefetching.
+
+	"""
+    pending = collections.deque()
+    pending_bytes = 0
+
+    def pop_pending():
+        nonlocal pending_bytes
+        rorp, future, size = pending.popleft()
+        pending_bytes -= size
+        if future: rorp.setfile(future.result())
+        return rorp
+
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+        for elem in rorp_iter:
+            if (elem is iterfile.MiscIterFlush
+                    or elem is iterfile.MiscIterFlushRepeat):
+                while pending:
+                    yield pop_pending()
+                yield elem
+                continue
+            if not (isinstance(elem, rpath.RORPath) and elem.file):
+                pending.append((elem, None, 0))
+            else:
+                size = elem.isreg() and elem.getsize() or 0
+                if max_bytes and size > max_bytes:
+                    pending.append((elem, None, 0))
+                else:
+                    while (max_bytes and pending
+                           and pending_bytes + size > max_bytes):
+                        yield pop_pending()
+                    pending.append((elem,
+                                    executor.submit(_read_attached_file,
+                                                    elem.file), size))
+                    pending_bytes += size
+            if len(pending) > 2 * num_workers: yield pop_pending()
+        while pending:
+            yield pop_pending()
+
+
 class IterTreeReducer:
     """Tree style reducer object for iterator
 
@@ -44,7 +44,9 @@ import socket
 import time
 import errno
 import codecs
-from . import Globals, Time, log, user_group, C
+import operator
+from collections.abc import MutableMapping
+from . import Globals, Time, log, user_group, C, compression
 
 try:
     import win32file, winnt
@@ -150,6 +152,145 @@ def make_file_dict(filename):
 
 
 
+_unset = object()  # marks a slot without value in StatData.get_items
+
+
+class StatData(MutableMapping):
+    """Data dictionary of a RORPath with a fixed layout
+
+	Backups keep many RORPaths in caches at the same time, and a dict
+	with a dozen keys takes several times the memory of an object
+	with a slot for each.  So the fields which most files have are
+	kept in slots, an unset slot meaning a missing key, and the rare
+	ones like ea and acl in the extra dictionary.  Otherwise it acts
+	like the dictionary it replaces.
+
+	"""
+    fields = ("type", "size", "perms", "uid", "gid", "uname", "gname",
+              "mtime", "atime", "ctime", "inode", "devloc", "nlink",
+              "devnums", "linkname", "sha1")
+    __slots__ = fields + ("extra", )
+    _field_set = frozenset(fields)
+
+    def __init__(self, data=(), **kwargs):
+        self.extra = None
+        if isinstance(data, StatData): self.set_items(data.get_items())
+        elif hasattr(data, "keys"): self.set_items(data.items())
+        else: self.set_items(data)
+        if kwargs: self.set_items(kwargs.items())
+
+    def set_items(self, items):
+        """Set the (key, value) pairs of items, quicker than update()"""
+        field_set = self._field_set
+        for key, value in items:
+            if key in field_set: setattr(self, key, value)
+            elif self.extra is None: self.extra = {key: value}
+            else: self.extra[key] = value
+
+    def get_items(self):
+        """Return list of the (key, value) pairs, quicker than items()"""
+        items = []
+        for field in self.fields:
+            value = getattr(self, field, _unset)
+            if value is not _unset: items.append((field, value))
+        if self.extra: items.extend(self.extra.items())
+        return items
+
+    def get(self, key, default=None):
+        if key in self._field_set: return getattr(self, key, default)
+        if self.extra is None: return default
+        return self.extra.get(key, default)
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra is None: raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._field_set: setattr(self, key, value)
+        elif self.extra is None: self.extra = {key: value}
+        else: self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._field_set:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self.extra is None: raise KeyError(key)
+        else: del self.extra[key]
+
+    def __contains__(self, key):
+        if key in self._field_set: return hasattr(self, key)
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        for field in self.fields:
+            if hasattr(self, field): yield field
+        if self.extra: yield from self.extra
+
+    def __len__(self):
+        return (len([f for f in self.fields if hasattr(self, f)]) +
+                (len(self.extra) if self.extra else 0))
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, dict(self))
+
+    def __reduce__(self):
+        return (StatData, (dict(self), ))
+
+    def copy(self):
+        """Return a new StatData with the same keys and values"""
+        return StatData(self)
+
+
+class EntryData(StatData):
+    """Data dictionary of a directory entry, only stat'ed when needed
+
+	At first it only holds the file type, which os.scandir knows
+	without stat on most file systems.  Looking up any other key
+	fills in the whole dictionary with make_file_dict.
+
+	"""
+    __slots__ = ("path", "complete")
+    get = MutableMapping.get  # go through __getitem__ to stat if needed
+
+    def __init__(self, entry):
+        StatData.__init__(self, type=get_entry_type(entry))
+        self.path = entry.path
+        self.complete = None
+        if self['type'] is None: self.stat_missing('type')
+
+    def __getitem__(self, key):
+        try:
+            return StatData.__getitem__(self, key)
+        except KeyError:
+            return self.stat_missing(key)
+
+    def stat_missing(self, key):
+        """Fill in the dictionary with make_file_dict and look up key"""
+        if self.complete: raise KeyError(key)
+        self.set_items(make_file_dict(self.path).items())
+        self.complete = 1
+        return StatData.__getitem__(self, key)
+
+
+def get_entry_type(entry):
+    """Return the file type of os.DirEntry entry, like in RORPath.data"""
+    if entry.is_symlink(): return "sym"
+    if entry.is_dir(follow_symlinks=False): return "dir"
+    if entry.is_file(follow_symlinks=False): return "reg"
+    mode = entry.stat(follow_symlinks=False).st_mode
+    if stat.S_ISCHR(mode) or stat.S_ISBLK(mode): return "dev"
+    if stat.S_ISFIFO(mode): return "fifo"
+    if stat.S_ISSOCK(mode): return "sock"
+    return None
+
+
 def make_socket_local(rpath):
     """Make a local socket at the given path
 
@@ -176,6 +317,22 @@ def open_local_read(rpath):
 def get_incfile_info(basename):
     """Returns None or tuple of
 	(is_compressed, timestr, type, and basename)"""
+    dotsplit = basename.split(b".")
+    if dotsplit[-1] in compression.suffixes:
+        compressed = 1
+        if len(dotsplit) < 4: return None
+        timestring, ext = dotsplit[-3:-1]
+    else:
+        compressed = None
+        if len(dotsplit) < 3: return None
+        timestring, ext = dotsplit[-2:]
+    if Time.bytestotime(timestring) is None: return None
+    if not (ext == b"snapshot" or ext == b"dir" or ext == b"missing"
+            or ext == b"diff" or ext == b"data"):
+        return None
+    if compressed: basestr = b".".join(dotsplit[:-3])
+    else: basestr = b".".join(dotsplit[:-2])
+    return (compressed, timestring, ext, basestr)
 
 
 def delete_dir_no_files(rp):
@@ -187,6 +344,37 @@ def delete_dir_no_files(rp):
     rp.delete()
 
 
+class IndexInterner:
+    """Make index tuples share their components with the previous one
+
+	Indicies are mostly made in order, so an index usually starts
+	with the same components as the one before, like (b"usr",
+	b"share", b"doc", b"foo") after (b"usr", b"share", b"doc").
+	Split from a path, each would have its own copies of b"usr",
+	b"share" and b"doc", which for millions of files in deep trees
+	add up.  intern returns an ordinary tuple equal to the given one,
+	so it compares and sorts the same way, but made of the components
+	of the last index where they are the same.
+
+	"""
+    __slots__ = ("last", )
+
+    def __init__(self):
+        self.last = ()
+
+    def intern(self, index):
+        """Return tuple equal to index, sharing components with the last"""
+        last = self.last
+        if index == last: return last
+        shared = 0
+        for last_component, component in zip(last, index):
+            if last_component != component: break
+            shared += 1
+        if shared: index = last[:shared] + index[shared:]
+        self.last = index
+        return index
+
+
 class RORPath:
     """Read Only RPath - carry information about a path
 
@@ -195,7 +383,20 @@ class RORPath:
 	changed.  The advantage of these objects is that they can be
 	communicated by encoding their index and data dictionary.
 
+	Backups keep many of these in caches at the same time, so they
+	have slots instead of an instance dictionary.  Subclasses which
+	add attributes should list them in their own __slots__.  For the
+	same reason, a dictionary assigned to data is stored as a
+	StatData.
+
 	"""
+    __slots__ = ("index", "_data", "file")
+
+    def _set_data(self, data):
+        if not isinstance(data, StatData): data = StatData(data)
+        self._data = data
+
+    data = property(operator.attrgetter("_data"), _set_data)
 
     def __init__(self, index, data=None):
         self.index = tuple(map(os.fsencode, index))
@@ -217,7 +418,8 @@ class RORPath:
         """True iff the two rorpaths are equivalent"""
         if self.index != other.index: return None
 
-        for key in list(self.data.keys()):  # compare dicts key by key
+        data, other_data = self._data, other._data
+        for key, value in data.get_items():  # compare dicts key by key
             if self.issym() and key in ('uid', 'gid', 'uname', 'gname'):
                 pass  # Don't compare gid/uid for symlinks
             elif key == 'atime' and not Globals.preserve_atime:
@@ -240,9 +442,9 @@ class RORPath:
                 pass
             elif key == 'uname' or key == 'gname':
                 # here for legacy reasons - 0.12.x didn't store u/gnames
-                other_name = other.data.get(key, None)
+                other_name = other_data.get(key, None)
                 if (other_name and other_name != "None"
-                        and other_name != self.data[key]):
+                        and other_name != value):
                     return None
             elif ((key == 'inode' or key == 'devloc')
                   and (not self.isreg() or self.getnumlinks() == 1
@@ -250,11 +452,8 @@ class RORPath:
                        or not Globals.preserve_hardlinks)):
                 pass
             else:
-                try:
-                    other_val = other.data[key]
-                except KeyError:
-                    return None
-                if self.data[key] != other_val: return None
+                other_val = other_data.get(key, _unset)
+                if other_val is _unset or value != other_val: return None
         return 1
 
     def equal_loose(self, other):
@@ -291,7 +490,29 @@ class RORPath:
 		symlink.
 		
 		"""
-
+        return self._data.type
+
+    def isreg(self):
+        """True if self corresponds to regular file"""
+        return self._data.type == 'reg'
+
+    def isdir(self):
+        """True if self is dir"""
+        return self._data.type == 'dir'
+
+    def getperms(self):
+        """Return permission block of file, 0 if unknown"""
+        try:
+            return self._data.perms
+        except AttributeError:  # unset slot, or EntryData not stat'ed yet
+            return self._data.get('perms', 0)
+
+    def getsize(self):
+        """Return length of file in bytes"""
+        try:
+            return self._data.size
+        except AttributeError:
+            return self._data['size']
 
 		For instance, if the index is (b"a", b"b"), return ("a", "b")
 
@@ -379,6 +600,9 @@ class RPath(RORPath):
 
 	"""
     regex_chars_to_quote = re.compile(b"[\\\\\\\"\\$`]")
+    # The inc_* attributes are set by isincfile
+    __slots__ = ("conn", "base", "path", "inc_compressed", "inc_timestr",
+                 "inc_type", "inc_basestr")
 
     def __init__(self, connection, base, index=(), data=None):
         """RPath constructor
@@ -445,6 +669,24 @@ class RPath(RORPath):
         """Just a getter for the path variable that can be overwritten by QuotedRPath"""
         return self.path
 
+    def append_entry(self, entry):
+        """Like append, but for an os.DirEntry of a local directory
+
+		The new rpath isn't stat'ed, its data is an EntryData.  Call
+		complete_data before using it for anything but selection.
+
+		"""
+        return self.__class__(self.conn, self.base, self.index + (entry.name, ),
+                              EntryData(entry))
+
+    def complete_data(self):
+        """Replace EntryData with the data setdata would make"""
+        if not isinstance(self.data, EntryData): return
+        if self.data.complete:
+            self.data = StatData(self.data)
+            if self.lstat(): setdata_local(self)
+        else: self.setdata()
+
     def get_safepath(self, somepath=None):
         """Return safely decoded version of path into the current encoding
 
@@ -520,6 +762,20 @@ class GzipFile(gzip.GzipFile):
 
 	"""
 
+    def __new__(cls, filename=None, mode=None):
+        """Return a file of another codec if filename's suffix says so
+
+		Multithreaded gzip writing is also done by another class, see
+		the compression module.
+
+		"""
+        if compression.get_codec(filename) == "zstd":
+            return compression.open_zstd(filename, mode)
+        if mode and 'w' in mode and Globals.compression_threads > 1:
+            return compression.ParallelGzipFile(open(filename, "wb"),
+                                                Globals.compression_threads)
+        return gzip.GzipFile.__new__(cls)
+
     def __init__(self, filename=None, mode=None):
         """ This is needed because we need to write an
 		encoded filename to the file, but use normal
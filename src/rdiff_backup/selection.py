@@ -23,7 +23,10 @@ documentation on what this code does can be found on the man page.
 
 """
 
-
+import os
+import re
+import threading
+import concurrent.futures
 from . import FilenameMapping, robust, rpath, Globals, log, rorpiter
 
 
@@ -100,14 +103,18 @@ class Select:
                                        exc)
             return None
 
+        readahead = self.get_readahead(rpath, sel_func, error_handler)
+
         def diryield(rpath):
-            """Generate relevant files in directory rpath
+            """Return iterator of relevant files in directory rpath
 
-			Returns (rpath, num) where num == 0 means rpath should be
+			It yields (rpath, num) where num == 0 means rpath should be
 			generated normally, num == 1 means the rpath is a directory
 			and should be included iff something inside is included.
 
 			"""
+            if readahead: return readahead.iterate(rpath)
+            return self.dir_entries(rpath, sel_func, error_handler)
 
 
 		rec_func is usually the same as this function and is what
@@ -145,9 +152,7 @@ class Select:
                 elif opt == "--exclude-fifos":
                     self.add_selection_func(self.fifos_get_sf(0))
                 elif opt == "--exclude-filelist":
-                    self.add_selection_func(
-                        self.filelist_get_sf(filelists[filelists_index], 0,
-                                             arg))
+                    self.add_filelist_sf(filelists[filelists_index], 0, arg)
                     filelists_index += 1
                 elif opt == "--exclude-globbing-filelist":
                     list(
@@ -165,9 +170,7 @@ class Select:
                 elif opt == "--include":
                     self.add_selection_func(self.glob_get_sf(arg, 1))
                 elif opt == "--include-filelist":
-                    self.add_selection_func(
-                        self.filelist_get_sf(filelists[filelists_index], 1,
-                                             arg))
+                    self.add_filelist_sf(filelists[filelists_index], 1, arg)
                     filelists_index += 1
                 elif opt == "--include-globbing-filelist":
                     list(
@@ -194,6 +197,118 @@ class Select:
 
         self.parse_last_excludes()
         self.parse_rbdir_exclude()
+        self.compile_selection_functions()
+
+    def Select(self, rp):
+        """Run through the selection functions and return dominant val 0/1/2"""
+        return self.run_selection_functions(self.selection_functions, rp)
+
+    @staticmethod
+    def run_selection_functions(sel_funcs, rp):
+        """Return dominant value 0/1/2 of the selection functions sel_funcs"""
+        scanned = 0  # 0, by default, or 2 if prev sel func scanned rp
+        for sf in sel_funcs:
+            if isinstance(sf, GlobMatcher): result, final = sf.match(rp)
+            else: result, final = sf(rp), 0
+            if result == 1: return 1
+            elif result == 0: return scanned
+            elif result == 2:
+                if final: return 2
+                scanned = 2
+        return 1
+
+    def dir_entries(self, dir_rp, sel_func, error_handler, scanned=None):
+        """Yield (rpath, num) for the selected files in dir_rp, see diryield
+
+		scanned is the list scan_dir_entries returned for dir_rp, if
+		it was read ahead, otherwise the directory is listed here.
+
+		"""
+        if scanned is None:
+            scanned = self.selected_rpaths(dir_rp, sel_func, error_handler)
+        for new_rpath, s in scanned:
+            robust.check_common_error(
+                error_handler, lambda filename: new_rpath.complete_data(),
+                (new_rpath.index[-1], ))
+            if new_rpath.lstat(): yield (new_rpath, s - 1)
+
+    def selected_rpaths(self, dir_rp, sel_func, error_handler):
+        """Yield (rpath, sel_func value) for the files dir_entries keeps"""
+        for new_rpath in self.dir_rpaths(dir_rp, error_handler):
+            s = sel_func(new_rpath)
+            if s == 1 or (s == 2 and new_rpath.isdir()): yield (new_rpath, s)
+
+    @staticmethod
+    def scan_dir_entries(dir_rp, sel_func):
+        """Return list of (rpath, sel_func value) like selected_rpaths
+
+		This is what the threads of a DirReadahead run.  Errors are
+		logged, and ErrorLog and the statistics written, through
+		connections which may lead to another process, and these can't
+		be used from several threads.  So instead of being passed to
+		an error handler, errors are raised here, and dir_entries
+		lists the directory again in the walking thread.  For the same
+		reason complete_data, which may log while reading extended
+		attributes and access control lists, is left to dir_entries.
+
+		"""
+        with os.scandir(dir_rp.path) as it:
+            dir_list = sorted(it, key=lambda entry: entry.name)
+        scanned = []
+        for entry in dir_list:
+            rp = dir_rp.append_entry(entry)
+            s = sel_func(rp)
+            if s == 1 or (s == 2 and rp.isdir()):
+                rp.getperms()  # lstat here, not in the walking thread
+                scanned.append((rp, s))
+        return scanned
+
+    def get_readahead(self, root_rp, sel_func, error_handler):
+        """Return DirReadahead for iterating root_rp, or None
+
+		Directories are only read ahead if Globals.readahead_threads is
+		more than 1, and if they are local, as the connections can't
+		be used by several threads.  Selection functions which must
+		be called on the files in order, like those of filelists,
+		rule it out too.  The threads only run scan_dir_entries, errors
+		are handled and logged by dir_entries in the calling thread.
+
+		"""
+        if (Globals.readahead_threads <= 1
+                or root_rp.conn is not Globals.local_connection
+                or type(root_rp) is not rpath.RPath
+                or [sf for sf in self.selection_functions
+                    if getattr(sf, "in_order", None)]):
+            return None
+        return DirReadahead(
+            lambda dir_rp, scanned: list(
+                self.dir_entries(dir_rp, sel_func, error_handler, scanned)),
+            lambda dir_rp: self.scan_dir_entries(dir_rp, sel_func),
+            Globals.readahead_threads, Globals.readahead_width,
+            Globals.readahead_depth)
+
+    def dir_rpaths(self, dir_rp, error_handler):
+        """Yield rpaths of the files in directory dir_rp, sorted by name
+
+		Local directories are read with os.scandir.  Their rpaths only
+		know the file type at first, see rpath.EntryData, so files
+		excluded by name are never stat'ed.  Call complete_data on the
+		rpaths which are kept.
+
+		"""
+        if (dir_rp.conn is not Globals.local_connection
+                or type(dir_rp) is not rpath.RPath):
+            for filename in robust.listrp(dir_rp):
+                rp = robust.check_common_error(error_handler, dir_rp.append,
+                                               (filename, ))
+                if rp and rp.lstat(): yield rp
+            return
+
+        for entry in robust.scandirrp(dir_rp):
+            rp = robust.check_common_error(
+                error_handler, lambda filename: dir_rp.append_entry(entry),
+                (entry.name, ))
+            if rp and rp.lstat(): yield rp
 
     def parse_catch_error(self, exc):
         """Deal with selection error exc"""
@@ -226,7 +341,55 @@ only specifies that files be included.  Because the default is to
 include all files, the expression is redundant.  Exiting because this
 probably isn't what you meant.""" % (self.selection_functions[-1].name, ))
 
+    def compile_selection_functions(self):
+        """Combine each run of consecutive globs into one GlobMatcher
 
+		Globs, unlike the other selection functions, can be tested
+		together, so a long globbing filelist costs about as much per
+		file as a single glob.
+
+		"""
+        sel_funcs, globs = [], []
+        for sel_func in self.selection_functions + [None]:
+            if isinstance(sel_func, GlobMatcher):
+                globs.extend(sel_func.globs)
+                continue
+            if globs:
+                sel_funcs.append(GlobMatcher(globs))
+                globs = []
+            if sel_func is not None: sel_funcs.append(sel_func)
+        self.selection_functions = sel_funcs
+
+    def glob_get_sf(self, glob_str, include):
+        """Return selection function given by glob string
+
+		The function is a GlobMatcher of just this glob, see
+		compile_selection_functions.
+
+		"""
+        assert include == 0 or include == 1
+        glob_str = os.fsencode(glob_str)
+        if glob_str != b"**":
+            if not self.glob_re.match(glob_str):  # normal file
+                if not glob_str.startswith(self.prefix):
+                    raise FilePrefixError(glob_str)
+            elif not GlobMatcher([(glob_str, 1)])(self.rpath):
+                raise FilePrefixError(glob_str)
+        return GlobMatcher([(glob_str, include)])
+
+
+
+    def add_filelist_sf(self, filelist_fp, inc_default, filelist_name):
+        """Add the selection function of a filelist, see filelist_get_sf
+
+		The function moves through the sorted filelist as it is called,
+		so it has to see the files in order, see get_readahead.
+
+		"""
+        sel_func = self.filelist_get_sf(filelist_fp, inc_default,
+                                        filelist_name)
+        sel_func.in_order = 1
+        self.add_selection_func(sel_func)
 
     def filelist_get_sf(self, filelist_fp, inc_default, filelist_name):
         """Return selection function by reading list of files
@@ -304,6 +467,335 @@ probably isn't what you meant.""" % (self.selection_functions[-1].name, ))
 		"""
 
 
+class GlobMatcher:
+    """Selection function for a run of globs, compiled together
+
+	Testing every file against thousands of globs one after another,
+	as happens with long globbing filelists, takes time proportional
+	to the length of the list.  A GlobMatcher gives the same answer as
+	Select.Select would get from the globs one by one (see match), but
+	only looks at the globs which could match a file:
+
+	Globs without special characters are paths, and are kept in a
+	tree of path components.  The other globs are put in the node of
+	the tree for their longest leading part without special
+	characters, and the globs of each node are combined into one
+	regular expression, whose alternatives are in the order of the
+	globs.  Finding the result for a file then takes a walk down the
+	tree along its path, and one regular expression match in each
+	node passed which has globs.
+
+	"""
+
+    class _Node:
+        """Node of the path tree for one leading path"""
+        __slots__ = ("children", "literal", "literal_below", "scan_below",
+                     "globs", "regexp", "decisive_regexp", "results")
+
+        def __init__(self):
+            self.children = {}
+            self.literal = None  # (number, result) of first path glob here
+            self.literal_below = None  # number of first include path below
+            self.scan_below = None  # number of first include glob below
+            self.globs = []  # list of (number, glob regexp, scan regexp)
+            self.regexp = self.decisive_regexp = self.results = None
+
+    def __init__(self, globs):
+        """GlobMatcher initializer
+
+		globs is a list of (glob_str, include) pairs, in the order of
+		precedence, as given to Select.glob_get_sf.
+
+		"""
+        self.globs = []
+        self.root = self._Node()
+        for glob_str, include in globs:
+            self.add_glob(glob_str, include)
+        self.compile()
+
+    def __call__(self, rp):
+        """Return the result of the globs on rp, see match"""
+        return self.match(rp)[0]
+
+    def match(self, rp):
+        """Return (result, final) of the globs on rp, as Select has them
+
+		As in Select.Select, the first glob including or excluding rp
+		decides, and a glob scanning rp before that makes the result
+		2.  So result is 1 if rp is included first, 0 or 2 if it is
+		excluded first, depending on whether it was scanned before, and
+		2 or None if no glob decides.  final is true if no selection
+		function after these globs should be asked.
+
+		"""
+        path = rp.path
+        decisive = scan = None  # first (number, result) deciding, scanning
+        node = self.root
+        for component in self.get_components(path):
+            if node.regexp is not None:
+                decisive, scan = self.match_node(node, path, decisive, scan)
+            node = node.children.get(component)
+            if node is None: break
+            if node.literal is not None:
+                decisive = self._min(decisive, node.literal)
+        else:
+            if node.regexp is not None:
+                decisive, scan = self.match_node(node, path, decisive, scan)
+            if node.literal_below is not None:
+                decisive = self._min(decisive, (node.literal_below, 1))
+            if node.scan_below is not None:
+                scan = self._min(scan, (node.scan_below, 2))
+
+        if decisive is None: return (scan and 2, 0)
+        if scan is None or decisive[0] < scan[0]: return (decisive[1], 1)
+        return (decisive[1] or 2, 1)
+
+    def match_node(self, node, path, decisive, scan):
+        """Add the first matches of the globs of node to decisive, scan"""
+        match = node.regexp.match(path)
+        if not match: return (decisive, scan)
+        first = node.results[match.lastgroup]
+        if first[1] != 2: return (self._min(decisive, first), scan)
+        # A scan came first, but a later glob here may still decide
+        match = node.decisive_regexp.match(path)
+        if match:
+            decisive = self._min(decisive, node.results[match.lastgroup])
+        return (decisive, self._min(scan, first))
+
+    @staticmethod
+    def _min(best, candidate):
+        """Return whichever (number, result) pair comes first"""
+        if best is None or candidate[0] < best[0]: return candidate
+        return best
+
+    @staticmethod
+    def get_components(path):
+        """Return tuple of components of path, as in the path tree"""
+        if path == b"/": return (b"", )
+        return tuple(path.split(b"/"))
+
+    @property
+    def exclude(self):
+        return not all(include for glob_str, include in self.globs)
+
+    @property
+    def name(self):
+        return "; ".join([
+            "Command-line %s glob: %s" %
+            (include and "include" or "exclude", os.fsdecode(glob_str))
+            for glob_str, include in self.globs
+        ])
+
+    def add_glob(self, glob_str, include):
+        """Add glob glob_str, with less precedence than those added before"""
+        number = len(self.globs)
+        self.globs.append((glob_str, include))
+        if glob_str == b"**":
+            self.root.globs.append((number, b".*", None))
+            return
+
+        if not Select.glob_re.match(glob_str):  # just a path
+            node = self.root
+            for component in self.get_components(glob_str.rstrip(b"/")
+                                                 or b"/"):
+                if not component and node is not self.root: continue
+                if node.literal_below is None and include:
+                    node.literal_below = number
+                node = node.children.setdefault(component, self._Node())
+            if node.literal is None: node.literal = (number, include and 1
+                                                     or 0)
+            return
+
+        ignorecase = glob_str[:11].lower() == b"ignorecase:"
+        if ignorecase: glob_str = glob_str[11:]
+        glob_regexp = b"%s(?:$|/)" % glob_to_re(glob_str)
+        if include:
+            if b"**" in glob_str:
+                scan_glob = glob_str[:glob_str.index(b"**") + 2]
+            else:
+                scan_glob = glob_str
+            scan_regexp = b"(?:%s)$" % b"|".join(get_prefix_res(scan_glob))
+        else:
+            scan_regexp = None
+        if ignorecase:
+            glob_regexp = b"(?i:%s)" % glob_regexp
+            if scan_regexp: scan_regexp = b"(?i:%s)" % scan_regexp
+
+        node = self.root
+        if not ignorecase:
+            components = glob_str.split(b"/")
+            for component in components[:-1]:
+                if Select.glob_re.match(component): break
+                if node.scan_below is None and include:
+                    node.scan_below = number
+                node = node.children.setdefault(component, self._Node())
+        node.globs.append((number, glob_regexp, scan_regexp))
+
+    def compile(self):
+        """Combine the globs of each node into one regular expression"""
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.children.values())
+            if not node.globs: continue
+            alternatives, decisive, node.results = [], [], {}
+            for number, glob_regexp, scan_regexp in node.globs:
+                include = self.globs[number][1]
+                alternatives.append(b"(?P<g%d>%s)" % (number, glob_regexp))
+                decisive.append(alternatives[-1])
+                node.results["g%d" % number] = (number, include and 1 or 0)
+                if scan_regexp is not None:
+                    alternatives.append(b"(?P<s%d>%s)" %
+                                        (number, scan_regexp))
+                    node.results["s%d" % number] = (number, 2)
+            node.regexp = re.compile(b"|".join(alternatives), re.S)
+            node.decisive_regexp = re.compile(b"|".join(decisive), re.S)
+
+
+def get_prefix_res(glob_str):
+    """Return list of regexps equivalent to prefixes of glob_str"""
+    glob_parts = glob_str.split(b"/")
+    if b"" in glob_parts[1:-1]:  # "" OK if comes first or last, as in /foo/
+        raise GlobbingError("Consecutive '/'s found in globbing string " +
+                            os.fsdecode(glob_str))
+
+    prefixes = [b"/".join(glob_parts[:i + 1]) for i in range(len(glob_parts))]
+    # we must make exception for root "/", only dir to end in slash
+    if prefixes[0] == b"": prefixes[0] = b"/"
+    return list(map(glob_to_re, prefixes))
+
+
+def glob_to_re(pat):
+    """Return regular expression equivalent to shell glob pat
+
+	See Select.glob_to_re, the ?, *, **, and [] expressions work the
+	same way.  The expression has no capturing groups, so that many of
+	them can be combined in one.
+
+	"""
+    i, n, res = 0, len(pat), b''
+    while i < n:
+        c, s = pat[i], pat[i:i + 1]
+        i = i + 1
+        if c == ord('*'):
+            if i < n and pat[i] == ord('*'):
+                res = res + b'.*'
+                i = i + 1
+            else:
+                res = res + b'[^/]*'
+        elif c == ord('?'):
+            res = res + b'[^/]'
+        elif c == ord('['):
+            j = i
+            if j < n and pat[j] in b'!^': j = j + 1
+            if j < n and pat[j] == ord(']'): j = j + 1
+            while j < n and pat[j] != ord(']'):
+                j = j + 1
+            if j >= n:
+                res = res + b'\\['  # interpret the [ literally
+            else:  # Deal with inside of [..]
+                stuff = pat[i:j].replace(b'\\', b'\\\\')
+                i = j + 1
+                if stuff[0] in b'!^': stuff = b'^' + stuff[1:]
+                res = res + b'[' + stuff + b']'
+        elif c == ord('\\') and i < n:
+            res = res + re.escape(pat[i:i + 1])
+            i = i + 1
+        else:
+            res = res + re.escape(s)
+    return res
+
+
+class DirReadahead:
+    """Read directories in a thread pool, ahead of Select
+
+	On network file systems most of the time of a backup with few
+	changes goes into waiting for directory listings and lstat calls.
+	A DirReadahead lists the directories Select.Iterate_fast is going
+	to descend into before it gets there: when a directory is
+	iterated, the next width of its subdirectories are read by the
+	thread pool, and, while reading these, their own first width
+	subdirectories, down to depth levels.  Select still walks the
+	directories one after another, so files are yielded in the same
+	order as without reading ahead.
+
+	At most about width ** depth directory listings are kept in
+	memory at the same time.
+
+	"""
+
+    def __init__(self, list_func, scan_func, threads, width, depth):
+        """DirReadahead initializer
+
+		scan_func takes a directory rpath and returns a list of
+		(rpath, value) pairs of its selected files, in order, or
+		raises an exception.  It is called in the threads of the pool,
+		so the selection functions must not depend on the order they
+		are called in, and it must not log or handle errors.
+
+		list_func takes the directory rpath and what scan_func
+		returned, or None if it wasn't read ahead or raised, and
+		returns the list of (rpath, num) pairs to yield.  It is called
+		in the thread which iterates.
+
+		"""
+        self.list_func, self.scan_func = list_func, scan_func
+        self.width, self.depth = width, depth
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+        self.futures = {}  # index of directory -> future of its list
+        self.lock = threading.Lock()
+        self.closed = None
+
+    def iterate(self, dir_rp):
+        """Yield the (rpath, num) pairs of dir_rp, reading ahead below it"""
+        entries = self.get_entries(dir_rp)
+        subdirs = [rp for rp, num in entries if rp.isdir()]
+        self.read_ahead(subdirs[:self.width], self.depth)
+        next_subdir = self.width
+        for rp, num in entries:
+            if rp.isdir():
+                self.read_ahead(subdirs[next_subdir:next_subdir + 1],
+                                self.depth)
+                next_subdir += 1
+            yield (rp, num)
+        if not dir_rp.index: self.close()  # root is the last to finish
+
+    def get_entries(self, dir_rp):
+        """Return list of (rpath, num) pairs of dir_rp"""
+        with self.lock:
+            future = self.futures.pop(dir_rp.index, None)
+        scanned = None
+        if future is not None:
+            try:
+                scanned = future.result()
+            except Exception:
+                pass  # list_func lists it again, handling the error
+        return self.list_func(dir_rp, scanned)
+
+    def read_ahead(self, dir_rps, depth):
+        """Start reading the directories dir_rps, and depth - 1 levels below"""
+        with self.lock:
+            if self.closed: return
+            for dir_rp in dir_rps:
+                if dir_rp.index not in self.futures:
+                    self.futures[dir_rp.index] = self.executor.submit(
+                        self.read_dir, dir_rp, depth)
+
+    def read_dir(self, dir_rp, depth):
+        """Return scan_func's list for dir_rp, run in the pool"""
+        scanned = self.scan_func(dir_rp)
+        if depth > 1:
+            subdirs = [rp for rp, value in scanned if rp.isdir()]
+            self.read_ahead(subdirs[:self.width], depth - 1)
+        return scanned
+
+    def close(self):
+        """Stop the threads, dropping whatever was read ahead"""
+        with self.lock:
+            self.futures.clear()
+            self.closed = 1
+        self.executor.shutdown(wait=False)
+
 
 class FilterIter:
     """Filter rorp_iter using a Select object, removing excluded rorps"""
@@ -0,0 +1,120 @@
+# Copyright 2019 The rdiff-backup project
+#
+# This file is part of rdiff-backup.
+#
+# rdiff-backup is free software; you can redistribute it and/or modify
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# rdiff-backup is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rdiff-backup; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+"""Keep signatures of large mirror files between sessions
+
+To find out how a changed file differs from its mirror, the
+destination sends the signature of the mirror file to the source.
+Computing that signature means reading the whole mirror file, which
+for large files like virtual machine images is often the bulk of the
+work of a backup.
+
+If Globals.signature_cache is set, the signature of every large
+regular file written to the mirror is made while it is written, and
+stored in the rdiff-backup-data/signature_cache directory, to be used
+in the next session instead of reading the mirror file again.  The
+signature is only used if the size, modification time and inode of
+the mirror file are still the same as when the signature was stored.
+
+Each cached signature is a file named after the sha1 of the mirror
+file's index.  It starts with the line "<size> <mtime> <inode>" and
+the signature data follows.  Entries of mirror files which are
+deleted, or stop being regular files, are removed by remove.
+
+"""
+
+import io
+import hashlib
+from . import Globals, log, rpath, Rdiff
+
+cache_dir_name = b"signature_cache"
+_cache_rp = None
+
+
+def get_cache_rp():
+    """Return the RPath of the signature cache dir, creating it if needed"""
+    global _cache_rp
+    if _cache_rp is None:
+        _cache_rp = Globals.rbdir.append_path(cache_dir_name)
+        if not _cache_rp.lstat(): _cache_rp.mkdir()
+    return _cache_rp
+
+
+def get_entry_rp(index):
+    """Return the RPath where the signature of the file at index is cached"""
+    return get_cache_rp().append(hashlib.sha1(b"/".join(index)).hexdigest())
+
+
+def get_stat_line(rp):
+    """Return the line identifying the current version of rp"""
+    return b"%d %d %d\n" % (rp.getsize(), rp.getmtime(), rp.getinode())
+
+
+def get_signature_fp(mirror_rp):
+    """Return file object with the cached signature of mirror_rp, or None
+
+	An entry that doesn't match mirror_rp anymore is deleted.
+
+	"""
+    entry_rp = get_entry_rp(mirror_rp.index)
+    if not entry_rp.lstat(): return None
+    fp = entry_rp.open("rb")
+    if fp.readline() != get_stat_line(mirror_rp):
+        fp.close()
+        entry_rp.delete()
+        return None
+    log.Log("Using cached signature for %s" % mirror_rp.get_safepath(), 7)
+    return fp
+
+
+def get_sig_generator(diff_rorp):
+    """Return SigGenerator for the new data of diff_rorp, or None
+
+	Its data is passed to the SigGenerator while it is patched into
+	the mirror, and the signature then given to update.  Files smaller
+	than Globals.signature_cache_min_size are not worth caching.
+
+	"""
+    if (not diff_rorp.isreg() or diff_rorp.isflaglinked()
+            or diff_rorp.getsize() < Globals.signature_cache_min_size):
+        return None
+    return Rdiff.get_sig_generator(diff_rorp.getsize(), diff_rorp.index)
+
+
+def update(index, new_rp, sig_gen):
+    """Cache the signature of new_rp, which is about to become the mirror
+
+	new_rp will usually be the temp file that is renamed to the
+	mirror file at index right after, which keeps its size, mtime and
+	inode.  sig_gen is what get_sig_generator returned, with all the
+	data of new_rp passed to it.  If it is None, an old entry for
+	index is still removed.
+
+	"""
+    if not sig_gen:
+        remove(index)
+        return
+    Rdiff.write_via_tempfile(
+        io.BytesIO(get_stat_line(new_rp) + sig_gen.getsig()),
+        get_entry_rp(index))
+
+
+def remove(index):
+    """Remove the cached signature of the file at index, if there is one"""
+    entry_rp = get_entry_rp(index)
+    if entry_rp.lstat(): entry_rp.delete()
@@ -37,7 +37,9 @@ class StatsObj:
                        'DeletedFiles', 'DeletedFileSize', 'ChangedFiles',
                        'ChangedSourceSize', 'ChangedMirrorSize',
                        'IncrementFiles', 'IncrementFileSize')
-    stat_misc_attrs = ('Errors', 'TotalDestinationSizeChange')
+    stat_misc_attrs = ('Errors', 'TotalDestinationSizeChange', 'WireBytes',
+                       'WireCompressedBytes', 'HardLinkEntries',
+                       'HardLinkMemory', 'SkippedSignatures')
     stat_time_attrs = ('StartTime', 'EndTime', 'ElapsedTime')
     stat_attrs = (
         ('Filename', ) + stat_time_attrs + stat_misc_attrs + stat_file_attrs)
@@ -80,6 +82,60 @@ class StatsObj:
         """Add value to given attribute"""
         self.__dict__[attr] += value
 
+    def set_wire_stats(self):
+        """Set WireBytes and WireCompressedBytes from the connections
+
+		WireBytes is the amount of data sent and received over the
+		connections to other rdiff-backup processes, and
+		WireCompressedBytes is how much of it was actually sent after
+		wire compression.
+
+		"""
+        from . import connection
+        raw_bytes = compressed_bytes = 0
+        for conn in Globals.connections:
+            if isinstance(conn, connection.LowLevelPipeConnection):
+                raw_bytes += conn.wire_raw_bytes
+                compressed_bytes += conn.wire_bytes
+        if raw_bytes:
+            self.WireBytes, self.WireCompressedBytes = \
+                raw_bytes, compressed_bytes
+
+    def get_wire_stats_string(self):
+        """Return lines about the wire compression, or "" if no data"""
+        if not self.WireBytes: return ""
+        return ("WireBytes %s (%s)\n"
+                "WireCompressedBytes %s (%s, ratio %.2f)\n" %
+                (self.WireBytes, self.get_byte_summary_string(self.WireBytes),
+                 self.WireCompressedBytes,
+                 self.get_byte_summary_string(self.WireCompressedBytes),
+                 self.WireBytes / max(self.WireCompressedBytes, 1)))
+
+    def set_hardlink_stats(self):
+        """Set HardLinkEntries and HardLinkMemory from Hardlink's table
+
+		These are the most entries the table of hard linked inodes had
+		at a time, and about the most bytes its entries took in memory.
+		With --hardlink-memory-entries the other entries were on disk.
+
+		"""
+        from . import Hardlink
+        entries, memory_size = Hardlink.get_table_stats()
+        if entries:
+            self.HardLinkEntries, self.HardLinkMemory = entries, memory_size
+
+    def get_hardlink_stats_string(self):
+        """Return lines about the hard link table, or "" if it was empty"""
+        if not self.HardLinkEntries: return ""
+        return ("HardLinkEntries %s\nHardLinkMemory %s (%s)\n" %
+                (self.HardLinkEntries, self.HardLinkMemory,
+                 self.get_byte_summary_string(self.HardLinkMemory)))
+
+    def get_signature_stats_string(self):
+        """Return line about skipped signatures, or "" if there were none"""
+        if not self.SkippedSignatures: return ""
+        return "SkippedSignatures %s\n" % (self.SkippedSignatures, )
+
     def get_total_dest_size_change(self):
         """Return total destination size change
 
@@ -87,11 +143,211 @@ class StatsObj:
 		rdiff-backup destination directory.
 
 		"""
+        addvals = [
+            self.NewFileSize, self.ChangedSourceSize, self.IncrementFileSize
+        ]
+        subtractvals = [self.DeletedFileSize, self.ChangedMirrorSize]
+        for val in addvals + subtractvals:
+            if val is None:
+                result = None
+                break
+        else:
+
+            def addlist(l):
+                return reduce(lambda x, y: x + y, l)
+
+            result = addlist(addvals) - addlist(subtractvals)
+        self.TotalDestinationSizeChange = result
+        return result
+
+    def get_stats_string(self):
+        """Return extended string printing out statistics"""
+        return "%s%s%s" % (self.get_timestats_string(),
+                           self.get_filestats_string(),
+                           self.get_miscstats_string())
+
+    def get_timestats_string(self):
+        """Return portion of statistics string dealing with time"""
+        timelist = []
+        if self.StartTime is not None:
+            timelist.append("StartTime %.2f (%s)\n" %
+                            (self.StartTime, Time.timetopretty(self.StartTime)))
+        if self.EndTime is not None:
+            timelist.append("EndTime %.2f (%s)\n" %
+                            (self.EndTime, Time.timetopretty(self.EndTime)))
+        if self.ElapsedTime or (self.StartTime is not None
+                                and self.EndTime is not None):
+            if self.ElapsedTime is None:
+                self.ElapsedTime = self.EndTime - self.StartTime
+            timelist.append(
+                "ElapsedTime %.2f (%s)\n" %
+                (self.ElapsedTime, Time.inttopretty(self.ElapsedTime)))
+        return "".join(timelist)
+
+    def get_filestats_string(self):
+        """Return portion of statistics string about files and bytes"""
+
+        def fileline(stat_file_pair):
+            """Return zero or one line of the string"""
+            attr, in_bytes = stat_file_pair
+            val = self.get_stat(attr)
+            if val is None: return ""
+            if in_bytes:
+                return "%s %s (%s)\n" % (attr, val,
+                                         self.get_byte_summary_string(val))
+            else:
+                return "%s %s\n" % (attr, val)
+
+        return "".join(map(fileline, self.stat_file_pairs))
+
+    def get_miscstats_string(self):
+        """Return portion of extended stat string about misc attributes"""
+        misc_string = ""
+        tdsc = self.get_total_dest_size_change()
+        if tdsc is not None:
+            misc_string += ("TotalDestinationSizeChange %s (%s)\n" %
+                            (tdsc, self.get_byte_summary_string(tdsc)))
+        if self.Errors is not None: misc_string += "Errors %d\n" % self.Errors
+        return (misc_string + self.get_wire_stats_string() +
+                self.get_hardlink_stats_string() +
+                self.get_signature_stats_string())
+
+    def get_byte_summary_string(self, byte_count):
+        """Turn byte count into human readable string like "7.23GB" """
+        if byte_count < 0:
+            sign = "-"
+            byte_count = -byte_count
+        else:
+            sign = ""
+
+        for abbrev_bytes, abbrev_string in self.byte_abbrev_list:
+            if byte_count >= abbrev_bytes:
+                # Now get 3 significant figures
+                abbrev_count = float(byte_count) / abbrev_bytes
+                if abbrev_count >= 100: precision = 0
+                elif abbrev_count >= 10: precision = 1
+                else: precision = 2
+                return "%s%%.%df %s" % (sign, precision, abbrev_string) \
+                    % (abbrev_count,)
+        byte_count = round(byte_count)
+        if byte_count == 1: return sign + "1 byte"
+        else: return "%s%d bytes" % (sign, byte_count)
+
+    def get_stats_logstring(self, title):
+        """Like get_stats_string, but add header and footer"""
+        header = "--------------[ %s ]--------------" % title
+        footer = "-" * len(header)
+        return "%s\n%s%s\n" % (header, self.get_stats_string(), footer)
+
+    def set_stats_from_string(self, s):
+        """Initialize attributes from string, return self for convenience
+
+		Each line starts with the name of the attribute and its value,
+		what follows, like a human readable version of the value, is
+		ignored.
 
+		"""
 
+        def error(line):
+            raise StatsException("Bad line '%s'" % line)
+
+        for line in s.split("\n"):
+            if not line: continue
+            line_parts = line.split()
+            if len(line_parts) < 2: error(line)
+            attr, value_string = line_parts[:2]
+            if attr not in self.stat_attrs: error(line)
+            try:
+                try:
+                    val1 = int(value_string)
+                except ValueError:
+                    val1 = None
+                val2 = float(value_string)
+                if val1 == val2: self.set_stat(attr, val1)  # use integer val
+                else: self.set_stat(attr, val2)  # use float
+            except ValueError:
+                error(line)
+        return self
+
+    def write_stats_to_rp(self, rp):
+        """Write statistics string to given rpath"""
+        fp = rp.open("wb")
+        fp.write(self.get_stats_string().encode())
+        assert not fp.close()
+
+    def read_stats_from_rp(self, rp):
+        """Set statistics from rpath, return self for convenience"""
+        fp = rp.open("r")
+        self.set_stats_from_string(fp.read())
+        fp.close()
+        return self
+
+    def stats_equal(self, s):
+        """Return true if s has same statistics as self"""
+        assert isinstance(s, StatsObj)
+        for attr in self.stat_file_attrs:
+            if self.get_stat(attr) != s.get_stat(attr): return None
+        return 1
 
-class StatFileObj(StatsObj):
 
+class StatFileObj(StatsObj):
+    """Build on StatsObj, add functions for processing files"""
+
+    def __init__(self, start_time=None):
+        """StatFileObj initializer - zero out file attributes"""
+        StatsObj.__init__(self)
+        for attr in self.stat_file_attrs:
+            self.set_stat(attr, 0)
+        if start_time is None: start_time = Time.curtime
+        self.StartTime = start_time
+        self.Errors = 0
+        self.SkippedSignatures = 0
+
+    def add_source_file(self, src_rorp):
+        """Add stats of source file"""
+        self.SourceFiles += 1
+        if src_rorp.isreg(): self.SourceFileSize += src_rorp.getsize()
+
+    def add_dest_file(self, dest_rorp):
+        """Add stats of destination size"""
+        self.MirrorFiles += 1
+        if dest_rorp.isreg(): self.MirrorFileSize += dest_rorp.getsize()
+
+    def add_changed(self, src_rorp, dest_rorp):
+        """Update stats when src_rorp changes to dest_rorp"""
+        if src_rorp and src_rorp.lstat() and dest_rorp and dest_rorp.lstat():
+            self.ChangedFiles += 1
+            if src_rorp.isreg():
+                self.ChangedSourceSize += src_rorp.getsize()
+            if dest_rorp.isreg():
+                self.ChangedMirrorSize += dest_rorp.getsize()
+        elif src_rorp and src_rorp.lstat():
+            self.NewFiles += 1
+            if src_rorp.isreg(): self.NewFileSize += src_rorp.getsize()
+        elif dest_rorp and dest_rorp.lstat():
+            self.DeletedFiles += 1
+            if dest_rorp.isreg(): self.DeletedFileSize += dest_rorp.getsize()
+
+    def add_increment(self, inc_rorp):
+        """Update stats with increment rorp"""
+        self.IncrementFiles += 1
+        if inc_rorp.isreg(): self.IncrementFileSize += inc_rorp.getsize()
+
+    def add_error(self):
+        """Increment error stat by 1"""
+        self.Errors += 1
+
+    def add_skipped_signature(self):
+        """Count a changed file sent whole, see Rdiff.skip_signature"""
+        self.SkippedSignatures += 1
+
+    def finish(self, end_time=None):
+        """Record end time and set other stats"""
+        self.get_total_dest_size_change()
+        self.set_wire_stats()
+        self.set_hardlink_stats()
+        if end_time is None: end_time = time.time()
+        self.EndTime = end_time
 
 
 _active_statfileobj = None
@@ -106,12 +362,40 @@ def init_statfileobj():
 
 
 def get_active_statfileobj():
+    """Return active stat file object if it exists"""
+    if _active_statfileobj: return _active_statfileobj
+    else: return None
 
 
 def record_error():
+    """Record error on active statfileobj, if there is one"""
+    if _active_statfileobj: _active_statfileobj.add_error()
 
 
 def process_increment(inc_rorp):
+    """Add statistics of increment rp incrp if there is active statfile"""
+    if _active_statfileobj: _active_statfileobj.add_increment(inc_rorp)
+
+
+def write_active_statfileobj(end_time=None):
+    """Write active StatFileObj object to session statistics file"""
+    global _active_statfileobj
+    assert _active_statfileobj
+    rp_base = Globals.rbdir.append(b"session_statistics")
+    session_stats_rp = increment.get_inc(rp_base, 'data', Time.curtime)
+    _active_statfileobj.finish(end_time)
+    _active_statfileobj.write_stats_to_rp(session_stats_rp)
+    _active_statfileobj = None
+
+
+def print_active_stats(end_time=None):
+    """Print statistics of active statobj to stdout and log"""
+    global _active_statfileobj
+    assert _active_statfileobj
+    _active_statfileobj.finish(end_time)
+    statmsg = _active_statfileobj.get_stats_logstring("Session statistics")
+    log.Log.log_to_file(statmsg)
+    Globals.client_conn.sys.stdout.write(statmsg)
 
 
 
@@ -147,12 +147,216 @@ def nested_files_rsync():
     print("Update changed rsync: %ss" % (run_cmd(rsync_command), ))
 
 
+def server_startup():
+    """Time starting rdiff-backup 50 times, as a short session would"""
+    count = 50
+    cmd = b"rdiff-backup --version > /dev/null"
+    if new_pythonpath:
+        cmd = b"PYTHONPATH=%b %b" % (new_pythonpath, cmd)
+    t = time.time()
+    for i in range(count):
+        assert not os.system(cmd)
+    print("Starting rdiff-backup: %ss on average" %
+          ((time.time() - t) / count, ))
+
+
+def main_import():
+    """Time starting python and importing rdiff_backup.Main 50 times"""
+    count = 50
+    cmd = b"%b -c 'import rdiff_backup.Main'" % os.fsencode(sys.executable)
+    if new_pythonpath:
+        cmd = b"PYTHONPATH=%b %b" % (new_pythonpath, cmd)
+    t = time.time()
+    for i in range(count):
+        assert not os.system(cmd)
+    print("Importing rdiff_backup.Main: %ss on average" %
+          ((time.time() - t) / count, ))
+
+
+def collate_iterators():
+    """Time collating a year of daily increment-like rorp iterators"""
+    from rdiff_backup import rorpiter
+    count, files = 365, 20000
+    streams = []
+    for i in range(count):
+        streams.append([
+            rpath.RORPath((b"dir", b"file_%06d" % j), {'type': 'reg'})
+            for j in range(i % 20, files, 20)
+        ])
+    t = time.time()
+    for tuple in rorpiter.CollateIterators(*map(iter, streams)):
+        pass
+    print("Collating %d iterators of %d rorps each: %ss" %
+          (count, files // 20, time.time() - t))
+
+
+def iterfile_throughput():
+    """Time sending a large file through FileWrappingIter"""
+    import io
+    from rdiff_backup import iterfile
+    buf = b"0123456789abcdef" * (4 * 1024 * 1024)  # 64MB
+    file_iter = iterfile.FileWrappingIter(iter([io.BytesIO(buf)]))
+    t = time.time()
+    size = 0
+    while 1:
+        chunk = file_iter.read(1024 * 1024)
+        if not chunk: break
+        size += len(chunk)
+    seconds = max(time.time() - t, 1e-6)
+    print("Sent %d bytes at %.1f MB/s" % (size, size / seconds / 1e6))
+
+
+def blocksize_policies():
+    """Compare signature and delta sizes of the block size policies"""
+    import io
+    import random
+    from rdiff_backup import Rdiff, librsync
+    size = 32 * 1024 * 1024
+    basis = os.urandom(size)
+    database = bytearray(basis)
+    for i in range(50):  # change a few 4KB pages
+        offset = random.randrange(size // 4096) * 4096
+        database[offset:offset + 4096] = os.urandom(4096)
+    cases = [("append-only log", basis + os.urandom(size // 100),
+              Rdiff.SMALL_CHANGE),
+             ("database", bytes(database), Rdiff.SMALL_CHANGE),
+             ("rewritten", os.urandom(size), Rdiff.REWRITTEN)]
+
+    for name, new, change in cases:
+        for policy in ("size", "history"):
+            if policy == "history": Rdiff._change_history = {(b"f", ): change}
+            else: Rdiff._change_history = None
+            t = time.time()
+            blocksize = Rdiff.find_blocksize(len(basis), (b"f", ))
+            sig = librsync.SigFile(io.BytesIO(basis), blocksize).read()
+            delta = librsync.DeltaFile(sig, io.BytesIO(new)).read()
+            print("%s, %s policy: block size %d, signature %d bytes, "
+                  "delta %d bytes, %.2fs" % (name, policy, blocksize,
+                                             len(sig), len(delta),
+                                             time.time() - t))
+    Rdiff._change_history = None
+
+
+def restore_increments():
+    """Time restoring a 10GB file through 30 increments
+
+	The reverse diffs are written directly in the librsync delta
+	format, each replacing 20 random 64KB regions, because computing
+	30 real signatures and deltas of a file this size takes hours.
+	Each way of reading the basis file is timed, and so is composing
+	the diffs with the deltachain module.  Then the same ways of
+	reading are timed with a delta of small copies from all over the
+	basis, where reading ahead reads bytes which aren't used.
+
+	"""
+    import hashlib
+    import random
+    import struct
+    import tempfile
+    from rdiff_backup import Rdiff, deltachain
+    size, count, region = 10 * 1024**3, 30, 64 * 1024
+    chunk = os.urandom(64 * 1024 * 1024)
+    os.makedirs(output_desc)
+    mirror_path = os.path.join(output_desc, b"mirror")
+    with open(mirror_path, "wb") as fp:
+        for i in range(size // len(chunk)):
+            fp.write(chunk)
+
+    final_regions, delta_paths = {}, []
+    for i in range(count):
+        offsets = sorted(random.sample(range(size // region), 20))
+        delta_paths.append(os.path.join(output_desc, b"delta.%d" % i))
+        with open(delta_paths[-1], "wb") as fp:
+            fp.write(deltachain.DELTA_MAGIC)
+            pos = 0
+            for offset in offsets:
+                data = os.urandom(region)
+                final_regions[offset] = data
+                if offset * region > pos:
+                    fp.write(struct.pack(">BQQ", deltachain.OP_COPY_N8_N8,
+                                         pos, offset * region - pos))
+                fp.write(struct.pack(">BQ", deltachain.OP_LITERAL_N8, region)
+                         + data)
+                pos = offset * region + region
+            if pos < size:
+                fp.write(struct.pack(">BQQ", deltachain.OP_COPY_N8_N8,
+                                     pos, size - pos))
+            fp.write(bytes([deltachain.OP_END]))
+
+    expected = hashlib.sha1()
+    for i in range(size // region):
+        expected.update(final_regions.get(i) or
+                        chunk[i * region % len(chunk):][:region])
+
+    for name, mmap_basis, read_ahead in (("stdio", 0, 0),
+                                         ("1MB read-ahead", 0, 1024 * 1024),
+                                         ("mmap", 1, 0), ("composed", 0, 0)):
+        Globals.mmap_basis, Globals.basis_read_ahead = mmap_basis, read_ahead
+        t = time.time()
+        current_fp = open(mirror_path, "rb")
+        delta_fps = (open(delta_path, "rb") for delta_path in delta_paths)
+        if name == "composed":
+            new_fp = tempfile.TemporaryFile(dir=output_desc)
+            rpath.copyfileobj(deltachain.compose(current_fp, delta_fps),
+                              new_fp)
+            new_fp.seek(0)
+            current_fp = new_fp
+        for delta_fp in delta_fps:
+            new_fp = tempfile.TemporaryFile(dir=output_desc)
+            Rdiff.write_patched_fp(current_fp, delta_fp, new_fp)
+            new_fp.seek(0)
+            current_fp = new_fp
+        seconds = time.time() - t
+        assert get_sha1(current_fp) == expected.digest(), name
+        print("Restoring through %d increments, %s: %.1fs" %
+              (count, name, seconds))
+
+    scattered_path = os.path.join(output_desc, b"delta.scattered")
+    copies = [random.randrange(size // 4096) * 4096 for i in range(20000)]
+    expected = hashlib.sha1()
+    with open(scattered_path, "wb") as fp:
+        fp.write(deltachain.DELTA_MAGIC)
+        for offset in copies:
+            fp.write(struct.pack(">BQQ", deltachain.OP_COPY_N8_N8, offset,
+                                 4096))
+            start = offset % len(chunk)
+            expected.update(chunk[start:start + 4096])
+        fp.write(bytes([deltachain.OP_END]))
+
+    for name, mmap_basis, read_ahead in (("stdio", 0, 0),
+                                         ("1MB read-ahead", 0, 1024 * 1024),
+                                         ("mmap", 1, 0)):
+        Globals.mmap_basis, Globals.basis_read_ahead = mmap_basis, read_ahead
+        t = time.time()
+        new_fp = tempfile.TemporaryFile(dir=output_desc)
+        Rdiff.write_patched_fp(open(mirror_path, "rb"),
+                               open(scattered_path, "rb"), new_fp)
+        seconds = time.time() - t
+        new_fp.seek(0)
+        assert get_sha1(new_fp) == expected.digest(), name
+        print("Patching %d scattered 4KB copies, %s: %.1fs" %
+              (len(copies), name, seconds))
+
+
+def get_sha1(fp):
+    """Return SHA1 digest of the rest of file object fp, and close it"""
+    import hashlib
+    result = hashlib.sha1()
+    for buf in iter(lambda: fp.read(1024 * 1024), b""):
+        result.update(buf)
+    fp.close()
+    return result.digest()
+
+
 if len(sys.argv) < 2 or len(sys.argv) > 3:
     print("Syntax:  benchmark.py benchmark_func [output_description]")
     print("")
     print("Where output_description defaults to '%s'." % abs_output_dir)
     print("Currently benchmark_func includes:")
-    print("'many_files', 'many_files_rsync', and, 'nested_files'.")
+    print("'many_files', 'many_files_rsync', 'nested_files', "
+          "'server_startup', 'main_import', 'collate_iterators', "
+          "'iterfile_throughput', 'blocksize_policies', and "
+          "'restore_increments'.")
     sys.exit(1)
 
 if len(sys.argv) == 3:
@@ -0,0 +1,161 @@
+import unittest
+import os
+import fcntl
+from commontest import MakeOutputDir
+from rdiff_backup import Globals, Time, rpath, changejournal
+from rdiff_backup.selection import Select
+
+
+class ChangeHintsTest(unittest.TestCase):
+    """Test the tree of changed indicies"""
+
+    def testStatus(self):
+        """Changed entries, their parents and changed trees are told apart"""
+        hints = changejournal.ChangeHints()
+        hints.add((b"a", b"b"), 0)
+        hints.add((b"c", ), 1)
+        hints.add((b"c", b"d"), 0)
+        assert hints.get_status(()) == changejournal.DESCEND
+        assert hints.get_status((b"a", )) == changejournal.DESCEND
+        assert hints.get_status((b"a", b"b")) == changejournal.DESCEND
+        assert hints.get_status((b"a", b"b", b"x")) == changejournal.REUSE
+        assert hints.get_status((b"a", b"x")) == changejournal.REUSE
+        assert hints.get_status((b"c", b"x")) == changejournal.WALK
+        assert not hints.everything_changed()
+        hints.add((), 1)
+        assert hints.everything_changed()
+
+
+class JournalTest(unittest.TestCase):
+    """Test taking the journal and reading only changed files"""
+
+    def setUp(self):
+        self.outdir = MakeOutputDir()
+        self.journal = self.outdir.append("journal").path
+        self.lock_fd = os.open(changejournal.get_lock_path(self.journal),
+                               os.O_RDONLY | os.O_CREAT)
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)  # pretend recorder runs
+
+    def tearDown(self):
+        if self.lock_fd is not None: os.close(self.lock_fd)
+
+    def write_journal(self, records):
+        with open(self.journal, "ab") as fp:
+            fp.write(b"".join([record + b"\0" for record in records]))
+
+    def testTakeJournal(self):
+        """Journals of failed sessions are read again"""
+        Time.setcurtime_local(20000)
+        Time.setprevtime_local(10000, Time.timetostring(10000))
+        self.write_journal([b"E/foo/bar", b"T/foo/baz"])
+        assert changejournal.take_journal(self.journal) == \
+            [(b"/foo/bar", False), (b"/foo/baz", True)]
+        assert not os.path.exists(self.journal)
+
+        Time.setcurtime_local(30000)  # session at 20000 failed
+        self.write_journal([b"E/foo/new"])
+        assert changejournal.take_journal(self.journal) == \
+            [(b"/foo/bar", False), (b"/foo/baz", True), (b"/foo/new", False)]
+
+        Time.setcurtime_local(40000)
+        Time.setprevtime_local(30000, Time.timetostring(30000))
+        assert changejournal.take_journal(self.journal) == []
+        assert [session_time for session_time, path in
+                changejournal.get_taken_journals(self.journal)] == []
+
+        os.close(self.lock_fd)  # recorder stopped
+        self.lock_fd = None
+        assert changejournal.take_journal(self.journal) is None
+
+    def check_hinted(self, selection_args):
+        """Only reading changed files gives the same rpaths as a full walk
+
+		selection_args is a function taking the source directory path
+		and returning the tuples given to Select.ParseArgs.
+
+		"""
+        source = self.outdir.append("source")
+        for index in [(b"a", b"b"), (b"a", b"c"), (b"d", b"e", b"f")]:
+            rp = source.new_index(index)
+            rp.get_parent_rp().makedirs()
+            rp.write_string("hello")
+
+        def get_select():
+            select = Select(rpath.RPath(Globals.local_connection,
+                                        source.path))
+            select.ParseArgs(selection_args(os.fsdecode(source.path)), [])
+            return select.set_iter()
+
+        mirror_rorps = [rp.getRORPath() for rp in get_select()]
+        changed = source.new_index((b"d", b"e", b"f"))
+        changed.write_string("changed")
+        source.new_index((b"d", b"g")).write_string("new")
+        hints = changejournal.ChangeHints()
+        hints.add(changed.index, 0)
+        hints.add((b"d", b"g"), 0)
+
+        expected = [rp.getRORPath() for rp in get_select()]
+        result = list(changejournal.HintedIter(get_select(), hints,
+                                               iter(mirror_rorps)))
+        assert [rp.index for rp in result] == [rp.index for rp in expected]
+        for rp, expected_rorp in zip(result, expected):
+            assert rp == expected_rorp, (rp.index, rp.data,
+                                         expected_rorp.data)
+        return result
+
+    def testHintedIter(self):
+        """Only reading changed files gives the same rpaths"""
+        self.check_hinted(lambda source: [])
+
+    def testHintedScan(self):
+        """Files scanned by one selection function, included by the next"""
+        result = self.check_hinted(lambda source: [
+            ("--include", source + "/a/**/nomatch"),
+            ("--include-regexp", "a/b$"), ("--exclude", "**")])
+        assert (b"a", b"b") in [rp.index for rp in result]
+
+    def testHintedOtherFilesystems(self):
+        """Selecting by device works although the metadata has none"""
+        self.check_hinted(lambda source: [("--exclude-other-filesystems",
+                                           "")])
+
+
+class RecorderTest(unittest.TestCase):
+    """Test turning inotify events into journal records"""
+
+    def setUp(self):
+        self.outdir = MakeOutputDir()
+        self.recorder = self.get_recorder()
+
+    def get_recorder(self):
+        """Return Recorder of the output dir, with root as watch 1"""
+        recorder = changejournal.Recorder(self.outdir.path,
+                                          self.outdir.append("journal").path)
+        recorder.wd_paths = {1: recorder.root}
+        recorder.path_wds = {recorder.root: 1}
+        return recorder
+
+    def get_event(self, mask, name=b""):
+        """Return the inotify event for watch 1, as read from its fd"""
+        return changejournal.event_header.pack(1, mask, 0,
+                                               len(name)) + name
+
+    def testChangedFile(self):
+        """A changed file is recorded and the recorder keeps running"""
+        records = self.recorder.get_records(
+            self.get_event(changejournal.IN_MODIFY, b"foo\0\0\0\0\0"))
+        assert records == [b"E" + self.recorder.root + b"/foo"], records
+        assert not self.recorder.error
+
+    def testRootGone(self):
+        """The recorder stops once the root directory goes away"""
+        for mask in (changejournal.IN_DELETE_SELF,
+                     changejournal.IN_MOVE_SELF, changejournal.IN_IGNORED):
+            recorder = self.get_recorder()
+            records = recorder.get_records(self.get_event(mask))
+            assert records == [b"T" + recorder.root], records
+            assert recorder.error
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -376,7 +376,7 @@ def CompareRecursive(src_rp,
 
 def reset_hardlink_dicts():
     """Clear the hardlink dictionaries"""
-    Hardlink._inode_index = {}
+    Hardlink.initialize_dictionaries()
 
 
 def BackupRestoreSeries(source_local,
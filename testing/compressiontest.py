@@ -0,0 +1,139 @@
+import unittest
+import gzip
+import io
+import os
+from commontest import MakeOutputDir
+from rdiff_backup import Globals, compression, rpath
+
+
+class ParallelGzipTest(unittest.TestCase):
+    """Test the multithreaded gzip writer"""
+
+    def get_data(self):
+        """Return list of strings to write, about 200KB in total"""
+        return [b"%d %s\n" % (i, os.urandom(20).hex().encode())
+                for i in range(4000)]
+
+    def write_gzip(self, data, threads):
+        """Write data to gzip string with threads, return (string, file)"""
+        outfp = io.BytesIO()
+        gzfp = compression.ParallelGzipFile(outfp, threads)
+        gzfp.block_size = 10000
+        outfp.close = lambda: None
+        for buf in data:
+            gzfp.write(buf)
+        gzfp.close()
+        return outfp.getvalue(), gzfp
+
+    def testThreads(self):
+        """Data written with several threads is one valid gzip file"""
+        data = self.get_data()
+        for threads in (1, 4):
+            gzstring, gzfp = self.write_gzip(data, threads)
+            assert gzip.decompress(gzstring) == b"".join(data)
+            assert len(gzfp.member_offsets) > 10, gzfp.member_offsets
+
+    def testSharedExecutor(self):
+        """All files compress in the same pool, grown when needed"""
+        data = self.get_data()
+        self.write_gzip(data, 2)
+        executor = compression.get_executor(2)
+        self.write_gzip(data, 2)
+        assert compression.get_executor(2) is executor
+        gzstring, gzfp = self.write_gzip(data, 3)
+        assert gzip.decompress(gzstring) == b"".join(data)
+        assert compression.get_executor(3) is not executor
+        compression.shutdown_executor()
+        assert compression._executor is None
+
+    def testEndMember(self):
+        """Reading may start at any member"""
+        data = self.get_data()
+        outfp = io.BytesIO()
+        outfp.close = lambda: None
+        gzfp = compression.ParallelGzipFile(outfp, 3)
+        starts = []
+        for i in range(len(data)):
+            if i % 500 == 0: starts.append((gzfp.end_member(), i))
+            gzfp.write(data[i])
+        gzfp.close()
+        for member, i in starts:
+            offset = gzfp.member_offsets[member]
+            assert (gzip.decompress(outfp.getvalue()[offset:]) ==
+                    b"".join(data[i:]))
+
+
+class WireCompressionTest(unittest.TestCase):
+    """Test compressing connection frames"""
+
+    def testRoundTrip(self):
+        """Compressed frames decompress to the original data"""
+        data = b"".join([b"%d\n" % i for i in range(10000)])
+        for codec in compression.wire_codecs:
+            compressed = compression.compress_frame(codec, data)
+            assert len(compressed) < len(data) / 2, codec
+            assert compression.decompress_frame(compressed) == data
+
+    def testSkipped(self):
+        """Short, compressed, or random data isn't compressed"""
+        assert compression.compress_frame("zlib", b"short") is None
+        gzipped = gzip.compress(b"a" * 100000) + b"b" * 100000
+        assert compression.compress_frame("zlib", gzipped) is None
+        assert compression.compress_frame("zlib", os.urandom(100000)) is None
+
+
+class CodecTest(unittest.TestCase):
+    """Test choosing the codec by file suffix"""
+
+    def setUp(self):
+        self.outdir = MakeOutputDir()
+
+    def tearDown(self):
+        Globals.compression_threads = 1
+        Globals.compression_codec = "gzip"
+
+    def write_read(self, filename):
+        """Write and read back some data through rpath.GzipFile"""
+        rp = self.outdir.append(filename)
+        fp = rpath.GzipFile(rp.path, "wb")
+        fp.write(b"hello, world\n" * 1000)
+        assert not fp.close()
+        fp = rpath.GzipFile(rp.path, "rb")
+        assert fp.read() == b"hello, world\n" * 1000
+        fp.close()
+        return rp
+
+    def testGetCodec(self):
+        """Codecs are recognized by file suffix"""
+        assert compression.get_codec(b"foo.2019-01-01T00:00:00Z.diff.gz") \
+            == "gzip"
+        assert compression.get_codec(b"foo.2019-01-01T00:00:00Z.diff.zst") \
+            == "zstd"
+        assert compression.get_codec(b"rdiff-backup.tmp.3") == "gzip"
+
+    def testIncfileInfo(self):
+        """Increments of all codecs are recognized"""
+        for suffix in (b"gz", b"zst"):
+            info = rpath.get_incfile_info(
+                b"foo.2019-01-01T00:00:00Z.diff." + suffix)
+            assert info == (1, b"2019-01-01T00:00:00Z", b"diff", b"foo"), info
+
+    def testThreadedGzip(self):
+        """Threaded gzip files can be read by gzip"""
+        Globals.compression_threads = 4
+        rp = self.write_read(b"threaded.gz")
+        with gzip.open(rp.path) as fp:
+            assert fp.read() == b"hello, world\n" * 1000
+
+    @unittest.skipUnless(compression.zstandard, "zstandard not available")
+    def testZstd(self):
+        """zst files are written and read with zstd"""
+        Globals.compression_codec = "zstd"
+        assert compression.get_suffix() == b"zst"
+        rp = self.write_read(b"file.zst")
+        with open(rp.path, "rb") as fp:
+            assert fp.read(4) == b"\x28\xb5\x2f\xfd"  # zstd magic number
+
+
+if __name__ == "__main__":
+    unittest.main()
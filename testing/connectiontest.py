@@ -1,4 +1,5 @@
 import unittest
+import io
 import tempfile
 import os
 import sys
@@ -6,7 +7,7 @@ import subprocess
 from commontest import old_test_dir, abs_test_dir
 from rdiff_backup.connection import LowLevelPipeConnection, PipeConnection, \
     VirtualFile, SetConnections
-from rdiff_backup import Globals, rpath, FilenameMapping  # , log
+from rdiff_backup import Globals, rpath, FilenameMapping, iterfile  # , log
 
 SourceDir = 'rdiff_backup'
 regfilename = os.path.join(old_test_dir, b"various_file_types",
@@ -49,6 +50,13 @@ class LocalConnectionTest(unittest.TestCase):
         """Test string evaluation"""
         assert self.lc.reval("pow", 2, 3) == 8
 
+    def testRevalAsync(self):
+        """Local async requests are done right away"""
+        future = self.lc.reval_async("pow", 2, 3)
+        assert future.done() and future.result() == 8
+        future = self.lc.reval_async("int", "a")
+        self.assertRaises(ValueError, future.result)
+
 
 class LowLevelPipeConnectionTest(unittest.TestCase):
     """Test LLPC class"""
@@ -94,6 +102,76 @@ class LowLevelPipeConnectionTest(unittest.TestCase):
                 assert isinstance(incoming_exception[1], exception.__class__)
         os.unlink(self.filename)
 
+    def testCompactRORPaths(self):
+        """RORPaths are sent in the compact encoding if it is negotiated"""
+        rorps = [rpath.RORPath((b"a", b"b"), {'type': 'reg', 'size': 5}),
+                 rpath.RORPath((), {'type': 'sym', 'linkname': 'not bytes'})]
+        with open(self.filename, "wb") as outpipe:
+            LLPC = LowLevelPipeConnection(None, outpipe)
+            LLPC.rorp_codec_version = 1
+            for rorp in rorps:
+                LLPC._putrorpath(rorp, 4)
+        with open(self.filename, "rb") as inpipe:
+            assert inpipe.read(1) == b"n"
+            inpipe.seek(0)
+            LLPC = LowLevelPipeConnection(inpipe, None)
+            for rorp in rorps:
+                req_num, gotten = LLPC._get()
+                assert req_num == 4 and gotten.index == rorp.index
+                assert gotten.data == rorp.data, gotten.data
+        os.unlink(self.filename)
+
+    def testCompactIterators(self):
+        """Iterators put down the pipe send RORPaths in the compact encoding"""
+        rorps = [rpath.RORPath((b"a", ), {'type': 'dir', 'perms': 0o755}),
+                 rpath.RORPath((b"a", b"b"), {'type': 'reg', 'size': 5}),
+                 rpath.RORPath((b"a", b"c"), {'type': 'reg', 'size': 0})]
+        rorps[1].setfile(io.BytesIO(b"hello"))
+        with open(self.filename, "wb") as outpipe:
+            LLPC = LowLevelPipeConnection(None, outpipe)
+            LLPC.rorp_codec_version = 1
+            LLPC._putiter(iter(rorps), 4)
+        with open(self.filename, "rb") as inpipe:
+            header = inpipe.read(9)
+            assert header[0:1] == b"i" and header[1] == 4, header
+            vfile_id = int(inpipe.read(int.from_bytes(header[2:], 'big')))
+        os.unlink(self.filename)
+
+        # What the other side reads from the iterator's VirtualFile
+        buf = VirtualFile.readfromid(vfile_id, None)
+        types, pos = [], 0
+        while pos < len(buf):
+            types.append(buf[pos:pos + 1])
+            pos += 8 + int.from_bytes(buf[pos + 1:pos + 8], 'big')
+        assert types == [b"n", b"N", b"f", b"c", b"h", b"n", b"z"], types
+
+        new_iter = iterfile.FileToMiscIter(io.BytesIO(buf))
+        for rorp in rorps:
+            gotten = next(new_iter)
+            assert gotten.index == rorp.index, gotten.index
+            assert gotten.data == rorp.data, gotten.data
+            if rorp.file: assert gotten.file.read() == b"hello"
+            else: assert not gotten.file
+        self.assertRaises(StopIteration, new_iter.__next__)
+
+    def testCompressedFrames(self):
+        """Frames are compressed if wire compression is on"""
+        buf = b"compressible " * 10000
+        with open(self.filename, "wb") as outpipe:
+            LLPC = LowLevelPipeConnection(None, outpipe)
+            LLPC.wire_compression = "zlib"
+            LLPC._putbuf(buf, 5)
+            for obj in self.objs:
+                LLPC._putobj(obj, 3)
+        assert LLPC.wire_bytes < LLPC.wire_raw_bytes / 10
+        with open(self.filename, "rb") as inpipe:
+            LLPC = LowLevelPipeConnection(inpipe, None)
+            assert LLPC._get() == (5, buf)
+            for obj in self.objs:
+                assert LLPC._get() == (3, obj)
+        assert LLPC.wire_raw_bytes > len(buf) > LLPC.wire_bytes * 10
+        os.unlink(self.filename)
+
 
 class PipeConnectionTest(unittest.TestCase):
     """Test Pipe connection"""
@@ -182,6 +260,30 @@ class PipeConnectionTest(unittest.TestCase):
         self.assertRaises(SyntaxError, self.conn.reval, "aoetnsu aoehtnsu")
         assert self.conn.pow(2, 3) == 8
 
+    def testRevalAsync(self):
+        """Test requests sent without waiting for the response"""
+        futures = [self.conn.reval_async("pow", 2, i) for i in range(300)]
+        error = self.conn.reval_async("int", "a")
+        assert self.conn.reval("ord", "a") == 97
+        assert [f.result() for f in futures] == [2**i for i in range(300)]
+        self.assertRaises(ValueError, error.result)
+        assert not self.conn.async_requests
+
+    def testRevalAsyncCallback(self):
+        """Async requests may call back while others are in flight
+
+		Each request reads its own iterator, which calls back to this
+		side, and must not be answered inside another one.
+
+		"""
+        futures = [
+            self.conn.reval_async(
+                "lambda i: (PipeConnection.answering, list(i))",
+                iter(range(j, j + 3))) for j in range(50)
+        ]
+        for j, future in enumerate(futures):
+            assert future.result() == (1, list(range(j, j + 3))), j
+
     def tearDown(self):
         """Bring down connection"""
         self.conn.quit()
@@ -0,0 +1,45 @@
+import unittest
+import io
+import os
+from commontest import MakeOutputDir
+from rdiff_backup import deltachain, librsync
+
+
+class DeltaChainTest(unittest.TestCase):
+    """Test composing chains of reverse diffs"""
+
+    def get_delta(self, basis, new):
+        """Return delta which turns basis into new"""
+        sig = librsync.SigFile(io.BytesIO(basis), 512).read()
+        return librsync.DeltaFile(sig, io.BytesIO(new)).read()
+
+    def testCompose(self):
+        """Composed diffs give the same file as applying them in turn"""
+        versions = [os.urandom(100000)]
+        for i in range(10):
+            old = bytearray(versions[-1])
+            for j in range(5):
+                offset = (i * 7919 + j * 15013) % len(old)
+                old[offset:offset + 300] = os.urandom(200)
+            versions.append(bytes(old) + os.urandom(i * 100))
+        deltas = [self.get_delta(newer, older)
+                  for newer, older in zip(versions, versions[1:])]
+
+        mirror = MakeOutputDir().append("mirror")
+        with open(mirror.path, "wb") as fp:
+            fp.write(versions[0])
+        for count in (1, 2, 10):
+            fp = deltachain.compose(mirror.open("rb"),
+                                    map(io.BytesIO, deltas[:count]))
+            assert fp.read() == versions[count], count
+            fp.close()
+
+    def testBadDelta(self):
+        """Copies past the end of the basis are errors"""
+        delta = deltachain.DELTA_MAGIC + b"\x45\x00\x04\x00"
+        self.assertRaises(librsync.librsyncError, deltachain.compose,
+                          io.BytesIO(b"abc"), [io.BytesIO(delta)])
+
+
+if __name__ == "__main__":
+    unittest.main()
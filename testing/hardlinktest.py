@@ -55,6 +55,26 @@ class HardlinkTest(unittest.TestCase):
             Hardlink.del_rorp(dsrp)
         assert Hardlink._inode_index == {}, Hardlink._inode_index
 
+    def testSpilledDict(self):
+        """Hard link dictionary with most entries on disk"""
+        Globals.hardlink_memory_entries = 1
+        try:
+            reset_hardlink_dicts()
+            for dsrp in selection.Select(self.hlinks_rp3).set_iter():
+                Hardlink.add_rorp(dsrp)
+            assert len(Hardlink._inode_index) == 3
+            assert Hardlink._inode_index.disk_entries == 2
+            assert Hardlink.get_table_stats()[0] == 3
+
+            reset_hardlink_dicts()
+            for dsrp in selection.Select(self.hlinks_rp1).set_iter():
+                Hardlink.add_rorp(dsrp)
+                Hardlink.del_rorp(dsrp)
+            assert Hardlink._inode_index == {}, Hardlink._inode_index
+            Hardlink.clear_dictionaries()
+        finally:
+            Globals.hardlink_memory_entries = None
+
     def testSeries(self):
         """Test hardlink system by backing up and restoring a few dirs"""
         dirlist = [
@@ -1,8 +1,9 @@
 import unittest
 import io
 import sys
+import hashlib
 from commontest import iter_equal, abs_output_dir, Myrm
-from rdiff_backup import rpath, Globals
+from rdiff_backup import rpath, Globals, hash, rorpiter
 from rdiff_backup.iterfile import IterWrappingFile, FileWrappingIter, \
     FileToMiscIter, MiscIterToFile, MiscIterFlush, MiscIterFlushRepeat
 
@@ -64,6 +65,35 @@ class testIterFile(unittest.TestCase):
         assert next(new_iter) == b"foo"
         self.assertRaises(StopIteration, new_iter.__next__)
 
+    def testCompactRorps(self):
+        """Test sending RORPaths in the compact encoding"""
+        objs = [
+            rpath.RORPath((), {'type': 'dir', 'perms': 0o755}), 5,
+            rpath.RORPath((b"a", b"b"), {'type': 'reg', 'size': 3})
+        ]
+        file_iter = FileWrappingIter(iter(objs))
+        file_iter.rorp_codec = 1
+        assert iter_equal(iter(objs), IterWrappingFile(file_iter))
+
+    def testReadChunk(self):
+        """Short reads don't keep a whole block of memory"""
+        for fp in (io.BytesIO(b"abc"), hash.FileWrapper(io.BytesIO(b"abc")),
+                   rorpiter.PrefetchedFile(b"abc", None)):
+            file_iter = FileWrappingIter(iter([]))
+            file_iter.currently_in_file = fp
+            chunk = file_iter.read_chunk(Globals.blocksize)
+            assert chunk == b"abc", chunk
+            assert sys.getsizeof(chunk) < 1024, sys.getsizeof(chunk)
+            assert file_iter.read_chunk(Globals.blocksize) == b""
+
+    def testLargeFile(self):
+        """Send a file of many blocks through readinto() wrappers"""
+        buf = b"0123456789abcdef" * (1024 * 1024)  # 16MB
+        wrapped = hash.FileWrapper(io.BytesIO(buf))
+        new_iter = IterWrappingFile(FileWrappingIter(iter([wrapped])))
+        assert next(new_iter).read() == buf
+        assert wrapped.close().sha1_digest == hashlib.sha1(buf).hexdigest()
+
 
 class testMiscIters(unittest.TestCase):
     """Test sending rorpiter back and forth"""
@@ -177,6 +207,32 @@ class testMiscIters(unittest.TestCase):
         assert next(i_out2) == self.outputrp
         self.assertRaises(StopIteration, i_out2.__next__)
 
+    def testAttachedFiles(self):
+        """Send rorps with files of several blocks, read in pieces"""
+        datas = [b"", b"abc", b"x" * (3 * Globals.blocksize + 7)] * 2
+        rorps = [rpath.RORPath((b"dir", ), {'type': 'dir'})]
+        for i, data in enumerate(datas):
+            rorp = rpath.RORPath((b"file%d" % i, ), {'type': 'reg',
+                                                     'size': len(data)})
+            rorp.setfile(io.BytesIO(data))
+            rorps.append(rorp)
+
+        i_out = FileToMiscIter(MiscIterToFile(iter(rorps)))
+        assert next(i_out) == rorps[0]
+        for i, data in enumerate(datas):
+            out = next(i_out)
+            assert out == rorps[i + 1], (out, rorps[i + 1])
+            if i >= 3: continue  # unread files are skipped by next()
+            fp = out.open("rb")
+            pieces = []
+            while 1:
+                buf = fp.read(1000)
+                if not buf: break
+                pieces.append(buf)
+            assert b"".join(pieces) == data
+            assert not fp.close()
+        self.assertRaises(StopIteration, i_out.__next__)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import subprocess
+import sys
+from rdiff_backup import lazyimport
+
+# Prints the rdiff-backup modules which have actually been executed
+list_loaded = """
+import sys
+import rdiff_backup.Main
+from rdiff_backup import lazyimport
+for name, module in sorted(sys.modules.items()):
+    if name.startswith("rdiff_backup.") and lazyimport.is_loaded(module):
+        print(name[len("rdiff_backup."):])
+"""
+
+
+class LazyImportTest(unittest.TestCase):
+    """Test importing modules on first use"""
+
+    def get_loaded(self):
+        """Start a new python importing Main, return modules loaded"""
+        output = subprocess.check_output([sys.executable, "-c", list_loaded])
+        return output.decode().split()
+
+    def testStartup(self):
+        """Starting rdiff-backup doesn't load modules of other actions"""
+        loaded = self.get_loaded()
+        assert "Main" in loaded and "connection" in loaded, loaded
+        for name in ("restore", "regress", "compare", "manage",
+                     "fs_abilities", "Hardlink"):
+            assert name not in loaded, (name, loaded)
+
+    def testThreadModules(self):
+        """Modules used by worker threads are loaded at startup"""
+        loaded = self.get_loaded()
+        for name in ("librsync", "statistics"):
+            assert name in loaded, (name, loaded)
+
+    def testLoadOnUse(self):
+        """A lazy module is executed when an attribute is looked up"""
+        module = lazyimport.lazy_import("compare")
+        from rdiff_backup import compare
+        assert compare is module
+        compare.Compare  # executes the module
+        assert lazyimport.is_loaded(compare)
+
+
+if __name__ == "__main__":
+    unittest.main()
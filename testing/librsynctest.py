@@ -2,6 +2,9 @@ import unittest
 import random
 import subprocess
 import os
+import io
+import time
+import concurrent.futures
 from commontest import abs_test_dir
 from rdiff_backup import Globals, librsync, rpath
 
@@ -169,6 +172,58 @@ class LibrsyncTest(unittest.TestCase):
             assert real_new == librsync_new, \
                 (len(real_new), len(librsync_new))
 
+    def testPatchBasisReads(self):
+        """Patching gives the same result however the basis is read"""
+        for length in (0, 300000):  # empty files can't be mapped
+            basis = os.urandom(length)
+            with open(self.basis.path, "wb") as fp:
+                fp.write(basis)
+            new = basis[1000:50000] + os.urandom(5000) + basis[:20000]
+            sig = librsync.SigFile(io.BytesIO(basis), 512).read()
+            delta = librsync.DeltaFile(sig, io.BytesIO(new)).read()
+            for use_mmap, read_ahead in ((0, 0), (0, 4096), (1, 0)):
+                pf = librsync.PatchedFile(self.basis.open("rb"),
+                                          io.BytesIO(delta), use_mmap,
+                                          read_ahead)
+                assert pf.read() == new, (length, use_mmap, read_ahead)
+                pf.close()
+
+    def testThreadedThroughput(self):
+        """Signatures, deltas and patches are right from several threads
+
+        The C module releases the GIL while librsync works, so
+        several files can be processed at the same time.  The speedup
+        depends on the machine, so it is only printed.
+
+        """
+        MakeRandomFile(self.basis.path, 4 * 1024 * 1024)
+        with self.basis.open("rb") as fp:
+            basis = fp.read()
+        new = basis[:1000000] + os.urandom(10000) + basis[1000000:]
+
+        def sig_delta_patch(i):
+            sig = librsync.SigFile(io.BytesIO(basis)).read()
+            delta = librsync.DeltaFile(sig, io.BytesIO(new)).read()
+            pf = librsync.PatchedFile(self.basis.open("rb"),
+                                      io.BytesIO(delta))
+            patched = pf.read()
+            pf.close()
+            return patched
+
+        def run(threads, jobs=8):
+            start = time.time()
+            with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+                results = list(executor.map(sig_delta_patch, range(jobs)))
+            seconds = max(time.time() - start, 1e-6)
+            assert results == [new] * jobs
+            print("%d threads: %.1f MB/s" %
+                  (threads, jobs * len(new) / seconds / 1e6))
+            return seconds
+
+        serial = run(1)
+        threaded = run(min(os.cpu_count() or 1, 4))
+        print("Speedup: %.2f" % (serial / max(threaded, 1e-6)))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,11 +1,14 @@
 import unittest
 import os
 import io
+import gzip
 import time
 from commontest import old_test_dir, abs_output_dir, iter_equal
 from rdiff_backup import rpath, Globals, selection
 from rdiff_backup.metadata import MetadataFile, PatchDiffMan, \
-    quote_path, unquote_path, RORP2Record, Record2RORP, RorpExtractor
+    quote_path, unquote_path, RORP2Record, Record2RORP, RorpExtractor, \
+    BinaryMetadataFile, RORP2BinaryRecord, BinaryRecord2RORP, \
+    get_index_rp, find_index_offset, MemberGzipFile
 
 tempdir = rpath.RPath(Globals.local_connection, abs_output_dir)
 
@@ -249,5 +252,169 @@ class MetadataTest(unittest.TestCase):
         compare(man, inc4, 40000)
 
 
+class BinaryMetadataTest(MetadataTest):
+    """Run the metadata tests again, writing the binary format"""
+
+    def setUp(self):
+        Globals.metadata_format = "binary"
+
+    def tearDown(self):
+        Globals.metadata_format = "text"
+
+    def write_metadata_to_temp(self):
+        """If necessary, write binary metadata of bigdir to file"""
+        temprp = tempdir.append(
+            "mirror_metadata.2005-11-03T14:51:06-06:00.snapshot")
+        if temprp.lstat():
+            return temprp
+
+        self.make_temp()
+        rootrp = rpath.RPath(Globals.local_connection,
+                             os.path.join(old_test_dir, b"bigdir"))
+        mf = MetadataFile(temprp, 'w')
+        assert isinstance(mf, BinaryMetadataFile)
+        for rp in selection.Select(rootrp).set_iter():
+            mf.write_object(rp)
+        mf.close()
+        return temprp
+
+    def testSpeed(self):
+        """Test reading the binary metadata of 10000 files"""
+        temprp = self.write_metadata_to_temp()
+        start_time = time.time()
+        i = 0
+        for rorp in MetadataFile(temprp, 'r').get_objects():
+            i += 1
+        print("Reading %s binary metadata entries took %s seconds." %
+              (i, time.time() - start_time))
+
+    def testBinaryRecord(self):
+        """Test turning RORPs into binary records and back again"""
+        for rp in self.get_rpaths():
+            record = RORP2BinaryRecord(rp)
+            new_rorp = BinaryRecord2RORP(record, 4)
+            assert new_rorp == rp, (new_rorp, rp, record)
+            assert new_rorp.data == Record2RORP(RORP2Record(rp)).data
+
+    def testReadBothFormats(self):
+        """Text and binary files are both read by MetadataFile"""
+        self.make_temp()
+        rps = self.get_rpaths()[:-1]
+        textrp = tempdir.append(
+            "mirror_metadata.2005-11-03T12:51:06-06:00.snapshot.gz")
+        Globals.metadata_format = "text"
+        write_mf = MetadataFile(textrp, 'w')
+        assert not isinstance(write_mf, BinaryMetadataFile)
+        for rp in rps:
+            write_mf.write_object(rp)
+        write_mf.close()
+
+        Globals.metadata_format = "binary"
+        binrp = tempdir.append(
+            "mirror_metadata.2005-11-03T13:51:06-06:00.snapshot")
+        write_mf = MetadataFile(binrp, 'w')
+        for rp in rps:
+            write_mf.write_object(rp)
+        write_mf.close()
+
+        Globals.metadata_format = "text"
+        read_mf = MetadataFile(binrp, 'r')
+        assert isinstance(read_mf, BinaryMetadataFile)
+        assert iter_equal(read_mf.get_objects(),
+                          MetadataFile(textrp, 'r').get_objects())
+
+    def testBlockIndex(self):
+        """Restricted reads start at the block holding the index"""
+        temprp = self.write_metadata_to_temp()
+        mf = MetadataFile(temprp, 'r')
+        index_offset, blocks = mf._read_index()
+        mf.close()
+        assert len(blocks) > 1, blocks
+        assert blocks[0][0] == ()
+        first_indexes = [index for index, offset in blocks]
+        assert first_indexes == sorted(first_indexes)
+
+
+class MetadataIndexTest(unittest.TestCase):
+    """Test the sidecar index of compressed mirror_metadata files"""
+
+    def setUp(self):
+        if tempdir.lstat():
+            tempdir.delete()
+        tempdir.mkdir()
+        self.old_block_size = MetadataFile._index_block_size
+        MetadataFile._index_block_size = 4096
+        self.metarp = tempdir.append(
+            "mirror_metadata.2005-11-03T14:51:06-06:00.snapshot.gz")
+        rootrp = rpath.RPath(Globals.local_connection,
+                             os.path.join(old_test_dir, b"bigdir"))
+        mf = MetadataFile(self.metarp, 'w')
+        for rp in selection.Select(rootrp).set_iter():
+            mf.write_object(rp)
+        mf.close()
+
+    def tearDown(self):
+        MetadataFile._index_block_size = self.old_block_size
+
+    def get_restricted(self, index):
+        """Return list of rorps at or below index read from self.metarp"""
+        return list(MetadataFile(self.metarp, 'r').get_objects(index))
+
+    def testIndexWritten(self):
+        """The index lists increasing offsets"""
+        index_rp = get_index_rp(self.metarp)
+        assert index_rp.lstat()
+        lines = index_rp.get_bytes().split(b"\n")
+        assert lines[0] == b"%d %d" % (self.metarp.getsize(),
+                                       self.metarp.getmtime()), lines[0]
+        offsets = [int(line.split(b" ")[0]) for line in lines[1:-1]]
+        assert len(offsets) > 10, offsets
+        assert offsets == sorted(offsets)
+        assert find_index_offset(self.metarp, (b"subdir3", b"subdir10")) > 0
+
+    def testRestrictedRead(self):
+        """Seeking with the index gives the same rorps as a full scan"""
+        index = (b"subdir3", b"subdir10")
+        all_rorps = MetadataFile(self.metarp, 'r').get_objects()
+        expected = [
+            rorp for rorp in all_rorps if rorp.index[:len(index)] == index
+        ]
+        assert len(expected) == 51, len(expected)
+        assert iter_equal(iter(self.get_restricted(index)), iter(expected))
+
+    def testStaleIndex(self):
+        """An index whose size or mtime doesn't match is not used"""
+        index_rp = get_index_rp(self.metarp)
+        lines = index_rp.get_bytes().split(b"\n", 1)
+        size, mtime = self.metarp.getsize(), self.metarp.getmtime()
+        for header in (b"%d %d" % (size + 1, mtime),
+                       b"%d %d" % (size, mtime - 1), b"%d" % size):
+            index_rp.delete()
+            index_rp.write_bytes(header + b"\n" + lines[1])
+            assert find_index_offset(self.metarp, (b"subdir3", )) == 0
+            assert len(self.get_restricted((b"subdir3", b"subdir10"))) == 51
+
+    def testUncompressed(self):
+        """Uncompressed mirror_metadata files are written without index"""
+        metarp = tempdir.append(
+            "mirror_metadata.2005-11-04T14:51:06-06:00.snapshot")
+        mf = MetadataFile(metarp, 'w', compress=0)
+        mf.write_object(rpath.RORPath((b"foo", ), {'type': 'reg', 'size': 1}))
+        mf.close()
+        metarp.setdata()
+        assert metarp.lstat() and not get_index_rp(metarp).lstat()
+        assert [rorp.index for rorp in MetadataFile(metarp, 'r').get_objects()
+                ] == [(b"foo", )]
+
+    def testMemberGzipFile(self):
+        """MemberGzipFile starts reading at the given member"""
+        fileobj = io.BytesIO(gzip.compress(b"abc") + gzip.compress(b"def"))
+        offset = len(gzip.compress(b"abc"))
+        fp = MemberGzipFile(fileobj, offset)
+        assert fp.read() == b"def"
+        fp.close()
+        assert fileobj.closed
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,8 +1,10 @@
 import unittest
 import random
 import os
-from commontest import abs_test_dir, old_test_dir, abs_output_dir
-from rdiff_backup import Globals, Rdiff, log, rpath
+import re
+from commontest import abs_test_dir, old_test_dir, abs_output_dir, \
+    MakeOutputDir
+from rdiff_backup import Globals, Rdiff, Time, log, rpath
 
 log.Log.setverbosity(7)
 
@@ -164,6 +166,53 @@ class RdiffTest(unittest.TestCase):
         assert rpath.cmp(self.basis, self.new)
         list(map(rpath.RPath.delete, rplist))
 
+    def testBlocksizeHistory(self):
+        """Block sizes follow the changes in the previous file_statistics"""
+        rbdir = MakeOutputDir()
+        rbdir.append(b"file_statistics.%s.data" %
+                     Time.timetostring(10000).encode()).write_bytes(
+                         b"# Filename Changed SourceSize MirrorSize "
+                         b"IncrementSize\n"
+                         b". 1 NA NA NA\n"
+                         b"logs/app.log 1 1000000 990000 2000\n"
+                         b"logs/app\\nlog 1 1000000 990000 2000\n"
+                         b"data/archive.zip 1 1000000 1000000 950000\n"
+                         b"data/table.db 1 1000000 1000000 100000\n"
+                         b"data/unchanged 0 1000000 1000000 NA\n")
+        old_rbdir, Globals.rbdir = Globals.rbdir, rbdir
+        try:
+            Rdiff.load_change_history(10000)
+            default = Rdiff.find_blocksize(1000000)
+            assert Rdiff.find_blocksize(1000000, (b"logs", b"app.log")) \
+                < default
+            assert Rdiff.find_blocksize(1000000, (b"logs", b"app\nlog")) \
+                < default
+            assert Rdiff.find_blocksize(1000000, (b"data", b"archive.zip")) \
+                > default
+            for index in [(b"data", b"table.db"), (b"data", b"unchanged"),
+                          (b"new", )]:
+                assert Rdiff.find_blocksize(1000000, index) == default
+            assert Rdiff.find_blocksize(1000, (b"logs", b"app.log")) == 64
+        finally:
+            Globals.rbdir = old_rbdir
+            Rdiff._change_history = None
+
+    def testSkipSignature(self):
+        """Rewritten and compressed files are sent without signature"""
+        Rdiff._change_history = {(b"enc.img", ): Rdiff.WHOLLY_REWRITTEN,
+                                 (b"db", ): Rdiff.REWRITTEN}
+        old_regexp = Globals.no_compression_regexp
+        Globals.no_compression_regexp = re.compile(
+            Globals.no_compression_regexp_string)
+        try:
+            for name, skip in [(b"enc.img", 1), (b"db", 0),
+                               (b"photo.JPG", 1), (b"notes.txt", 0)]:
+                rp = self.output.append(name)
+                assert bool(Rdiff.skip_signature(rp)) == bool(skip), name
+        finally:
+            Rdiff._change_history = None
+            Globals.no_compression_regexp = old_regexp
+
 
 if __name__ == '__main__':
     unittest.main()
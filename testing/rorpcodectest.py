@@ -0,0 +1,53 @@
+import unittest
+import os
+import pickle
+from commontest import old_test_dir
+from rdiff_backup import rorpcodec, rpath, Globals, eas_acls
+
+
+class RorpCodecTest(unittest.TestCase):
+    """Test the compact encoding of RORPaths"""
+
+    def check(self, index, data):
+        """Assert that index and data are encoded and decoded unchanged"""
+        encoded = rorpcodec.encode(index, data)
+        assert rorpcodec.decode(encoded) == (index, data), (index, data)
+        assert rorpcodec.decode(memoryview(encoded)) == (index, data)
+        return encoded
+
+    def testRealFiles(self):
+        """Encode the data dictionaries of files of various types"""
+        vft = rpath.RPath(Globals.local_connection,
+                          os.path.join(old_test_dir, b"various_file_types"))
+        for rp in [vft] + [vft.append(x) for x in vft.listdir()]:
+            self.check(rp.index, rp.data)
+
+    def testUnusualValues(self):
+        """Values of unexpected types fall back to pickling"""
+        self.check((), {'type': None})
+        self.check((b"a", b"b"), {})
+        self.check((b"a", ), {'type': 'reg', 'uname': None, 'gname': 'g'})
+        self.check((b"a", ), {'type': 'reg', 'inode': 2**64 - 1})
+        self.check((b"a", ), {'type': 'reg', 'uid': None, 'uname': 5})
+        self.check((b"a", ), {'type': 'other', 'linkname': 'not bytes'})
+        self.check((b"a", ), {
+            'type': 'reg',
+            'size': 3,
+            'ea': eas_acls.ExtendedAttributes((b"a", ))
+        })
+
+    def testSize(self):
+        """The encoding is smaller than the pickle it replaces"""
+        data = {
+            'type': 'reg', 'size': 1234, 'perms': 0o644, 'uid': 1000,
+            'gid': 1000, 'uname': 'user', 'gname': 'user', 'mtime': 10000,
+            'atime': 10000, 'ctime': 10000, 'inode': 123456, 'devloc': 2049,
+            'nlink': 1
+        }
+        index = (b"home", b"user", b"file")
+        encoded = self.check(index, data)
+        assert len(encoded) < len(pickle.dumps((index, data), 1)) / 2
+
+
+if __name__ == "__main__":
+    unittest.main()
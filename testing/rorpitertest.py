@@ -1,8 +1,9 @@
 import unittest
 import pickle
 import os
+import io
 from commontest import old_test_dir, abs_output_dir, CompareRecursive, iter_equal
-from rdiff_backup import rpath, rorpiter, Globals
+from rdiff_backup import rpath, rorpiter, iterfile, Globals
 from functools import reduce
 
 
@@ -51,6 +52,22 @@ class RORPIterTest(unittest.TestCase):
         assert iter_equal(iter([(i, None) for i in indicies]),
                           rorpiter.CollateIterators(makeiter1(), iter([])))
 
+    def testCollateManyIterators(self):
+        """Collate many iterators, some giving the same index twice"""
+        indicies = list(map(index, range(100)))
+        iters = [iter(indicies[i::7]) for i in range(7)]
+        iters.append(iter([indicies[5], indicies[5], indicies[60]]))
+        iters.append(iter([]))
+        outlist = list(rorpiter.CollateIterators(*iters))
+        assert len(outlist) == 101, len(outlist)
+        for i in range(100):
+            out = outlist[i + (i > 5)]
+            assert out.index == i, (out.index, i)
+            assert out[i % 7] is indicies[i]
+            assert out[7] is (i in (5, 60) and indicies[i] or None)
+            assert out[8] is None
+        assert outlist[6] == (None, ) * 7 + (indicies[5], None)
+
     def compare_no_times(self, src_rp, dest_rp):
         """Compare but disregard directories attributes"""
 
@@ -235,5 +252,92 @@ class CacheIndexableTest(unittest.TestCase):
         assert l1 == l2, (l1, l2)
 
 
+class PrefetchFilesTest(unittest.TestCase):
+    def get_rorps(self):
+        """Return list of rorps with attached files, and a flush marker"""
+        rorps = []
+        for i in range(20):
+            rorp = rpath.RORPath((b"file%02d" % i, ))
+            rorp.setfile(io.BytesIO(rorp.index[0] * 1000))
+            rorps.append(rorp)
+        rorps.insert(7, iterfile.MiscIterFlushRepeat)
+        rorps.insert(9, rpath.RORPath((b"file07a", )))  # no file attached
+        return rorps
+
+    def testOrder(self):
+        """Elements come out in order, with the file data unchanged"""
+        in_list = self.get_rorps()
+        out_list = list(rorpiter.PrefetchFiles(iter(in_list), 4))
+        assert out_list == in_list, out_list
+        for rorp in out_list:
+            if rorp is iterfile.MiscIterFlushRepeat or not rorp.file:
+                continue
+            assert isinstance(rorp.file, rorpiter.PrefetchedFile)
+            assert rorp.file.read() == rorp.index[0] * 1000
+
+    def testFlush(self):
+        """A flush marker is passed on without reading further input"""
+        in_list = self.get_rorps()
+        pulled = []
+
+        def in_iter():
+            for elem in in_list:
+                pulled.append(elem)
+                yield elem
+
+        out_iter = rorpiter.PrefetchFiles(in_iter(), 8)
+        for i in range(7):
+            assert next(out_iter) is in_list[i]
+        assert next(out_iter) is iterfile.MiscIterFlushRepeat
+        assert len(pulled) == 8, len(pulled)
+
+    def testMaxBytes(self):
+        """Files above max_bytes are left alone, the rest stay below it"""
+
+        rorps = []
+        for size in (300, 300, 5000, 300, 300, 300):
+            rorp = rpath.RORPath((b"file%05d" % len(rorps), ),
+                                 {'type': 'reg', 'size': size})
+            rorp.setfile(io.BytesIO(b"x" * size))
+            rorps.append(rorp)
+
+        out_list = list(rorpiter.PrefetchFiles(iter(rorps), 8, 1000))
+        assert out_list == rorps
+        assert not isinstance(out_list[2].file, rorpiter.PrefetchedFile)
+        assert out_list[2].file.read() == b"x" * 5000
+        for i in (0, 1, 3, 4, 5):
+            assert isinstance(out_list[i].file, rorpiter.PrefetchedFile)
+            assert out_list[i].file.read() == b"x" * 300
+
+    def testReadError(self):
+        """Exceptions while reading are raised when the file is read"""
+
+        class BadFile:
+            def read(self, length=-1):
+                raise IOError("bad file")
+
+            def close(self):
+                pass
+
+        rorp = rpath.RORPath((b"bad", ))
+        rorp.setfile(BadFile())
+        out_rorp, = rorpiter.PrefetchFiles(iter([rorp]), 2)
+        self.assertRaises(IOError, out_rorp.file.read)
+
+    def testCloseValue(self):
+        """The close value of the original file is kept"""
+
+        class HashFile(io.BytesIO):
+            def close(self):
+                io.BytesIO.close(self)
+                return "close value"
+
+        rorp = rpath.RORPath((b"hashed", ))
+        rorp.setfile(HashFile(b"abc"))
+        out_rorp, = rorpiter.PrefetchFiles(iter([rorp]), 2)
+        assert out_rorp.file.read() == b"abc"
+        assert out_rorp.file.close() == "close value"
+
+
 if __name__ == "__main__":
     unittest.main()
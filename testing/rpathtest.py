@@ -27,6 +27,57 @@ class RORPStateTest(RPathTest):
         assert rorp2.isreg()
         assert rorp2.data == rorp.data and rorp.index == rorp2.index
 
+    def testSlots(self):
+        """RORPaths and RPaths have no instance dictionary"""
+        rp = rpath.RPath(self.lc, self.prefix, ("regular_file", ))
+        rorp = rp.getRORPath()
+        for obj in (rp, rorp):
+            assert not hasattr(obj, "__dict__"), obj
+            self.assertRaises(AttributeError, setattr, obj, "foo", 1)
+        rp2 = pickle.loads(pickle.dumps(rp, 4))
+        assert rp2.path == rp.path and rp2.data == rp.data
+        assert rp2.conn is rp.conn
+
+    def testStatData(self):
+        """The data of RORPaths is a StatData acting like a dictionary"""
+        rp = rpath.RPath(self.lc, self.prefix, ("regular_file", ))
+        assert isinstance(rp.data, rpath.StatData), rp.data
+        assert not hasattr(rp.data, "__dict__")
+        assert rp.data.extra is None, rp.data.extra
+        data = dict(rp.data)
+        assert data['type'] == 'reg' and 'size' in data, data
+        assert rp.data == data and data == rp.data
+
+        rorp = rpath.RORPath(("foo", ), {'type': 'reg', 'size': 3, 'ea': 1})
+        assert isinstance(rorp.data, rpath.StatData)
+        assert rorp.data.extra == {'ea': 1}, rorp.data.extra
+        assert rorp.data['size'] == 3 and rorp.data.get('perms') is None
+        assert 'perms' not in rorp.data and 'ea' in rorp.data
+        assert rorp.isreg() and rorp.getsize() == 3 and rorp.getperms() == 0
+        assert rorp.data.get_items() == [('type', 'reg'), ('size', 3),
+                                         ('ea', 1)], rorp.data.get_items()
+        rorp.data['mirrorname'] = b"bar"
+        del rorp.data['size']
+        self.assertRaises(KeyError, rorp.data.__getitem__, 'size')
+        assert list(rorp.data) == ['type', 'ea', 'mirrorname'], rorp.data
+        rorp2 = pickle.loads(pickle.dumps(rorp))
+        assert type(rorp2.data) is rpath.StatData
+        assert rorp2.data == rorp.data and rorp2 == rorp
+
+    def testIndexInterner(self):
+        """Interned indicies are equal and share leading components"""
+        interner = rpath.IndexInterner()
+        paths = [b"usr/share/doc/a", b"usr/share/doc/b", b"usr/share/doc",
+                 b"usr/share/man", b"var", b"var/log"]
+        indicies = [interner.intern(tuple(path.split(b"/")))
+                    for path in paths]
+        assert indicies == [tuple(path.split(b"/")) for path in paths]
+        for i in range(1, 4):
+            assert indicies[i][0] is indicies[0][0]
+            assert indicies[i][1] is indicies[0][1]
+        assert interner.intern((b"var", b"log")) is indicies[5]
+        assert indicies[5][0] is indicies[4][0]
+
 
 class CheckTypes(RPathTest):
     """Check to see if file types are identified correctly"""
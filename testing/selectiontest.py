@@ -230,6 +230,30 @@ rdiff-backup_testfiles/select/1/1
         self.assertRaises(FilePrefixError, self.Select.glob_get_sf,
                           b"ignorecase:tesfiles/sect/foo/bar", 1)
 
+    def testCompiledGlobs(self):
+        """Consecutive globs compiled together give the same results"""
+        globs = [("rdiff-backup_testfiles/select/1/1", 1),
+                 ("rdiff-backup_testfiles/select/1/**.py", 0),
+                 ("ignorecase:rdiff-backup_testfiles/select/2/FOO", 1),
+                 ("rdiff-backup_testfiles/select/[12]/*/bar", 1),
+                 ("rdiff-backup_testfiles/select/2", 0),
+                 ("**/baz", 1), ("**", 0)]
+        sfs = [self.Select.glob_get_sf(glob, include)
+               for glob, include in globs]
+        self.Select.selection_functions = sfs[:]
+        self.Select.compile_selection_functions()
+        assert len(self.Select.selection_functions) == 1
+        sf = self.Select.selection_functions[0]
+
+        # 2/x and 1/2 are scanned by one glob and decided by a later one
+        for path in ("1", "1/1", "1/1/foo.py", "1/2", "1/2/foo.py",
+                     "1/2/bar", "2", "2/x", "2/foo", "2/x/bar", "2/baz",
+                     "3/baz", "3/q"):
+            rp = self.makeext(path)
+            expected = Select.run_selection_functions(sfs, rp)
+            assert self.Select.Select(rp) == expected, \
+                (path, self.Select.Select(rp), expected)
+
     def testDev(self):
         """Test device and special file selection"""
         dir = self.root.append("filetypes")
@@ -331,6 +355,93 @@ class ParseArgsTest(unittest.TestCase):
                           map(tuple_fsencode, indicies),
                           verbose=1)
 
+    def testExcludedNotStated(self):
+        """Files excluded by name keep data without stat information"""
+        self.ParseTest([("--include", "rdiff-backup_testfiles/select/1/1"),
+                        ("--exclude", "**")],
+                       [(), ('1', ), ("1", "1"), ("1", '1', '1'),
+                        ('1', '1', '2'), ('1', '1', '3')])
+        dir_rps = list(self.Select.dir_rpaths(self.root, None))
+        indicies = [rp.index for rp in dir_rps]
+        assert (b'1', ) in indicies and indicies == sorted(indicies)
+        for rp in dir_rps:
+            assert isinstance(rp.data, rpath.EntryData)
+            assert list(rp.data.keys()) == ['type']
+            rp.complete_data()
+            assert not isinstance(rp.data, rpath.EntryData)
+            assert rp.data == self.root.append(rp.index[0]).data
+
+    def testIteratedStated(self):
+        """Files yielded by the iterator have their full data"""
+        select = Select(rpath.RPath(Globals.local_connection,
+                                    "rdiff-backup_testfiles/select"))
+        select.ParseArgs([("--include", "rdiff-backup_testfiles/select/1"),
+                          ("--exclude", "**")], [])
+        rps = list(select.set_iter())
+        assert len(rps) > 10, rps
+        for rp in rps:
+            assert not isinstance(rp.data, rpath.EntryData), rp.index
+            assert rp.data == rpath.RPath(Globals.local_connection,
+                                          rp.path).data, rp.index
+
+    def testReadahead(self):
+        """Reading directories ahead yields files in the same order"""
+        filelist = b"""rdiff-backup_testfiles/select/1/2
+rdiff-backup_testfiles/select/3/1/1
+"""
+
+        def get_select(args):
+            select = Select(rpath.RPath(Globals.local_connection,
+                                        "rdiff-backup_testfiles/select"))
+            select.ParseArgs(args, [io.BytesIO(filelist)])
+            return select
+
+        def get_indicies(args):
+            return [rp.index for rp in get_select(args).set_iter()]
+
+        # Without filelists the directories are read ahead
+        args = [("--exclude", "rdiff-backup_testfiles/select/1/1/1"),
+                ("--include", "rdiff-backup_testfiles/select/1"),
+                ("--include", "rdiff-backup_testfiles/select/2/*/2"),
+                ("--exclude", "**")]
+        indicies = get_indicies(args)
+        assert len(indicies) > 10, indicies
+        assert (b"1", b"1", b"2") in indicies, indicies
+        assert (b"1", b"1", b"1") not in indicies, indicies
+        assert (b"3", b"1", b"1") not in indicies, indicies
+        Globals.readahead_threads, Globals.readahead_width = 4, 2
+        try:
+            select = get_select(args)
+            assert select.get_readahead(select.rpath, select.Select,
+                                        None) is not None
+            assert get_indicies(args) == indicies
+        finally:
+            Globals.readahead_threads, Globals.readahead_width = 1, 16
+
+        # An include filelist ahead of the final exclude still selects
+        # its files, as reading ahead is turned off for it
+        args = args[:-1] + [("--include-filelist", "list"),
+                            ("--exclude", "**")]
+        indicies = get_indicies(args)
+        assert (b"1", b"1", b"2") in indicies, indicies
+        assert (b"3", b"1", b"1") in indicies, indicies
+        Globals.readahead_threads, Globals.readahead_width = 4, 2
+        try:
+            select = get_select(args)
+            assert select.get_readahead(select.rpath, select.Select,
+                                        None) is None
+            assert get_indicies(args) == indicies
+        finally:
+            Globals.readahead_threads, Globals.readahead_width = 1, 16
+
+        select = get_select([("--exclude-filelist", "list")])
+        Globals.readahead_threads = 4
+        try:
+            assert select.get_readahead(select.rpath, select.Select,
+                                        None) is None
+        finally:
+            Globals.readahead_threads = 1
+
     def remake_filelists(self, filelist):
         """Turn strings in filelist into fileobjs"""
         new_filelists = []
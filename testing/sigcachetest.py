@@ -0,0 +1,89 @@
+import unittest
+import os
+from commontest import abs_output_dir, MakeOutputDir
+from rdiff_backup import Globals, Rdiff, rpath, sigcache
+
+
+class SigCacheTest(unittest.TestCase):
+    """Test the cache of mirror file signatures"""
+
+    def setUp(self):
+        self.output = MakeOutputDir()
+        Globals.rbdir = self.output.append("rdiff-backup-data")
+        Globals.rbdir.mkdir()
+        sigcache._cache_rp = None
+        self.mirror = self.output.append("mirror_file")
+        self.new = self.output.append("new_file")
+        self.old_min_size = Globals.signature_cache_min_size
+        Globals.signature_cache_min_size = 1000
+
+    def tearDown(self):
+        Globals.signature_cache_min_size = self.old_min_size
+
+    def write_new(self, data):
+        """Write data to self.new, and set its mtime"""
+        self.new.write_bytes(data)
+        os.utime(self.new.path, (10000, 10000))
+        self.new.setdata()
+
+    def update(self):
+        """Cache signature of self.new for self.mirror, like PatchITRB"""
+        diff_rorp = rpath.RORPath(self.mirror.index, self.new.data.copy())
+        sig_gen = sigcache.get_sig_generator(diff_rorp)
+        if sig_gen:
+            fp = Rdiff.SigWrapper(self.new.open("rb"), sig_gen)
+            while fp.read(1000):
+                pass
+            fp.close()
+        sigcache.update(self.mirror.index, self.new, sig_gen)
+
+    def get_sig_string(self, rp):
+        """Return signature of rp as computed without cache"""
+        sig_fp = Rdiff.get_signature(rp)
+        sig_string = sig_fp.read()
+        sig_fp.close()
+        return sig_string
+
+    def testCachedSig(self):
+        """The cached signature is used as long as the mirror is unchanged"""
+        self.write_new(b"abcdef" * 1000)
+        real_sig = self.get_sig_string(self.new)
+        self.update()
+        assert sigcache.get_entry_rp(self.mirror.index).lstat()
+        assert sigcache.get_signature_fp(self.new) is None  # other index
+
+        rpath.rename(self.new, self.mirror)
+        self.mirror.setdata()
+        sig_fp = sigcache.get_signature_fp(self.mirror)
+        assert sig_fp.read() == real_sig
+        sig_fp.close()
+
+    def testStaleSig(self):
+        """A signature whose mirror file was changed is removed"""
+        self.write_new(b"abcdef" * 1000)
+        self.update()
+        rpath.rename(self.new, self.mirror)
+        self.mirror.write_bytes(b"ghijkl" * 2000)
+        self.mirror.setdata()
+        assert sigcache.get_signature_fp(self.mirror) is None
+        assert not sigcache.get_entry_rp(self.mirror.index).lstat()
+
+    def testSmallFile(self):
+        """Small files are not cached, and their old entry is removed"""
+        self.write_new(b"abcdef" * 1000)
+        self.update()
+        self.write_new(b"abc")
+        self.update()
+        assert not sigcache.get_entry_rp(self.mirror.index).lstat()
+
+    def testRemove(self):
+        """The entry of a mirror file which goes away can be removed"""
+        self.write_new(b"abcdef" * 1000)
+        self.update()
+        sigcache.remove(self.mirror.index)
+        assert not sigcache.get_entry_rp(self.mirror.index).lstat()
+        sigcache.remove(self.mirror.index)  # no entry left is fine
+
+
+if __name__ == "__main__":
+    unittest.main()
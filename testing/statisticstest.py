@@ -110,6 +110,28 @@ TotalDestinationSizeChange 7 (7 bytes)
         s2.set_stats_from_string(s1.get_stats_string())
         assert s1.stats_equal(s2)
 
+    def test_misc_stats(self):
+        """Wire, hard link and signature statistics are read back"""
+        s1 = statistics.StatsObj()
+        self.set_obj(s1)
+        s1.WireBytes, s1.WireCompressedBytes = 3000, 1000
+        s1.HardLinkEntries, s1.HardLinkMemory = 20, 2048
+        s1.SkippedSignatures = 5
+        stats_string = s1.get_stats_string()
+        assert "WireCompressedBytes 1000 (1000 bytes, ratio 3.00)\n" in \
+            stats_string, stats_string
+        assert "HardLinkMemory 2048 (2.00 KB)\n" in stats_string
+        assert "SkippedSignatures 5\n" in stats_string
+
+        s2 = statistics.StatsObj().set_stats_from_string(stats_string)
+        for attr in s1.stat_misc_attrs:
+            assert s2.get_stat(attr) == s1.get_stat(attr), attr
+
+        s3 = statistics.StatFileObj()
+        assert "SkippedSignatures" not in s3.get_stats_string()
+        s3.add_skipped_signature()
+        assert "SkippedSignatures 1\n" in s3.get_stats_string()
+
     def test_write_rp(self):
         """Test reading and writing of statistics object"""
         rp = rpath.RPath(Globals.local_connection,
@@ -218,6 +240,20 @@ class IncStatTest(unittest.TestCase):
             root_stats.ChangedMirrorSize
         assert 10 < root_stats.IncrementFileSize < 30000
 
+    def testWireStatistics(self):
+        """Data sent to a remote destination is in session_statistics"""
+        Myrm(abs_output_dir)
+        InternalBackup(1, 0, os.path.join(old_test_dir, b"stattest1"),
+                       abs_output_dir)
+        rbdir = rpath.RPath(Globals.local_connection,
+                            os.path.join(abs_output_dir, b"rdiff-backup-data"))
+        incs = restore.get_inclist(rbdir.append("session_statistics"))
+        assert len(incs) == 1
+        s = statistics.StatsObj().read_stats_from_rp(incs[0])
+        assert s.WireBytes > 700000, s.WireBytes
+        assert 0 < s.WireCompressedBytes <= s.WireBytes, \
+            s.WireCompressedBytes
+
 
 if __name__ == "__main__":
     unittest.main()